@@ -4,8 +4,16 @@
 import os.path
 from math import radians
 import bpy, mathutils
+try:
+    import numpy
+except ImportError:
+    # Without NumPy, meshes are built from lists and textures are loaded
+    # by Blender, the same as valkyria falls back.
+    numpy = None
 from bpy_extras.io_utils import ImportHelper
 from . import valkyria
+# Not imported by valkyria itself, so it can also run as a script.
+from .valkyria import texture_cache
 
 bl_info = {
         "name": "Valkyria Chronicles (.MLX, .HMD, .ABR, .MXE)",
@@ -27,6 +35,67 @@ def make_transform_matrix(loc,rot,scale):
     return mat_loc * mat_rot * mat_scale
 
 
+def open_valk_file(filename, archive=None, pool=None):
+    # Opens a loose file, or a member of an already opened archive. Files
+    # opened through a valkyria.files.SourcePool are shared and closed
+    # along with it.
+    if pool is not None:
+        return pool.open(filename, archive)[0]
+    if archive is not None:
+        return valkyria.files.valk_open(archive.open(filename))[0]
+    return valkyria.files.valk_open(filename)[0]
+
+def set_image_pixels(image, pixels):
+    # pixels is a flat float array
+    if hasattr(image.pixels, 'foreach_set'):
+        image.pixels.foreach_set(pixels)
+    else:
+        image.pixels[:] = pixels.tolist()
+
+def pack_generated_image(image):
+    try:
+        image.pack(as_png=True)
+    except TypeError:
+        # Blender 2.8 and later pack generated images as PNG by themselves.
+        image.pack()
+
+def build_images(images, max_workers=None):
+    # Textures are decoded on a pool of threads (NumPy releases the GIL);
+    # only creating the Blender images happens here on the main thread, as
+    # each decoded texture comes in.
+    if max_workers is None:
+        max_workers = HTSF_Image.decode_workers
+    for image in valkyria.files.imap_threads(HTSF_Image.decode, images, max_workers):
+        image.build_blender()
+
+
+def flat_list(rows, dtype):
+    # Rows of numbers as the flat sequence foreach_set expects.
+    if numpy is not None:
+        return numpy.asarray(rows, dtype=dtype).ravel()
+    return [value for row in rows for value in row]
+
+def group_by_weight(vertex_ids, weights):
+    # Yields (vertex_id_list, weight) pairs so that each distinct weight
+    # only needs a single VertexGroup.add call.
+    if numpy is None:
+        by_weight = {}
+        for vertex_id, weight in zip(vertex_ids, weights):
+            by_weight.setdefault(weight, []).append(vertex_id)
+        for weight in sorted(by_weight):
+            yield by_weight[weight], float(weight)
+        return
+    order = numpy.argsort(weights, kind='stable')
+    sorted_ids = vertex_ids[order]
+    sorted_weights = weights[order]
+    bounds = numpy.flatnonzero(sorted_weights[1:] != sorted_weights[:-1]) + 1
+    starts = [0] + bounds.tolist()
+    ends = bounds.tolist() + [len(sorted_ids)]
+    for start, end in zip(starts, ends):
+        if start < end:
+            yield sorted_ids[start:end].tolist(), float(sorted_weights[start])
+
+
 class Texture_Pack:
     def __init__(self):
         self.htsf_images = []
@@ -39,8 +108,7 @@ class Texture_Pack:
         return image
 
     def build_blender(self):
-        for image in self.htsf_images:
-            image.build_blender()
+        build_images(self.htsf_images)
         self.blender_built = True
 
 
@@ -51,75 +119,108 @@ class HTEX_Pack:
         self.htsf_images = []
         self.blender_built = False
 
+    @classmethod
+    def from_data(cls, dds_data_list, htex_id):
+        # Builds a pack from DDS data that was already read, e.g. by
+        # valkyria.scheduler.
+        pack = cls(None, htex_id)
+        for dds_data in dds_data_list:
+            pack.append_image(HTSF_Image.from_data(dds_data))
+        return pack
+
     def add_image(self, htsf):
+        return self.append_image(HTSF_Image(htsf))
+
+    def append_image(self, image):
         htsf_id = len(self.htsf_images)
-        image = HTSF_Image(htsf)
         image.filename = "HTEX-{:03}-HTSF-{:03}.dds".format(self.htex_id, htsf_id)
         self.htsf_images.append(image)
         return image
 
     def read_data(self):
-        for htsf in self.F.HTSF:
-            image = self.add_image(htsf)
-            image.read_data()
+        images = [self.add_image(htsf) for htsf in self.F.HTSF]
+        valkyria.files.map_threads(HTSF_Image.read_data, images)
 
     def build_blender(self):
-        for image in self.htsf_images:
-            image.build_blender()
+        build_images(self.htsf_images)
         self.blender_built = True
 
 
 class HTSF_Image:
+    # Threads used to decode textures, see build_images(). None for
+    # valkyria.files.DECODE_THREADS.
+    decode_workers = None
+    # Proxy textures: the mip level to use, and the longest side allowed.
+    # Smaller mip levels are used where the texture has them.
+    mip_level = 0
+    max_size = None
+
     def __init__(self, source_file):
         self.F = source_file
-        assert len(self.F.DDS) == 1
-        self.dds = self.F.DDS[0]
+        self.dds = None
+        if source_file is not None:
+            assert len(self.F.DDS) == 1
+            self.dds = self.F.DDS[0]
         self.dds_data = None
+        self.decoded = False
+        self.pixels = None
+
+    @classmethod
+    def from_data(cls, dds_data):
+        image = cls(None)
+        image.dds_data = dds_data
+        return image
 
     def write_tmp_dds(self, dds_path):
         tmp_dds = open(dds_path, 'wb')
-        tmp_dds.write(self.dds.data)
+        tmp_dds.write(self.dds_data)
         tmp_dds.close()
 
-    def convert_dds_to_png(self, dds_path):
-        from bpy_extras.image_utils import load_image
-        import platform
-        import pathlib
-        import subprocess
-        png_path = dds_path[0:-4] + '.png'
-        home = pathlib.Path.home()
-        current_os = platform.system()
-        if current_os == 'Linux':
-            converter = home / 'Compressonator' / 'CompressonatorCLI'
-            command = ['sh', str(converter), '-fs', 'BC7', dds_path, png_path]
-        if current_os == 'Darwin':
-            converter = home / 'Compressonator' / 'CompressonatorCLI.sh'
-            command = ['sh', str(converter), '-fs', 'BC7', dds_path, png_path]
-        if current_os == 'Windows':
-            converter = home / 'texconv' / 'texconv.exe'
-            dds_folder = pathlib.Path(dds_path).parent
-            command = [str(converter), '-ft', 'png', '-o', str(dds_folder), dds_path]
-            png_path = dds_path[0:-4] + '.PNG'
-        subprocess.run(command)
-        self.image = load_image(png_path)
-        self.image.pack()
-        os.remove(png_path)
+    def decode(self):
+        # Decodes the texture into Blender's pixel layout, if it can be
+        # decoded in memory. Doesn't touch bpy, so it can run on any thread.
+        header = valkyria.dds.read_header(self.dds_data)
+        level = header.choose_level(self.mip_level, self.max_size)
+        if valkyria.dds.can_decode(header):
+            pixels = valkyria.texture_cache.decode(self.dds_data, header, level)
+            if self.max_size:
+                pixels = valkyria.dds.downsample(pixels, self.max_size)
+            self.size = (pixels.shape[1], pixels.shape[0])
+            # Blender stores rows bottom to top, as floats.
+            self.pixels = numpy.multiply(pixels[::-1].reshape(-1), 1 / 255, dtype=numpy.float32)
+        elif level:
+            # Blender loads only the chosen mip level.
+            self.dds_data = valkyria.dds.extract_level(self.dds_data, header, level)
+        self.decoded = True
+        return self
 
     def build_blender(self):
+        if not self.decoded:
+            self.decode()
+        if self.pixels is not None:
+            self.build_from_pixels()
+        else:
+            self.build_from_dds_file()
+
+    def build_from_pixels(self):
+        width, height = self.size
+        self.image = bpy.data.images.new(self.filename, width, height, alpha=True)
+        set_image_pixels(self.image, self.pixels)
+        pack_generated_image(self.image)
+        self.pixels = None
+
+    def build_from_dds_file(self):
         from bpy_extras.image_utils import load_image
         tempdir = bpy.app.tempdir
         dds_path = os.path.join(tempdir, self.filename)
         self.write_tmp_dds(dds_path)
         self.image = load_image(dds_path)
-        supported = self.image.size[0] > 0 or self.image.size[1] > 0
         self.image.pack()
-        if not supported:
-            # DDS file is probably BC7, which Blender doesn't support yet.
-            self.convert_dds_to_png(dds_path)
         os.remove(dds_path)
 
     def read_data(self):
         self.dds.read_data()
+        self.dds_data = self.dds.data
 
 
 class MXTL_List:
@@ -297,11 +398,20 @@ class ABRS_Model:
 
 class MXEN_Model:
     # TODO: EV_OBJ_026.MXE causes vertex group error
+    # Processes used to parse the map's model and texture files, see
+    # valkyria.scheduler.
+    max_workers = None
+    # Where the .mmf, .htr and merge.htx files are opened
+    pool = None
+
     def __init__(self, source_file):
         self.F = source_file
         self.texture_packs = []
         self.hmdl_models = []
         self.instances = []
+        self.parsed_files = None
+        self.resolver = valkyria.resolver.FileResolver(
+            os.path.dirname(self.F.filename), self.F.source.archive)
 
     def add_htex(self, htex):
         htex_id = len(self.texture_packs)
@@ -315,37 +425,46 @@ class MXEN_Model:
         self.hmdl_models.append(model)
         return model
 
+    def find_file(self, filename):
+        return self.resolver.resolve(filename)
+
     def open_file(self, filename):
-        path = os.path.dirname(self.F.filename)
-        possible_files = []
-        possible_files.append(os.path.join(path, filename))
-        possible_files.append(os.path.join(path, filename.lower()))
-        possible_files.append(os.path.join(path, filename.upper()))
-        possible_files.append(os.path.join(path, '..', 'resource', 'mx', filename.lower()))
-        possible_files.append(os.path.join(path, '..', 'resource', 'mx', filename.upper()))
-        opened_file = None
-        for model_filepath in possible_files:
-            try:
-                opened_file = valkyria.files.valk_open(model_filepath)[0]
-            except FileNotFoundError:
-                pass
-        if opened_file is None:
-            raise FileNotFoundError(filename)
-        return opened_file
+        return open_valk_file(self.find_file(filename), self.F.source.archive, self.pool)
+
+    def parse_files(self, mxec):
+        # Models and textures in their own files are independent of each
+        # other, so they're all parsed up front by a pool of workers.
+        archive = self.F.source.archive
+        jobs = []
+        for mxec_model in mxec.models:
+            if not "model_file" in mxec_model:
+                continue
+            for job_type, file_desc in (("model", mxec_model["model_file"]), ("texture", mxec_model["texture_file"])):
+                if file_desc["is_inside"] != 0:
+                    continue
+                filename = self.find_file(file_desc["filename"])
+                job = (job_type, filename, valkyria.scheduler.member_location(archive, filename))
+                if job not in jobs:
+                    jobs.append(job)
+        # Released once the Blender objects have been built from them.
+        self.parsed_files = valkyria.scheduler.parse_files(jobs, self.max_workers)
+        parsed = {}
+        for (job_type, filename, location), result in zip(jobs, self.parsed_files):
+            parsed[job_type, filename] = result
+        return parsed
 
     def read_data(self):
         mxec = self.F.MXEC[0]
         mxec.read_data()
         if hasattr(mxec, "mmf_file"):
             mmf = self.open_file(mxec.mmf_file["filename"])
-            mmf.find_inner_files()
             mmf.read_data()
         if hasattr(mxec, "htr_file"):
             htr = self.open_file(mxec.htr_file["filename"])
             htr.read_data()
         if hasattr(mxec, "merge_htx_file"):
             merge_htx = self.open_file(mxec.merge_htx_file["filename"])
-            merge_htx.find_inner_files()
+        parsed = self.parse_files(mxec)
         model_cache = {}
         texture_cache = {}
         for mxec_model in mxec.models:
@@ -356,10 +475,9 @@ class MXEN_Model:
             model = model_cache.get(model_file_desc["filename"], None)
             if model is None:
                 if model_file_desc["is_inside"] == 0:
-                    hmd = self.open_file(model_file_desc["filename"])
-                    hmd.find_inner_files()
-                    model = self.add_model(hmd)
-                    model.read_data()
+                    model_data = parsed["model", self.find_file(model_file_desc["filename"])]
+                    model = HMDL_Model.from_data(model_data, len(self.hmdl_models))
+                    self.hmdl_models.append(model)
                 elif model_file_desc["is_inside"] == 0x200:
                     hmd = mmf.named_models[model_file_desc["filename"]]
                     model = self.add_model(hmd)
@@ -377,15 +495,14 @@ class MXEN_Model:
             texture_pack = texture_cache.get(texture_file_desc["filename"])
             if texture_pack is None:
                 if texture_file_desc["is_inside"] == 0:
-                    htx = self.open_file(texture_file_desc["filename"])
-                    htx.find_inner_files()
-                    texture_pack = self.add_htex(htx)
-                    texture_pack.read_data()
+                    dds_data = parsed["texture", self.find_file(texture_file_desc["filename"])]
+                    texture_pack = HTEX_Pack.from_data(dds_data, len(self.texture_packs))
+                    self.texture_packs.append(texture_pack)
                 elif texture_file_desc["is_inside"] == 0x100:
                     texture_pack = Texture_Pack()
                     for htsf_i in htr.texture_packs[texture_file_desc["htr_index"]]["htsf_ids"]:
                         texture_filename = "{}-{:03d}".format(texture_file_desc["filename"], htsf_i)
-                        htsf = texture_pack.add_image(merge_htx.HTSF[htsf_i], texture_filename)
+                        htsf = texture_pack.add_image(merge_htx.get_htsf(htsf_i), texture_filename)
                         htsf.read_data()
                     self.texture_packs.append(texture_pack)
                 texture_cache[texture_file_desc["filename"]] = texture_pack
@@ -393,6 +510,12 @@ class MXEN_Model:
                 self.texture_packs.append(texture_pack)
 
     def build_blender(self):
+        # Decode the textures of every pack the map uses together, rather
+        # than one pack at a time as the models are built.
+        texture_packs = {id(pack): pack for pack in self.texture_packs if not pack.blender_built}
+        build_images([image for pack in texture_packs.values() for image in pack.htsf_images])
+        for texture_pack in texture_packs.values():
+            texture_pack.blender_built = True
         for texture_pack, model, instance_info in zip(self.texture_packs, self.hmdl_models, self.instances):
             if texture_pack.blender_built:
                 pass
@@ -415,6 +538,9 @@ class MXEN_Model:
             instance.rotation_mode = 'XYZ'
             instance.rotation_euler = instance_info[1]
             instance.scale = instance_info[2]
+        if self.parsed_files is not None:
+            self.parsed_files.release()
+            self.parsed_files = None
 
     def finalize_blender(self):
         for model in self.hmdl_models:
@@ -438,6 +564,17 @@ class HMDL_Model:
         self.kfmd_models = []
         self.empty = None
 
+    @classmethod
+    def from_data(cls, model_data_list, model_id):
+        # Builds a model from ValkKFMD.model_data() dicts that were already
+        # read, e.g. by valkyria.scheduler.
+        model = cls(None, model_id)
+        for model_data in model_data_list:
+            kfmd_model = KFMD_Model(None, len(model.kfmd_models))
+            kfmd_model.set_data(model_data)
+            model.kfmd_models.append(kfmd_model)
+        return model
+
     def add_model(self, kfmd):
         model_id = len(self.kfmd_models)
         model = KFMD_Model(kfmd, model_id)
@@ -445,9 +582,8 @@ class HMDL_Model:
         return model
 
     def read_data(self):
-        for kfmd in self.F.KFMD:
-            model = self.add_model(kfmd)
-            model.read_data()
+        models = [self.add_model(kfmd) for kfmd in self.F.KFMD]
+        valkyria.files.map_threads(KFMD_Model.read_data, models)
 
     def build_blender(self):
         self.empty = bpy.data.objects.new("HMDL-{:03d}".format(self.model_id), None)
@@ -474,8 +610,6 @@ class KFMD_Model:
     def __init__(self, source_file, model_id):
         self.F = source_file
         self.model_id = model_id
-        self.kfms = self.F.KFMS[0]
-        self.kfmg = self.F.KFMG[0]
         self.empty = None
         self.oneside = None
 
@@ -525,20 +659,13 @@ class KFMD_Model:
             bpy.context.scene.objects.link(mesh_dict['bpy'])
             mesh_dict["bpy"].parent = self.armature
             # Create vertices
-            mesh.vertices.add(len(mesh_dict['vertices']))
-            vertex_array = []
-            for vertex in mesh_dict["vertices"]:
-                vertex_array.append(vertex["location_x"])
-                vertex_array.append(vertex["location_y"])
-                vertex_array.append(vertex["location_z"])
-            mesh.vertices.foreach_set("co", vertex_array)
+            vertices = mesh_dict["vertices"]
+            mesh.vertices.add(len(vertices))
+            mesh.vertices.foreach_set("co", flat_list(vertices.positions, 'float32'))
             # Create faces
-            face_count = len(mesh_dict["faces"])
-            mesh.tessfaces.add(face_count)
-            face_array = []
-            for face in mesh_dict["faces"]:
-                face_array.extend(face)
-            mesh.tessfaces.foreach_set("vertices_raw", face_array)
+            faces = mesh_dict["faces"]
+            mesh.tessfaces.add(len(faces))
+            mesh.tessfaces.foreach_set("vertices_raw", flat_list(faces, 'int32'))
             mesh.update()
             # Move accessories to proper places
             parent_bone_id = mesh_dict["object"]["parent_bone_id"]
@@ -565,8 +692,9 @@ class KFMD_Model:
                     vgroup = mesh["bpy"].vertex_groups[vgroup_name]
                 else:
                     vgroup = mesh["bpy"].vertex_groups.new(vgroup_name)
-                for vertex_id, weight in vertex_list:
-                    vgroup.add([vertex_id], weight, 'ADD')
+                for vertex_ids, weights in vertex_list:
+                    for id_list, weight in group_by_weight(vertex_ids, weights):
+                        vgroup.add(id_list, weight, 'ADD')
 
     def build_blender(self):
         self.empty = bpy.data.objects.new("KFMD-{:03d}".format(self.model_id), None)
@@ -579,29 +707,43 @@ class KFMD_Model:
     def index_vertex_groups(self):
         # TODO: This function and assign_vertex_groups might be a little
         # excessive. Consider doing this all directly when building the mesh.
+        # Each vertex group maps to a list of (vertex ids, weights) arrays,
+        # one per group slot that refers to it.
         for mesh in self.meshes:
             vertex_groups = {}
-            for i, vertex in enumerate(mesh["vertices"]):
-                if "vertex_group_1" in vertex:
-                    if vertex["vertex_group_1"] not in vertex_groups:
-                        vertex_groups[vertex["vertex_group_1"]] = []
-                    vertex_groups[vertex["vertex_group_1"]].append([i, vertex["vertex_group_weight_1"]])
-                if "vertex_group_2" in vertex:
-                    if vertex["vertex_group_2"] not in vertex_groups:
-                        vertex_groups[vertex["vertex_group_2"]] = []
-                    vertex_groups[vertex["vertex_group_2"]].append([i, vertex["vertex_group_weight_2"]])
-                if "vertex_group_3" in vertex:
-                    if vertex["vertex_group_3"] not in vertex_groups:
-                        vertex_groups[vertex["vertex_group_3"]] = []
-                    vertex_groups[vertex["vertex_group_3"]].append([i, vertex["vertex_group_weight_3"]])
+            vertices = mesh["vertices"]
+            if vertices.groups is not None and vertices.weights is not None and numpy is not None:
+                groups = numpy.asarray(vertices.groups)
+                weights = numpy.asarray(vertices.weights)
+                for slot in range(3):
+                    slot_groups = groups[:, slot]
+                    for local_id in numpy.unique(slot_groups).tolist():
+                        vertex_ids = numpy.flatnonzero(slot_groups == local_id)
+                        if local_id not in vertex_groups:
+                            vertex_groups[local_id] = []
+                        vertex_groups[local_id].append((vertex_ids, weights[vertex_ids, slot]))
+            elif vertices.groups is not None and vertices.weights is not None:
+                for slot in range(3):
+                    slot_vertices = {}
+                    for vertex_id, group_ids in enumerate(vertices.groups):
+                        slot_vertices.setdefault(group_ids[slot], []).append(vertex_id)
+                    for local_id in sorted(slot_vertices):
+                        vertex_ids = slot_vertices[local_id]
+                        if local_id not in vertex_groups:
+                            vertex_groups[local_id] = []
+                        vertex_groups[local_id].append((vertex_ids, [vertices.weights[i][slot] for i in vertex_ids]))
             mesh["vertex_groups"] = vertex_groups
 
     def read_data(self):
         self.F.read_data()
-        self.bones = self.F.bones
-        self.materials = self.F.materials
-        self.meshes = self.F.meshes
-        self.textures = self.F.textures
+        self.set_data(self.F.model_data())
+
+    def set_data(self, model_data):
+        self.vc_game = model_data['vc_game']
+        self.bones = model_data['bones']
+        self.materials = model_data['materials']
+        self.meshes = model_data['meshes']
+        self.textures = model_data['textures']
         self.index_vertex_groups()
 
     def create_oneside(self):
@@ -615,9 +757,9 @@ class KFMD_Model:
         element1.color = (1.0, 1.0, 1.0, 1.0)
 
     def build_materials(self, texture_pack):
-        if self.kfms.vc_game == 1:
+        if self.vc_game == 1:
             self.build_materials_old(texture_pack)
-        elif self.kfms.vc_game == 4:
+        elif self.vc_game == 4:
             self.build_materials_new(texture_pack)
 
     def build_materials_new(self, texture_pack):
@@ -733,8 +875,10 @@ class KFMD_Model:
         for mesh in self.meshes:
             material = self.materials[mesh["object"]["material_ptr"]]["bpy"]
             mesh["bpy"].data.materials.append(material)
-            u = ["u", "u2"]
-            v = ["v", "v2"]
+            vertices = mesh["vertices"]
+            faces = mesh["faces"]
+            if numpy is not None:
+                faces = numpy.asarray(faces, dtype=numpy.int32).reshape(-1, 4)[:, :3]
             for slot_i in range(2):
                 if hasattr(material.texture_slots[slot_i], "texture") and material.texture_slots[slot_i].texture.type == 'IMAGE':
                     uvname = "UVMap-{}".format(slot_i)
@@ -742,14 +886,24 @@ class KFMD_Model:
                     uv_layer = mesh["bpy"].data.uv_layers[uvname]
                     material.texture_slots[slot_i].uv_layer = uvname
                     image = material.texture_slots[slot_i].texture.image
-                    for i, face in enumerate(mesh["faces"]):
-                        if u[slot_i] not in mesh["vertices"][face[0]]:
-                            break
-                        mesh["bpy"].data.polygons[i].use_smooth = 1
-                        uv_layer.data[i*3 + 0].uv = (mesh["vertices"][face[0]][u[slot_i]], mesh["vertices"][face[0]][v[slot_i]] + 1)
-                        uv_layer.data[i*3 + 1].uv = (mesh["vertices"][face[1]][u[slot_i]], mesh["vertices"][face[1]][v[slot_i]] + 1)
-                        uv_layer.data[i*3 + 2].uv = (mesh["vertices"][face[2]][u[slot_i]], mesh["vertices"][face[2]][v[slot_i]] + 1)
-                        uv_texture.data[i].image = image
+                    uvs = vertices.uvs[slot_i]
+                    if uvs is None or not len(faces):
+                        continue
+                    polygons = mesh["bpy"].data.polygons
+                    polygons.foreach_set("use_smooth", [True] * len(faces))
+                    if numpy is not None:
+                        loop_uvs = numpy.asarray(uvs, dtype=numpy.float32)[faces].reshape(-1, 2)
+                        loop_uvs[:, 1] += 1
+                        loop_uvs = loop_uvs.ravel()
+                    else:
+                        loop_uvs = []
+                        for face in faces:
+                            for vertex_id in face[:3]:
+                                u, v = uvs[vertex_id]
+                                loop_uvs += [u, v + 1]
+                    uv_layer.data.foreach_set("uv", loop_uvs)
+                    for face_texture in uv_texture.data:
+                        face_texture.image = image
 
     def build_shape_keys(self, shape_key_set):
         scene = bpy.context.scene
@@ -795,8 +949,11 @@ class KFMD_Model:
         for mesh in self.meshes:
             mesh["bpy"].data.update()
             mesh["bpy"].data.use_auto_smooth = True
-            normals = [(dict_vertex["normal_x"], dict_vertex["normal_y"], dict_vertex["normal_z"]) for dict_vertex in mesh["vertices"]]
-            mesh["bpy"].data.normals_split_custom_set_from_vertices(normals)
+            normals = mesh["vertices"].normals
+            if normals is not None:
+                if numpy is not None:
+                    normals = numpy.asarray(normals, dtype=numpy.float32).tolist()
+                mesh["bpy"].data.normals_split_custom_set_from_vertices(normals)
             if "bpy_dup_base" in mesh:
                 bpy.ops.object.select_all(action='DESELECT')
                 mesh["bpy_dup_base"].select = True
@@ -804,10 +961,11 @@ class KFMD_Model:
 
 
 class ValkyriaScene:
-    def __init__(self, source_file, name):
+    def __init__(self, source_file, name, pool=None):
         self.source_file = source_file
         self.name = os.path.basename(name)
         self.filename = name
+        self.pool = pool
         self.layers_used = 0
 
     def layer_list(self, layer_num):
@@ -848,17 +1006,16 @@ class ValkyriaScene:
     def read_data(self):
         self.source_file.read_data()
         if isinstance(self.source_file, HMDL_Model):
-            possible_files = []
-            possible_files.append(self.filename[0:-4] + '.htx')
-            possible_files.append(self.filename[0:-4] + '.HTX')
+            archive = self.source_file.F.source.archive
+            resolver = valkyria.resolver.FileResolver(os.path.dirname(self.filename), archive, search_dirs=('',))
             htex = None
-            for possible_file in possible_files:
-                try:
-                    htex = valkyria.files.valk_open(possible_file)[0]
-                except FileNotFoundError:
-                    continue
+            try:
+                htex_filename = resolver.resolve(os.path.basename(self.filename)[0:-4] + '.htx')
+            except FileNotFoundError:
+                pass
+            else:
+                htex = open_valk_file(htex_filename, archive, self.pool)
             if htex is not None:
-                htex.find_inner_files()
                 self.hmdl_htex_pack = HTEX_Pack(htex, 0)
                 self.hmdl_htex_pack.read_data()
 
@@ -873,7 +1030,6 @@ class ValkyriaScene:
 
     def pose_blender(self, pose_filename):
         poses = IZCA_Poses(valkyria.files.valk_open(pose_filename)[0])
-        poses.F.find_inner_files()
         poses.read_data()
         poses.pose_model(self.source_file)
 
@@ -883,35 +1039,103 @@ class ImportValkyria(bpy.types.Operator, ImportHelper):
     bl_label = 'Valkyria Chronicles (.MLX, .HMD, .ABR, .MXE)'
     filename_ext = "*.mlx"
     filter_glob = bpy.props.StringProperty(
-            default = "*.mlx;*.hmd;*.abr;*.mxe",
+            default = "*.mlx;*.hmd;*.abr;*.mxe;*.cpk;*.cvm",
             options = {'HIDDEN'},
             )
+    archive_member = bpy.props.StringProperty(
+            name = "Archive member",
+            description = "Path of the model to import when opening a .cpk or .cvm archive",
+            default = "",
+            )
+    worker_count = bpy.props.IntProperty(
+            name = "Worker processes",
+            description = "Processes used to read the files an .mxe map refers to (0 for one per CPU)",
+            default = 0,
+            min = 0,
+            )
+    texture_worker_count = bpy.props.IntProperty(
+            name = "Texture threads",
+            description = "Threads used to decode textures (0 for the default)",
+            default = 0,
+            min = 0,
+            )
+    texture_mip_level = bpy.props.IntProperty(
+            name = "Texture mip level",
+            description = "Mip level of the textures to import, for lower resolution previews (0 for full size)",
+            default = 0,
+            min = 0,
+            )
+    texture_size_limit = bpy.props.IntProperty(
+            name = "Texture size limit",
+            description = "Longest side of imported textures, using smaller mip levels where needed (0 for no limit)",
+            default = 0,
+            min = 0,
+            )
 
     def import_file(self, filename):
-        vfile = valkyria.files.valk_open(filename)[0]
-        vfile.find_inner_files()
-        if vfile.ftype == 'IZCA':
-            model = IZCA_Model(vfile)
-        elif vfile.ftype == 'HMDL':
-            model = HMDL_Model(vfile, 0)
-        elif vfile.ftype == 'ABRS':
-            model = ABRS_Model(vfile)
-        elif vfile.ftype == 'MXEN':
-            model = MXEN_Model(vfile)
-        self.valk_scene = ValkyriaScene(model, filename)
+        archive_types = {
+            '.cpk': valkyria.cpk.CPKArchive,
+            '.cvm': valkyria.cvm.CVMArchive,
+            }
+        archive_type = archive_types.get(os.path.splitext(filename)[1].lower())
+        archive = None
+        # Indexes still being built from the last import would compete with
+        # this one. The files they're for stay pending.
+        valkyria.index.stop_building()
+        if archive_type is not None:
+            if not self.archive_member:
+                self.report({'ERROR'}, 'Enter the path of the model inside the archive in the Archive member field.')
+                return False
+            archive = archive_type(filename)
         try:
-            self.valk_scene.read_data()
-        except FileNotFoundError as e:
-            message = 'This model requires a separate file which could not be found:\n'
-            message += '    ' + str(e)
-            message += '\nTry finding the file manually and copying it into the same folder as the model you attempted to open.'
-            self.report({'ERROR'}, message)
-        self.valk_scene.build_blender()
-        #pose_filename = os.path.join(os.path.dirname(filename), "VALCA02AD.MLX")
-        #self.valk_scene.pose_blender(pose_filename)
+            if archive is not None:
+                try:
+                    archive.find(self.archive_member)
+                except FileNotFoundError:
+                    self.report({'ERROR'}, 'The archive does not contain ' + self.archive_member)
+                    return False
+                filename = self.archive_member
+            self.import_model(filename, archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        # Index the files that were read without a chunk index, so importing
+        # them again is quicker. Done after the import to keep it fast.
+        valkyria.index.start_building()
+        return True
+
+    def import_model(self, filename, archive):
+        HTSF_Image.decode_workers = self.texture_worker_count or None
+        HTSF_Image.mip_level = self.texture_mip_level
+        HTSF_Image.max_size = self.texture_size_limit or None
+        # Every file the import opens is closed once the scene is built.
+        with valkyria.files.SourcePool() as pool:
+            vfile = open_valk_file(filename, archive, pool)
+            if vfile.ftype == 'IZCA':
+                model = IZCA_Model(vfile)
+            elif vfile.ftype == 'HMDL':
+                model = HMDL_Model(vfile, 0)
+            elif vfile.ftype == 'ABRS':
+                model = ABRS_Model(vfile)
+            elif vfile.ftype == 'MXEN':
+                model = MXEN_Model(vfile)
+                model.max_workers = self.worker_count or None
+                model.pool = pool
+            self.valk_scene = ValkyriaScene(model, filename, pool)
+            try:
+                self.valk_scene.read_data()
+            except FileNotFoundError as e:
+                message = 'This model requires a separate file which could not be found:\n'
+                message += '    ' + str(e)
+                message += '\nTry finding the file manually and copying it into the same folder as the model you attempted to open.'
+                self.report({'ERROR'}, message)
+            self.valk_scene.build_blender()
+            #pose_filename = os.path.join(os.path.dirname(filename), "VALCA02AD.MLX")
+            #self.valk_scene.pose_blender(pose_filename)
 
     def execute(self, context):
-        self.import_file(self.filepath)
+        if not self.import_file(self.filepath):
+            return {'CANCELLED'}
         return {'FINISHED'}
 
 
@@ -923,5 +1147,6 @@ def register():
     bpy.types.INFO_MT_file_import.append(menu_func)
 
 def unregister():
+    valkyria.index.stop_building()
     bpy.utils.unregister_class(ImportValkyria)
     bpy.types.INFO_MT_file_import.remove(menu_func)
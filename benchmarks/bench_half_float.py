@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# Compares per-value and bulk half-float / fixed-point decoding.
+# Run from the repository root: python3 benchmarks/bench_half_float.py
+
+import io
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import files
+
+
+def bit_ops_half_float(word):
+    # The old per-value decoder, kept here as a baseline.
+    sign = (word >> 15) & 0x0001
+    exponent = (word >> 10) & 0x001f
+    fraction = word & 0x03ff
+    int32 = None
+    if exponent == 0:
+        if fraction == 0:
+            int32 = sign << 31
+        else:
+            while not (fraction & 0x0400):
+                fraction = fraction << 1
+                exponent -= 1
+            exponent += 1
+            fraction &= 0x03ff
+    elif exponent == 31:
+        if fraction == 0:
+            int32 = (sign << 31) | 0x7f800000
+        else:
+            int32 = (sign << 31) | 0x7f800000 | (fraction << 13)
+    if int32 is None:
+        exponent = exponent + (127 -15)
+        fraction = fraction << 13
+        int32 = (sign << 31) | (exponent << 23) | fraction
+    return struct.unpack('f', struct.pack('I', int32))[0]
+
+
+def make_chunk(count):
+    random.seed(0)
+    payload = bytes(random.getrandbits(8) for i in range(count * 2))
+    data = b'KFMG' + struct.pack('<II', len(payload), 0x20) + bytes(0x14) + payload
+    return files.valk_factory(files.ValkSource(io.BytesIO(data)), 0)
+
+
+def report(name, seconds, count):
+    print("{:28s} {:8.1f} ns/value".format(name, seconds / count * 1e9))
+
+
+def main():
+    count = 100000
+    chunk = make_chunk(count)
+
+    def old_half():
+        chunk.seek(0x20)
+        for i in range(count):
+            bit_ops_half_float(chunk.read_and_unpack(2, '>h'))
+
+    def old_fixed():
+        chunk.seek(0x20)
+        for i in range(count):
+            chunk.read_word_be_signed() / 2**10
+
+    def bulk_half():
+        chunk.seek(0x20)
+        chunk.read_half_floats_be(count)
+
+    def bulk_fixed():
+        chunk.seek(0x20)
+        chunk.read_fixed_be(count, 2, 10)
+
+    report("half, per value (bit ops)", min(timeit.repeat(old_half, number=1, repeat=3)), count)
+    report("fixed, per value", min(timeit.repeat(old_fixed, number=1, repeat=3)), count)
+    if files.numpy is not None:
+        report("half, bulk (numpy)", min(timeit.repeat(bulk_half, number=1, repeat=3)), count)
+        report("fixed, bulk (numpy)", min(timeit.repeat(bulk_fixed, number=1, repeat=3)), count)
+    numpy = files.numpy
+    files.numpy = None
+    report("half, bulk (struct)", min(timeit.repeat(bulk_half, number=1, repeat=3)), count)
+    report("fixed, bulk (struct)", min(timeit.repeat(bulk_fixed, number=1, repeat=3)), count)
+    files.numpy = numpy
+
+
+if __name__ == '__main__':
+    main()
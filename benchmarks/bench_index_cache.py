@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# Compares opening a file by reading its chunk headers against rebuilding
+# the chunks from the persistent chunk index.
+# Run from the repository root: python3 benchmarks/bench_index_cache.py
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def chunk(ftype, body, children=b''):
+    main = body + children
+    return ftype + struct.pack('<II', len(main), 0x20) + bytes(8) + struct.pack('<I', len(body)) + bytes(8) + main
+
+
+EOFC = b'EOFC' + struct.pack('<II', 0, 0x20) + bytes(0x14)
+
+
+def build_htex(image_count):
+    # An HTEX texture pack holding image_count HTSF chunks with a tiny DDS each.
+    dds = b'DDS ' + bytes(0x7c) + bytes(0x20)
+    htsf = b'HTSF' + struct.pack('<II', 0x20 + len(dds), 0x20) + bytes(0x34) + dds
+    return chunk(b'HTEX', bytes(0x10), htsf * image_count + EOFC) + EOFC
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    os.environ['VALKYRIA_CACHE_DIR'] = os.path.join(workdir, 'cache')
+    from valkyria import files
+    filename = os.path.join(workdir, 'bench.htx')
+    with open(filename, 'wb') as F:
+        F.write(build_htex(3000))
+
+    def open_all(use_index):
+        htex = files.valk_open(filename, use_index=use_index)[0]
+        for htsf in htex.HTSF:
+            htsf.DDS
+
+    def open_one(use_index):
+        htex = files.valk_open(filename, use_index=use_index)[0]
+        htex.HTSF[-1].DDS
+
+    from valkyria import index
+    index.build_index(filename)
+    print("3000 textures          headers   index")
+    for name, func in (("open, all textures", open_all), ("open, last texture", open_one)):
+        headers = min(timeit.repeat(lambda: func(False), number=10, repeat=3)) / 10
+        index = min(timeit.repeat(lambda: func(True), number=10, repeat=3)) / 10
+        print("{:20s} {:7.1f} ms {:5.1f} ms".format(name, headers * 1e3, index * 1e3))
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+# Measures the cost of a seek+read on chunks at different nesting depths.
+# Run from the repository root: python3 benchmarks/bench_nesting.py
+
+import io
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import files
+
+
+def build_nested(depth):
+    # Each level is an HMDL chunk whose payload is the next level. The
+    # innermost chunk is a KFMG with some data to read.
+    payload = b'KFMG' + struct.pack('<II', 0x100, 0x20) + bytes(0x14) + bytes(range(256))
+    for level in range(depth - 1):
+        payload = b'HMDL' + struct.pack('<II', len(payload), 0x20) + bytes(0x14) + payload
+    return payload
+
+
+def innermost_chunk(depth):
+    source = files.ValkSource(io.BytesIO(build_nested(depth)))
+    chunk = files.valk_factory(source, 0)
+    for level in range(depth - 1):
+        chunk = files.valk_factory(chunk, 0x20)
+    return chunk
+
+
+def main():
+    reads = 200000
+    print("depth  ns/read")
+    for depth in (1, 2, 4, 6, 8):
+        chunk = innermost_chunk(depth)
+        def read():
+            chunk.seek(0x40)
+            chunk.read_long_le()
+        seconds = min(timeit.repeat(read, number=reads, repeat=5))
+        print("{:5d}  {:7.1f}".format(depth, seconds / reads * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# Measures the memory used per chunk node for a synthetic 100k-chunk tree,
+# once walked and again once every DDS in it has been read.
+# Run from the repository root: python3 benchmarks/bench_node_memory.py
+
+import gc
+import io
+import os
+import struct
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import files
+
+
+EOFC = b'EOFC' + struct.pack('<II', 0, 0x20) + bytes(0x14)
+
+
+def build_htex(image_count):
+    # An HTEX texture pack holding image_count HTSF chunks with a tiny DDS
+    # each, so the tree has 2 * image_count + 3 chunks.
+    dds = b'DDS ' + bytes(0x7c) + bytes(0x20)
+    htsf = b'HTSF' + struct.pack('<II', 0x20 + len(dds), 0x20) + bytes(0x34) + dds
+    children = htsf * image_count + EOFC
+    htex = b'HTEX' + struct.pack('<II', 0x10 + len(children), 0x20) + bytes(8) + struct.pack('<I', 0x10) + bytes(8) + bytes(0x10)
+    return htex + children + EOFC
+
+
+def report(label, used, node_count):
+    print("{:8s} {} nodes, {:.1f} MB, {:.0f} bytes/node".format(label, node_count, used / 1e6, used / node_count))
+
+
+def main():
+    image_count = 50000
+    source = files.ValkBufferSource(build_htex(image_count))
+    gc.collect()
+    tracemalloc.start()
+    top_level = files.valk_open(source, use_index=False)
+    for chunk in top_level:
+        chunk.find_inner_files()
+    gc.collect()
+    node_count = 2 * image_count + len(top_level) + 1
+    report("walked", tracemalloc.get_traced_memory()[0], node_count)
+    # Every DDS node stores a view of its data once read, like the ones an
+    # import decodes textures from.
+    for htsf in top_level[0].HTSF:
+        htsf.DDS[0].read_data()
+    gc.collect()
+    report("read", tracemalloc.get_traced_memory()[0], node_count)
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main()
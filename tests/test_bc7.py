@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# BC7 reference blocks, one per mode, with the RGBA pixels they decode to.
+# The expected pixels come from an independent decoder (Pillow's).
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import bc7
+
+
+# (mode, block, 16 RGBA pixels in row order), all as hex
+REFERENCE_BLOCKS = [
+    (0, '7368294d8252f7c7a35cd4627aca189b',
+        '381ec2ff461954ff381ec2ff3f1c89ffa54ec9ff627d4cff429410ff73716bff9559abff73716bffa54ec9ff52882eff94a552ff83af94ff83af94ff88ac7eff'),
+    (1, 'ee674f77e387b5b5dec41358421ecf16',
+        '9f8fd7ffab8ddaff9f8fd7ff83abb3ffb97a5fffb88addff9f8fd7ffab8ddaff76b7c7ffc66e4aff83abb3ffc488dfffeb80e8ff83abb3ffb97a5fffd36236ff'),
+    (2, '3c3f4e4bfd7f76a12d07ee9e016916fb',
+        'ffffceffffffceff4adee7ff4fa3c1ffc67e49ffc67e49ffecbe8dffd97a49ff4fa3c1ff4fa3c1ff52a57bffc67e49ffecbe8dffc63908ff5a2973ff4fa3c1ff'),
+    (3, 'c8a50d3e0848646c4f1d47f2ce72c61c',
+        '92427aff92427aff4e444aff5ea6a1ff92427aff3fc1b6ff21dbc9ff7c8c8eff5ea6a1ff5ea6a1ff7c8c8eff0d451dff7c8c8eff0d451dff92427affd341a7ff'),
+    (4, '109f51b323f350f5c2ccd7ea202b0dad',
+        'ffa5de359657a7339657a7359657a7399657a73a9657a73263318c30cc7fc332cc7fc335ffa5de399657a737cc7fc33a9657a730cc7fc3339657a73563318c39'),
+    (5, '201c6ee41f397b32972cb2c14f130cac',
+        '626b5bad8fb696cc3822229e626b5bad8fb696cc626b5b9e626b5bad3822229e626b5b9e8fb696cc626b5b9eb9ffcf9e3822229e382222cc8fb696bdb9ffcfbd'),
+    (6, 'c039a881b85024fedbfd4ed80bd7a035',
+        'b1182d6c58122adf58122adf411129fd4b1229f0bb182d5e8f162c9858122adf6d142bc4e71b2f2599162c8a58122adfe71b2f2577142bb6b1182d6cc5192e51'),
+    (7, '80c000fb458e96da8fae865f35d1ebb2',
+        '13aa816109c7af65be4c89ad9a5296931c8e555d09c7af659a5296937959a27913aa816113aa81617959a279be4c89ad13aa816109c7af65be4c89adbe4c89ad'),
+    ]
+
+
+class BC7Test(unittest.TestCase):
+    def test_reference_blocks(self):
+        for mode, block, expected in REFERENCE_BLOCKS:
+            with self.subTest(mode=mode):
+                pixels = bc7.decode_bc7(bytes.fromhex(block), 4, 4)
+                self.assertEqual(pixels.shape, (4, 4, 4))
+                self.assertEqual(pixels.tobytes().hex(), expected)
+
+    def test_all_modes_at_once(self):
+        data = b''.join(bytes.fromhex(block) for mode, block, expected in REFERENCE_BLOCKS)
+        pixels = bc7.decode_bc7(data, 32, 4)
+        for i, (mode, block, expected) in enumerate(REFERENCE_BLOCKS):
+            with self.subTest(mode=mode):
+                self.assertEqual(pixels[:, 4 * i:4 * i + 4].tobytes().hex(), expected)
+
+    def test_reserved_mode(self):
+        # A first byte of 0 has no mode bit set
+        pixels = bc7.decode_bc7(bytes(16), 4, 4)
+        self.assertEqual(pixels.tobytes(), bytes(64))
+
+
+if __name__ == '__main__':
+    unittest.main()
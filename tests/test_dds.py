@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# DDS headers, mip levels and uncompressed pixels described by bit masks.
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import dds
+
+
+def build_dds(fourcc, width, height, mip_count, payload_size):
+    header = bytearray(b'DDS ' + bytes(124))
+    struct.pack_into('<7I', header, 4, 124, 0x21007, height, width, 0, 0, mip_count)
+    struct.pack_into('<2I4s', header, 76, 32, dds.DDPF_FOURCC, fourcc)
+    return bytes(header) + bytes(range(256)) * (payload_size // 256) + bytes(payload_size % 256)
+
+
+def build_masked_dds(width, height, bit_count, masks, pf_flags, pixels):
+    header = bytearray(b'DDS ' + bytes(124))
+    struct.pack_into('<7I', header, 4, 124, 0x1007, height, width, 0, 0, 1)
+    struct.pack_into('<2I4x5I', header, 76, 32, pf_flags, bit_count, *masks)
+    return bytes(header) + pixels
+
+
+class MipLevelTest(unittest.TestCase):
+    def test_dxt1_levels(self):
+        # 64x64 DXT1 with all 7 levels: 2048 + 512 + 128 + 32 + 8 * 3 bytes
+        data = build_dds(b'DXT1', 64, 64, 7, 2744)
+        header = dds.read_header(data)
+        self.assertEqual(header.mip_count, 7)
+        self.assertEqual(header.choose_level(0, 16), 2)
+        self.assertEqual(header.choose_level(10), 6)
+        level = dds.extract_level(data, header, 2)
+        level_header = dds.read_header(level)
+        self.assertEqual((level_header.width, level_header.height, level_header.mip_count), (16, 16, 1))
+        self.assertEqual(len(level), header.data_offset + 128)
+        self.assertEqual(dds.decode(level).tolist(), dds.decode(data, header, 2).tolist())
+
+    def test_truncated_levels(self):
+        # Room for 64x64, 32x32 and 16x16 but not all of 8x8
+        data = build_dds(b'DXT1', 64, 64, 7, 2700)
+        self.assertEqual(dds.read_header(data).mip_count, 3)
+
+    def test_unsupported_fourcc(self):
+        # FourCC 113 (A16B16G16R16F) has no bit count, so level sizes are
+        # unknown and the whole texture is used as it is.
+        data = build_dds(struct.pack('<I', 113), 64, 64, 7, 65536)
+        header = dds.read_header(data)
+        self.assertFalse(dds.can_decode(header))
+        self.assertFalse(header.sizes_known())
+        self.assertEqual(header.mip_count, 1)
+        self.assertEqual(header.choose_level(2), 0)
+        self.assertEqual(header.choose_level(0, 16), 0)
+        with self.assertRaises(ValueError):
+            dds.extract_level(data, header, 1)
+
+
+class MaskedTest(unittest.TestCase):
+    def test_r5g6b5(self):
+        # Channels are widened to 8 bits by rounding v * 255 / max to the
+        # nearest value, as Direct3D converts UNORM formats. (Pillow
+        # truncates instead, so these were computed separately.)
+        data = build_masked_dds(3, 2, 16, (0xf800, 0x07e0, 0x001f, 0), dds.DDPF_RGB,
+            bytes.fromhex('5f6595064c93988f8b866ec1'))
+        header = dds.read_header(data)
+        self.assertEqual(header.format, 'RGB')
+        self.assertEqual(dds.decode(data).tobytes().hex(),
+            '63aaffff00d2adff946963ff8cf3c5ff84d25affc52d73ff')
+
+    def test_a8r8g8b8(self):
+        # Expected pixels from Pillow
+        data = build_masked_dds(3, 2, 32, (0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000),
+            dds.DDPF_RGB | dds.DDPF_ALPHAPIXELS,
+            bytes.fromhex('ace6876d1617ff715b196ec7670eedd7f332833d66011875'))
+        self.assertEqual(dds.decode(data).tobytes().hex(),
+            '87e6ac6dff1716716e195bc7ed0e67d78332f33d18016675')
+
+
+if __name__ == '__main__':
+    unittest.main()
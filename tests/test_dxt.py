@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# DXT1/DXT3/DXT5 (BC1/BC2/BC3) reference blocks with the RGBA pixels they
+# decode to. The expected pixels come from an independent decoder (Pillow's).
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import dxt
+
+
+# (case, decoder, block, 16 RGBA pixels in row order), all as hex
+REFERENCE_BLOCKS = [
+    # color_0 > color_1
+    ('BC1 four colors', dxt.decode_bc1, '4df548e8233e069c',
+        'f13e4ffff7aa6bfff4745dfff7aa6bfff4745dfff13e4ffff13e4ffff7aa6bfff4745dffef0842fff7aa6bfff7aa6bfff7aa6bfff13e4fffef0842fff4745dff'),
+    # color_0 <= color_1, with the fourth color transparent
+    ('BC1 three colors', dxt.decode_bc1, '2b2fb3b3ff1be400',
+        '00000000000000000000000000000000000000006fae7bffb5759cff29e75aff29e75affb5759cff6fae7bff0000000029e75aff29e75aff29e75aff29e75aff'),
+    ('BC2', dxt.decode_bc2, '58cae3143b44f50ce499db2dee8dafbb',
+        '756660884f909f55756660aa4f909fcc29bade334f909fee9c3c2144756660114f909fbb4f909f3375666044756660444f909f55756660ff4f909fcc75666000'),
+    # alpha_0 > alpha_1
+    ('BC3 eight alphas', dxt.decode_bc3, 'ec6eb5e20c93e105ed9693434f6b302e',
+        '5d958ba45d958b9294df6bda42719c6e5d958b9278ba7b6e78ba7bc842719cec94df6bc894df6bda5d958b9294df6bec78ba7b925d958bc878ba7b6e94df6bec'),
+    # alpha_0 <= alpha_1, with 0 and 255 as the last two alphas
+    ('BC3 six alphas', dxt.decode_bc3, 'c6fbf6f3900fb253c19cb655422ff464',
+        '83a341009c9a08009c9a08ff52b6b5fb6aac7bff6aac7bfb83a341e59c9a08e59c9a08ff52b6b5fb6aac7bc66aac7bfb9c9a08db52b6b5ff83a341e552b6b5d0'),
+    ]
+
+# A 6x5 DXT1 texture: 2x2 blocks, of which only the top left is whole
+ODD_SIZE_BLOCKS = '9fa6ea832447d345e1aa1fb12f6e0c57d2ec6740814884e137a9a9ecea2f4e90'
+ODD_SIZE_PIXELS = (
+    'a5d3ffff847d52ff9ab6c5ffa5d3ffff00000000000000008f998bff847d52ffa5d3ffff847d52ffb13e83ff00000000'
+    '8f998bffa5d3ffff847d52ff8f998bffad5d08ff00000000847d52ff847d52ffa5d3ffff847d52ff00000000b520ffff'
+    '420c39ffef9a94ffef9a94ffb56a75ffce5d83ffce5d83ff')
+
+
+class DXTTest(unittest.TestCase):
+    def test_reference_blocks(self):
+        for case, decoder, block, expected in REFERENCE_BLOCKS:
+            with self.subTest(case=case):
+                pixels = decoder(bytes.fromhex(block), 4, 4)
+                self.assertEqual(pixels.shape, (4, 4, 4))
+                self.assertEqual(pixels.tobytes().hex(), expected)
+
+    def test_odd_size(self):
+        pixels = dxt.decode_bc1(bytes.fromhex(ODD_SIZE_BLOCKS), 6, 5)
+        self.assertEqual(pixels.shape, (5, 6, 4))
+        self.assertEqual(pixels.tobytes().hex(), ODD_SIZE_PIXELS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# Chunks rebuilt from the chunk index must look the same as chunks parsed
+# from the file's headers.
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import cache, files, index
+
+
+def chunk(ftype, body, children=b''):
+    main = body + children
+    return ftype + struct.pack('<II', len(main), 0x20) + bytes(8) + struct.pack('<I', len(body)) + bytes(8) + main
+
+
+EOFC = b'EOFC' + struct.pack('<II', 0, 0x20) + bytes(0x14)
+
+
+def build_map():
+    # An MXEN map next to an HTEX texture pack with a few tiny DDS files
+    htsfs = b''
+    for i in range(3):
+        dds = b'DDS ' + bytes(0x7c) + bytes([i]) * (0x20 * (i + 1))
+        htsfs += b'HTSF' + struct.pack('<II', 0x20 + len(dds), 0x20) + bytes(0x34) + dds
+    mxen = chunk(b'MXEN', bytes(0x10), chunk(b'MXEC', bytes(0x40)) + EOFC)
+    htex = chunk(b'HTEX', bytes(0x10), htsfs + EOFC)
+    return mxen + htex + EOFC
+
+
+# Slots that refer to other objects, the cursor, which every reader moves
+# before reading, and the chunk's record in the index itself
+SKIPPED_SLOTS = {'F', 'source', 'pos', 'index_id', '_inner_files', '_by_type', '__dict__', '__weakref__'}
+MISSING = object()
+
+
+def chunk_state(chunk):
+    # Every attribute of a chunk, from its slots and any dict, except
+    # references to other objects. Attributes set while the headers are
+    # read must be set for chunks rebuilt from the index as well.
+    state = {'class': type(chunk).__name__}
+    for cls in type(chunk).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name not in SKIPPED_SLOTS:
+                state[name] = getattr(chunk, name, MISSING)
+    state.update(getattr(chunk, '__dict__', {}))
+    return state
+
+
+def htsf_state(htsf):
+    dds = htsf.DDS[0]
+    dds.read_data()
+    return htsf.offset, htsf.base, bytes(dds.data)
+
+
+def tree_state(chunks):
+    states = []
+    for chunk in chunks:
+        states.append(chunk_state(chunk))
+        states.append(tree_state(chunk.inner_files))
+    return states
+
+
+class IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.saved_cache = index.index_cache
+        index.index_cache = cache.CacheDirectory('index', root=self.workdir)
+        index.pending.clear()
+        self.filename = os.path.join(self.workdir, 'map.mxe')
+        with open(self.filename, 'wb') as F:
+            F.write(build_map())
+
+    def tearDown(self):
+        index.stop_building()
+        index.pending.clear()
+        index.index_cache = self.saved_cache
+        shutil.rmtree(self.workdir)
+
+    def test_index_matches_headers(self):
+        with files.valk_open(self.filename, use_index=False) as parsed:
+            expected = tree_state(parsed)
+        self.assertIsNotNone(index.build_index(self.filename))
+        with files.valk_open(self.filename, use_index=True) as rebuilt:
+            self.assertIsNotNone(rebuilt.source.chunk_index)
+            self.assertEqual(tree_state(rebuilt), expected)
+
+    def test_open_doesnt_build(self):
+        with files.valk_open(self.filename, use_index=True) as parsed:
+            self.assertIsNone(parsed.source.chunk_index)
+        self.assertIsNone(index.load_index(self.filename))
+        index.build_pending()
+        self.assertIsNotNone(index.load_index(self.filename))
+
+    def test_stopped_build_stays_pending(self):
+        with files.valk_open(self.filename, use_index=True):
+            pass
+        stop = threading.Event()
+        stop.set()
+        with self.assertRaises(index.BuildStopped):
+            index.build_index(self.filename, stop)
+        index.build_pending(stop)
+        self.assertIsNone(index.load_index(self.filename))
+        self.assertEqual(index.pending, {os.path.abspath(self.filename)})
+
+    def test_background_builder(self):
+        with files.valk_open(self.filename, use_index=True):
+            pass
+        index.start_building()
+        index.builder.join()
+        self.assertIsNotNone(index.load_index(self.filename))
+        self.assertEqual(index.pending, set())
+        index.stop_building()
+        self.assertIsNone(index.builder)
+
+    def test_get_htsf(self):
+        # Single HTSFs fetched from a merge.htx are the same as the ones
+        # found by walking the HTEX
+        for use_index in (False, True):
+            with self.subTest(use_index=use_index):
+                if use_index:
+                    index.build_index(self.filename)
+                with files.valk_open(self.filename, use_index=use_index) as top_level:
+                    expected = [htsf_state(htsf) for htsf in top_level[1].HTSF]
+                with files.valk_open(self.filename, use_index=use_index) as top_level:
+                    htex = top_level[1]
+                    self.assertEqual(htex.source.chunk_index is not None, use_index)
+                    self.assertEqual(htex.htsf_count(), len(expected))
+                    fetched = [htsf_state(htex.get_htsf(i)) for i in (2, 0, 1)]
+                    self.assertIs(htex.get_htsf(1), htex.get_htsf(1))
+                    self.assertFalse(htex.children_found)
+                self.assertEqual(fetched, [expected[i] for i in (2, 0, 1)])
+
+    def test_mxec_flags(self):
+        index.build_index(self.filename)
+        with files.valk_open(self.filename, use_index=True) as rebuilt:
+            mxec = rebuilt[0].MXEC[0]
+            self.assertFalse(mxec.PRINT_PARAMS)
+            self.assertFalse(mxec.PRINT_FILES)
+
+
+if __name__ == '__main__':
+    unittest.main()
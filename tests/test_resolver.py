@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+# Resolving referenced file names on disk.
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria.resolver import FileResolver
+
+
+class FileResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        os.mkdir(os.path.join(self.folder.name, 'Sub'))
+        with open(os.path.join(self.folder.name, 'Sub', 'Model.HMD'), 'wb'):
+            pass
+
+    def test_case_insensitive(self):
+        resolver = FileResolver(self.folder.name, search_dirs=('',))
+        self.assertEqual(resolver.resolve('sub/model.hmd'),
+            os.path.join(self.folder.name, 'Sub', 'Model.HMD'))
+        self.assertFalse(resolver.exists('sub/other.hmd'))
+
+    def test_empty_directory_is_current_folder(self):
+        # os.path.dirname() of a bare file name is ''
+        cwd = os.getcwd()
+        os.chdir(os.path.join(self.folder.name, 'Sub'))
+        self.addCleanup(os.chdir, cwd)
+        resolver = FileResolver('', search_dirs=('',))
+        self.assertTrue(resolver.exists('model.hmd'))
+        self.assertTrue(resolver.exists('../sub/MODEL.hmd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
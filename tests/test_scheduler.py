@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# Parsing files in worker processes, with this package imported the way the
+# Blender add-on imports it.
+# Run from the repository root: python3 -m unittest discover tests
+
+import importlib
+import io
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import files, scheduler
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'valkyria')
+
+# Stands in for the add-on's __init__.py, which needs Blender
+ADDON_INIT = '''
+import multiprocessing
+if multiprocessing.parent_process() is not None:
+    raise ImportError("Workers must not import the add-on")
+'''
+
+
+def chunk(ftype, body, children=b''):
+    main = body + children
+    return ftype + struct.pack('<II', len(main), 0x20) + bytes(8) + struct.pack('<I', len(body)) + bytes(8) + main
+
+
+EOFC = b'EOFC' + struct.pack('<II', 0, 0x20) + bytes(0x14)
+
+
+def build_htx(seed, count):
+    # An HTEX pack of DDS files large enough to go through shared memory
+    htsfs = b''
+    for i in range(count):
+        dds = b'DDS ' + bytes(0x7c) + bytes([seed, i]) * (scheduler.SHARED_MIN_SIZE // 2)
+        htsfs += b'HTSF' + struct.pack('<II', 0x20 + len(dds), 0x20) + bytes(0x34) + dds
+    return chunk(b'HTEX', bytes(0x10), htsfs + EOFC) + EOFC
+
+
+@unittest.skipIf(not hasattr(os, 'symlink'), "needs symlinks")
+class AddonSchedulerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        addon_dir = os.path.join(cls.workdir, 'valk_addon')
+        os.mkdir(addon_dir)
+        with open(os.path.join(addon_dir, '__init__.py'), 'w') as F:
+            F.write(ADDON_INIT)
+        os.symlink(os.path.abspath(PACKAGE_DIR), os.path.join(addon_dir, 'valkyria'))
+        sys.path.insert(0, cls.workdir)
+        cls.scheduler = importlib.import_module('valk_addon.valkyria.scheduler')
+        cls.scheduler.START_METHOD = 'spawn'
+        cls.filenames = []
+        for seed in range(3):
+            filename = os.path.join(cls.workdir, 'pack{}.htx'.format(seed))
+            with open(filename, 'wb') as F:
+                F.write(build_htx(seed, 2))
+            cls.filenames.append(filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(cls.workdir)
+        for name in list(sys.modules):
+            if name == 'valk_addon' or name.startswith('valk_addon.'):
+                del sys.modules[name]
+        shutil.rmtree(cls.workdir)
+
+    def test_names(self):
+        self.assertEqual(self.scheduler.PACKAGE, 'valk_addon.valkyria')
+        self.assertEqual(self.scheduler.WORKER_PACKAGE, 'valkyria')
+        addon_files = sys.modules['valk_addon.valkyria.files']
+        # Out to the workers under the top-level name, and back again
+        self.assertIs(pickle.loads(self.scheduler.worker_dumps(addon_files.ValkSource)), files.ValkSource)
+        data = pickle.dumps(files.ValkSource)
+        self.assertIs(self.scheduler.SharedResultUnpickler(io.BytesIO(data)).load(), addon_files.ValkSource)
+
+    def test_worker_processes(self):
+        jobs = [('texture', filename, None) for filename in self.filenames]
+        expected = [scheduler.parse_job(job) for job in jobs]
+        with self.scheduler.parse_files(jobs, max_workers=2) as results:
+            self.assertEqual([[bytes(data) for data in result] for result in results], expected)
+            if scheduler.shared_memory is not None:
+                self.assertEqual(len(results.blocks), len(jobs))
+
+    @unittest.skipIf(scheduler.shared_memory is None or scheduler.numpy is None, "needs shared memory")
+    def test_blocks_outlive_release(self):
+        jobs = [('texture', filename, None) for filename in self.filenames]
+        expected = scheduler.parse_job(jobs[0])[0]
+        unraisable = []
+        with unittest.mock.patch.object(sys, 'unraisablehook', unraisable.append):
+            results = self.scheduler.parse_files(jobs, max_workers=2)
+            blocks = list(results.blocks)
+            view = results[0][0]
+            results.release()
+            del results
+            # Still mapped for the view that's left
+            self.assertEqual(bytes(view), expected)
+            self.assertIsNotNone(blocks[0].buf)
+            self.assertIsNone(blocks[1].buf)
+            del view
+            self.assertIsNone(blocks[0].buf)
+        self.assertEqual(unraisable, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
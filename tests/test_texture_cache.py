@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# The on-disk cache of decoded textures.
+# Run from the repository root: python3 -m unittest discover tests
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from valkyria import cache, dds, texture_cache
+
+
+def chunk(ftype, body, children=b''):
+    main = body + children
+    return ftype + struct.pack('<II', len(main), 0x20) + bytes(8) + struct.pack('<I', len(body)) + bytes(8) + main
+
+
+EOFC = b'EOFC' + struct.pack('<II', 0, 0x20) + bytes(0x14)
+
+
+def build_dxt1(seed, width=256, height=256):
+    header = bytearray(b'DDS ' + bytes(124))
+    struct.pack_into('<7I', header, 4, 124, 0x1007, height, width, 0, 0, 1)
+    struct.pack_into('<2I4s', header, 76, 32, dds.DDPF_FOURCC, b'DXT1')
+    return bytes(header) + bytes([seed]) * (width * height // 2)
+
+
+def build_htx(textures):
+    htsfs = b''
+    for data in textures:
+        htsfs += b'HTSF' + struct.pack('<II', 0x20 + len(data), 0x20) + bytes(0x34) + data
+    return chunk(b'HTEX', bytes(0x10), htsfs + EOFC) + EOFC
+
+
+@unittest.skipIf(dds.numpy is None, "needs NumPy")
+class TextureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.saved_cache = texture_cache.texture_cache
+        texture_cache.texture_cache = cache.CacheDirectory('textures', root=self.workdir)
+
+    def tearDown(self):
+        texture_cache.texture_cache = self.saved_cache
+        shutil.rmtree(self.workdir)
+
+    def test_round_trip(self):
+        data = build_dxt1(1)
+        pixels = texture_cache.decode(data)
+        cached = texture_cache.load(texture_cache.texture_key(data))
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.tobytes(), pixels.tobytes())
+
+    def test_load_rejects_bad_entries(self):
+        pixels = dds.numpy.zeros((4, 8, 4), dtype=dds.numpy.uint8)
+        texture_cache.store('good', pixels)
+        entry = texture_cache.texture_cache.get('good')
+        self.assertEqual(texture_cache.load('good').shape, (4, 8, 4))
+        bad_entries = {
+            'short': entry[:texture_cache.ENTRY_HEADER.size - 1],
+            'truncated': entry[:-1],
+            'too long': entry + b'\0',
+            'magic': b'XXXX' + entry[4:],
+            'size': texture_cache.ENTRY_HEADER.pack(texture_cache.ENTRY_MAGIC, 8, 5) + entry[texture_cache.ENTRY_HEADER.size:],
+            }
+        for name, data in bad_entries.items():
+            with self.subTest(entry=name):
+                texture_cache.texture_cache.put(name, data)
+                self.assertIsNone(texture_cache.load(name))
+        self.assertIsNone(texture_cache.load('missing'))
+
+    def test_warm_skips_cached(self):
+        folder = os.path.join(self.workdir, 'game')
+        os.mkdir(folder)
+        with open(os.path.join(folder, 'a.htx'), 'wb') as F:
+            # The second texture is a copy of the first
+            F.write(build_htx([build_dxt1(1), build_dxt1(1), build_dxt1(2)]))
+        logged = []
+        self.assertEqual(texture_cache.warm(folder, max_workers=2, log=logged.append), 2)
+        with open(os.path.join(folder, 'b.htx'), 'wb') as F:
+            F.write(build_htx([build_dxt1(2), build_dxt1(3)]))
+        self.assertEqual(texture_cache.warm(folder, max_workers=2, log=logged.append), 1)
+        self.assertEqual(texture_cache.warm(folder, max_workers=2, log=logged.append), 0)
+
+    def test_concurrent_puts(self):
+        directory = texture_cache.texture_cache
+        directory.evict()
+
+        def put_entries(thread_id):
+            for i in range(50):
+                directory.put('{}-{}'.format(thread_id, i), bytes(100))
+
+        threads = [threading.Thread(target=put_entries, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(directory.size_estimate, sum(size for mtime, size, name in directory.entries()))
+
+
+if __name__ == '__main__':
+    unittest.main()
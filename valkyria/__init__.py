@@ -1,3 +1,10 @@
 #!/usr/bin/python3
 
 from . import files
+from . import cpk
+from . import cvm
+from . import cache
+from . import index
+from . import scheduler
+from . import resolver
+from . import dds
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+# Common base for game archives whose members can be opened in place with
+# files.valk_open().
+
+import posixpath
+
+from . import files
+
+
+def normalize_path(path):
+    # Archive paths are looked up case-insensitively with '/' separators.
+    path = posixpath.normpath(path.replace('\\', '/')).lstrip('/')
+    return path.lower()
+
+
+class ArchiveEntry:
+    def __init__(self, name, offset, size, extract_size=None):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        if extract_size is None:
+            extract_size = size
+        self.extract_size = extract_size
+
+    @property
+    def compressed(self):
+        return self.size != self.extract_size
+
+
+class ValkArchive:
+    def __init__(self, filename, use_mmap=None):
+        self.filename = filename
+        self.source = files.valk_source(filename, use_mmap)
+        self.entries = {}
+
+    @classmethod
+    def without_toc(cls, filename, use_mmap=None):
+        # The archive without its table of contents, for reading entries
+        # that were already found by another instance, e.g. in a worker
+        # process that was given them.
+        archive = cls.__new__(cls)
+        ValkArchive.__init__(archive, filename, use_mmap)
+        return archive
+
+    def add_entry(self, entry):
+        self.entries[normalize_path(entry.name)] = entry
+
+    def namelist(self):
+        return [entry.name for entry in self.entries.values()]
+
+    def find(self, name):
+        entry = self.entries.get(normalize_path(name))
+        if entry is None:
+            raise FileNotFoundError(name)
+        return entry
+
+    def read_entry(self, entry):
+        return self.source.pread_view(entry.offset, entry.size)
+
+    def read(self, name):
+        return self.read_entry(self.find(name))
+
+    def open(self, name):
+        # Members of a mapped archive that are stored uncompressed are
+        # zero-copy views.
+        entry = self.find(name)
+        source = files.ValkBufferSource(self.read_entry(entry), entry.name)
+        source.archive = self
+        return source
+
+    def close(self):
+        self.source.close()
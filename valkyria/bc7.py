@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+
+# BC7 (BPTC) texture decoder. Valkyria Chronicles 4 stores most of its
+# textures as BC7, which Blender can't load. Blocks are decoded with NumPy,
+# all blocks of one mode at a time, following the D3D11 specification.
+
+import numpy
+
+
+# Blocks decoded at once; bounds the temporary arrays to a few MB.
+CHUNK_BLOCKS = 0x8000
+
+# subsets, partition bits, rotation bits, index selection bits, color bits,
+# alpha bits, endpoint P-bits, shared P-bits, index bits, secondary index
+# bits
+MODES = (
+    (3, 4, 0, 0, 4, 0, 1, 0, 3, 0),
+    (2, 6, 0, 0, 6, 0, 0, 1, 3, 0),
+    (3, 6, 0, 0, 5, 0, 0, 0, 2, 0),
+    (2, 6, 0, 0, 7, 0, 1, 0, 2, 0),
+    (1, 0, 2, 1, 5, 6, 0, 0, 2, 3),
+    (1, 0, 2, 0, 7, 8, 0, 0, 2, 2),
+    (1, 0, 0, 0, 7, 7, 1, 0, 4, 0),
+    (2, 6, 0, 0, 5, 5, 1, 0, 2, 0),
+    )
+
+# Subset of each pixel, for every partition of the two and three subset
+# modes
+PARTITIONS_2 = (
+    '0011001100110011', '0001000100010001', '0111011101110111', '0001001100110111',
+    '0000000100010011', '0011011101111111', '0001001101111111', '0000000100110111',
+    '0000000000010011', '0011011111111111', '0000000101111111', '0000000000010111',
+    '0001011111111111', '0000000011111111', '0000111111111111', '0000000000001111',
+    '0000100011101111', '0111000100000000', '0000000010001110', '0111001100010000',
+    '0011000100000000', '0000100011001110', '0000000010001100', '0111001100110001',
+    '0011000100010000', '0000100010001100', '0110011001100110', '0011011001101100',
+    '0001011111101000', '0000111111110000', '0111000110001110', '0011100110011100',
+    '0101010101010101', '0000111100001111', '0101101001011010', '0011001111001100',
+    '0011110000111100', '0101010110101010', '0110100101101001', '0101101010100101',
+    '0111001111001110', '0001001111001000', '0011001001001100', '0011101111011100',
+    '0110100110010110', '0011110011000011', '0110011010011001', '0000011001100000',
+    '0100111001000000', '0010011100100000', '0000001001110010', '0000010011100100',
+    '0110110010010011', '0011011011001001', '0110001110011100', '0011100111000110',
+    '0110110011001001', '0110001100111001', '0111111010000001', '0001100011100111',
+    '0000111100110011', '0011001111110000', '0010001011101110', '0100010001110111',
+    )
+PARTITIONS_3 = (
+    '0011001102212222', '0001001122112221', '0000200122112211', '0222002200110111',
+    '0000000011221122', '0011001100220022', '0022002211111111', '0011001122112211',
+    '0000000011112222', '0000111111112222', '0000111122222222', '0012001200120012',
+    '0112011201120112', '0122012201220122', '0011011211221222', '0011200122002220',
+    '0001001101121122', '0111001120012200', '0000112211221122', '0022002200221111',
+    '0111011102220222', '0001000122212221', '0000001101220122', '0000110022102210',
+    '0122012200110000', '0012001211222222', '0110122112210110', '0000011012211221',
+    '0022110211020022', '0110011020022222', '0011012201220011', '0000200022112221',
+    '0000000211221222', '0222002200120011', '0011001200220222', '0120012001200120',
+    '0000111122220000', '0120120120120120', '0120201212010120', '0011220011220011',
+    '0011112222000011', '0101010122222222', '0000000021212121', '0022112200221122',
+    '0022001100220011', '0220122102201221', '0101222222220101', '0000212121212121',
+    '0101010101012222', '0222011102220111', '0002111200021112', '0000211221122112',
+    '0222011101110222', '0002111211120002', '0110011001102222', '0000000021122112',
+    '0110011022222222', '0022001100110022', '0022112211220022', '0000000000002112',
+    '0002000100020001', '0222122202221222', '0101222222222222', '0111201122012220',
+    )
+
+# Pixels whose index has its top bit left out, besides pixel 0: the anchor
+# of the second subset of each two subset partition, and of the second and
+# third subsets of each three subset partition
+ANCHORS_2 = (
+    15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15,
+    15, 2, 8, 2, 2, 8, 8, 15, 2, 8, 2, 2, 8, 8, 2, 2,
+    15, 15, 6, 8, 2, 8, 15, 15, 2, 8, 2, 2, 2, 15, 15, 6,
+    6, 2, 6, 8, 15, 15, 2, 2, 15, 15, 15, 15, 15, 2, 2, 15,
+    )
+ANCHORS_3_SECOND = (
+    3, 3, 15, 15, 8, 3, 15, 15, 8, 8, 6, 6, 6, 5, 3, 3,
+    3, 3, 8, 15, 3, 3, 6, 10, 5, 8, 8, 6, 8, 5, 15, 15,
+    8, 15, 3, 5, 6, 10, 8, 15, 15, 3, 15, 5, 15, 15, 15, 15,
+    3, 15, 5, 5, 5, 8, 5, 10, 5, 10, 8, 13, 15, 12, 3, 3,
+    )
+ANCHORS_3_THIRD = (
+    15, 8, 8, 3, 15, 15, 3, 8, 15, 15, 15, 15, 15, 15, 15, 8,
+    15, 8, 15, 3, 15, 8, 15, 8, 3, 15, 6, 10, 15, 15, 10, 8,
+    15, 3, 15, 10, 10, 8, 9, 10, 6, 15, 8, 15, 3, 6, 6, 8,
+    15, 3, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 3, 15, 15, 8,
+    )
+
+WEIGHTS = {
+    2: numpy.array([0, 21, 43, 64], dtype=numpy.int16),
+    3: numpy.array([0, 9, 18, 27, 37, 46, 55, 64], dtype=numpy.int16),
+    4: numpy.array([0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64], dtype=numpy.int16),
+    }
+
+
+def partition_table(partitions):
+    return numpy.array([[int(subset) for subset in partition] for partition in partitions], dtype=numpy.intp)
+
+
+def anchor_table(*anchor_lists):
+    anchors = numpy.zeros((64, 16), dtype=bool)
+    anchors[:, 0] = True
+    for anchor_list in anchor_lists:
+        anchors[numpy.arange(64), anchor_list] = True
+    return anchors
+
+
+def skipped_table(anchors):
+    # Anchors before each pixel
+    return numpy.cumsum(anchors, axis=1) - anchors
+
+
+SUBSETS = {
+    1: numpy.zeros((1, 16), dtype=numpy.intp),
+    2: partition_table(PARTITIONS_2),
+    3: partition_table(PARTITIONS_3),
+    }
+ANCHORS = {
+    1: anchor_table(),
+    2: anchor_table(ANCHORS_2),
+    3: anchor_table(ANCHORS_3_SECOND, ANCHORS_3_THIRD),
+    }
+SKIPPED_ANCHORS = {subset_count: skipped_table(anchors) for subset_count, anchors in ANCHORS.items()}
+
+# Channel order after each rotation
+ROTATIONS = numpy.array([(0, 1, 2, 3), (3, 1, 2, 0), (0, 3, 2, 1), (0, 1, 3, 2)], dtype=numpy.intp)
+
+# Mode of each possible first byte: the position of its lowest set bit.
+# Blocks starting with a zero byte are reserved and decode to zeros.
+MODE_OF_BYTE = numpy.array([(b & -b).bit_length() - 1 if b else 8 for b in range(256)], dtype=numpy.uint8)
+
+
+class BlockBits:
+    # Reads consecutive fields from many blocks at once. Each block is held
+    # as two little-endian 64-bit words.
+    def __init__(self, words, pos):
+        self.low = words[:, 0]
+        self.high = words[:, 1]
+        self.pos = pos
+
+    def field(self, pos, count):
+        if pos >= 64:
+            value = self.high >> (pos - 64)
+        elif pos + count <= 64:
+            value = self.low >> pos
+        else:
+            value = (self.low >> pos) | (self.high << (64 - pos))
+        return (value & ((1 << count) - 1)).astype(numpy.int32)
+
+    def take(self, count):
+        value = self.field(self.pos, count)
+        self.pos += count
+        return value
+
+    def take_indices(self, index_bits, subset_count, partition):
+        # 16 indices of index_bits bits each, except each subset's anchor
+        # pixel, whose index has one bit less. Where a pixel's index starts
+        # depends on how many anchors come before it, which depends on the
+        # partition, so each possible start is read and the right one picked.
+        skipped = SKIPPED_ANCHORS[subset_count][partition]
+        anchors = ANCHORS[subset_count][partition]
+        indices = numpy.empty((len(partition), 16), dtype=numpy.int32)
+        for pixel in range(16):
+            start = self.pos + pixel * index_bits
+            if pixel == 0:
+                value = self.field(start, index_bits - 1)
+            else:
+                value = self.field(start - 1, index_bits)
+                for skip in range(2, subset_count + 1):
+                    value = numpy.where(skipped[:, pixel] == skip, self.field(start - skip, index_bits), value)
+                value = numpy.where(anchors[:, pixel], value & ((1 << (index_bits - 1)) - 1), value)
+            indices[:, pixel] = value
+        self.pos += 16 * index_bits - subset_count
+        return indices
+
+
+def unquantize(values, precision):
+    values = values << (8 - precision)
+    return values | (values >> precision)
+
+
+def decode_mode(mode, words):
+    # (blocks, 16, 4) RGBA pixels of blocks of one mode
+    (subset_count, partition_bits, rotation_bits, selection_bits, color_bits,
+        alpha_bits, endpoint_pbits, shared_pbits, index_bits, index_bits_2) = MODES[mode]
+    count = len(words)
+    rows = numpy.arange(count)[:, None]
+    reader = BlockBits(words, mode + 1)
+    partition = reader.take(partition_bits)
+    rotation = reader.take(rotation_bits)
+    selection = reader.take(selection_bits)
+
+    endpoints = numpy.zeros((count, 2 * subset_count, 4), dtype=numpy.int32)
+    for channel in range(3):
+        for endpoint in range(2 * subset_count):
+            endpoints[:, endpoint, channel] = reader.take(color_bits)
+    if alpha_bits:
+        for endpoint in range(2 * subset_count):
+            endpoints[:, endpoint, 3] = reader.take(alpha_bits)
+    if endpoint_pbits or shared_pbits:
+        if endpoint_pbits:
+            pbits = numpy.stack([reader.take(1) for endpoint in range(2 * subset_count)], axis=1)
+        else:
+            pbits = numpy.repeat(numpy.stack([reader.take(1) for subset in range(subset_count)], axis=1), 2, axis=1)
+        endpoints = (endpoints << 1) | pbits[:, :, None]
+        color_bits += 1
+        if alpha_bits:
+            alpha_bits += 1
+    endpoints[:, :, :3] = unquantize(endpoints[:, :, :3], color_bits)
+    if alpha_bits:
+        endpoints[:, :, 3] = unquantize(endpoints[:, :, 3], alpha_bits)
+    else:
+        endpoints[:, :, 3] = 255
+
+    subsets = SUBSETS[subset_count][partition]
+    indices = reader.take_indices(index_bits, subset_count, partition)
+    color_weights = alpha_weights = WEIGHTS[index_bits][indices]
+    if index_bits_2:
+        indices_2 = reader.take_indices(index_bits_2, 1, partition)
+        weights_2 = WEIGHTS[index_bits_2][indices_2]
+        # Mode 4's index selection bit swaps which index set is for color
+        swap = (selection == 1)[:, None]
+        color_weights = numpy.where(swap, weights_2, alpha_weights)
+        alpha_weights = numpy.where(swap, alpha_weights, weights_2)
+
+    # Values fit in 16 bits, which halves the memory traffic.
+    endpoints = endpoints.astype(numpy.int16)
+    if subset_count == 1:
+        first = endpoints[:, None, 0]
+        second = endpoints[:, None, 1]
+    else:
+        first = endpoints[rows, 2 * subsets]
+        second = endpoints[rows, 2 * subsets + 1]
+    weights = numpy.empty((count, 16, 4), dtype=numpy.int16)
+    weights[:, :, :3] = color_weights[:, :, None]
+    weights[:, :, 3] = alpha_weights
+    # Same as ((64 - w) * first + w * second + 32) >> 6
+    pixels = first + (((second - first) * weights + 32) >> 6)
+
+    if rotation_bits:
+        # Rotation swaps alpha with one of the color channels
+        pixels = numpy.take_along_axis(pixels, ROTATIONS[rotation][:, None, :], axis=2)
+    return pixels.astype(numpy.uint8)
+
+
+def decode_blocks(blocks):
+    # blocks is (count, 16) uint8; returns (count, 16, 4) RGBA pixels, in
+    # row-major order within each block.
+    pixels = numpy.zeros((len(blocks), 16, 4), dtype=numpy.uint8)
+    words = blocks.view('<u8')
+    modes = MODE_OF_BYTE[blocks[:, 0]]
+    for mode in range(8):
+        selected = numpy.flatnonzero(modes == mode)
+        for start in range(0, len(selected), CHUNK_BLOCKS):
+            chunk = selected[start:start + CHUNK_BLOCKS]
+            pixels[chunk] = decode_mode(mode, words[chunk])
+    return pixels
+
+
+def decode_bc7(data, width, height):
+    # Decodes one BC7 image into a (height, width, 4) array of RGBA bytes,
+    # top row first.
+    blocks_wide = (width + 3) // 4
+    blocks_high = (height + 3) // 4
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=blocks_wide * blocks_high * 16)
+    pixels = decode_blocks(blocks.reshape(-1, 16))
+    pixels = pixels.reshape(blocks_high, blocks_wide, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape(blocks_high * 4, blocks_wide * 4, 4)[:height, :width]
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+# On-disk cache shared by the chunk index and other derived data. Entries
+# are plain files named by key; the least recently used ones are deleted
+# once a cache directory grows past its size limit.
+
+import os
+import tempfile
+import threading
+
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_root():
+    root = os.environ.get('VALKYRIA_CACHE_DIR')
+    if root:
+        return root
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'valkyria')
+
+
+class CacheDirectory:
+    def __init__(self, name, root=None, max_size=DEFAULT_MAX_SIZE):
+        if root is None:
+            root = default_cache_root()
+        self.path = os.path.join(root, name)
+        self.max_size = max_size
+        # Total size of the entries as of the last eviction plus what was
+        # put since. Other processes may add entries too, so it's only used
+        # to skip listing the directory after every put while the cache is
+        # clearly below its limit.
+        self.size_estimate = None
+        # Entries are put from several threads at once, e.g. textures
+        # decoded on a pool. This guards size_estimate and eviction.
+        self.lock = threading.Lock()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as F:
+                data = F.read()
+        except OSError:
+            return None
+        try:
+            # The modification time doubles as the last use time for eviction.
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        # Written to a temporary file first so readers never see a partial
+        # entry. A cache that can't be written is silently skipped.
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as F:
+                    F.write(data)
+                os.replace(tmp_path, self.entry_path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            return False
+        with self.lock:
+            if self.size_estimate is not None:
+                self.size_estimate += len(data)
+            if self.size_estimate is None or self.size_estimate > self.max_size:
+                self._evict(keep=key)
+        return True
+
+    def remove(self, key):
+        try:
+            os.unlink(self.entry_path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        # (last use time, size, key) for every entry
+        found = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return found
+        for name in names:
+            if name.startswith('.tmp-'):
+                continue
+            try:
+                stat = os.stat(self.entry_path(name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, stat.st_size, name))
+        return found
+
+    def evict(self, keep=None):
+        with self.lock:
+            self._evict(keep)
+
+    def _evict(self, keep=None):
+        entries = self.entries()
+        total_size = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if name == keep:
+                continue
+            self.remove(name)
+            total_size -= size
+        self.size_estimate = total_size
+
+    def clear(self):
+        with self.lock:
+            for mtime, size, name in self.entries():
+                self.remove(name)
+            self.size_estimate = None
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+# Reader for CRI Middleware CPK archives, such as Valkyria Chronicles 4's
+# BASE.CPK.
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .archive import ArchiveEntry, ValkArchive
+
+
+# @UTF column flags
+UTF_HAS_NAME = 0x10
+UTF_HAS_DEFAULT = 0x20
+UTF_PER_ROW = 0x40
+
+UTF_STRING = 0xa
+UTF_DATA = 0xb
+UTF_FORMATS = {
+    0x0: 'B',
+    0x1: 'b',
+    0x2: 'H',
+    0x3: 'h',
+    0x4: 'I',
+    0x5: 'i',
+    0x6: 'Q',
+    0x7: 'q',
+    0x8: 'f',
+    0x9: 'd',
+    UTF_STRING: 'I',
+    UTF_DATA: 'II',
+    }
+
+# Bits of a CRILAYLA stream that runs of literals are found in at once
+LITERAL_WINDOW = 1 << 16
+
+
+def decrypt_utf(data):
+    # Tables in some archives are masked with a simple multiplicative XOR.
+    m = 0x655f
+    output = bytearray(data)
+    for i in range(len(output)):
+        output[i] ^= m & 0xff
+        m = (m * 0x4115) & 0xffffffff
+    return bytes(output)
+
+
+class UTFTable:
+    # A CRI @UTF table. Every row is a dict of column name to value.
+    def __init__(self, data):
+        data = bytes(data)
+        if data[:4] != b'@UTF':
+            data = decrypt_utf(data)
+        if data[:4] != b'@UTF':
+            raise ValueError("Not a @UTF table")
+        (table_size, version, rows_offset, strings_offset, data_offset,
+            name_offset, column_count, row_length, row_count) = struct.unpack_from('>IHHIIIHHI', data, 4)
+        self.data = data
+        self.strings_begin = strings_offset + 8
+        self.data_begin = data_offset + 8
+        self.name = self.read_string(name_offset)
+        self.columns = []
+        row_format = ['>']
+        pos = 0x20
+        for i in range(column_count):
+            flags = data[pos]
+            pos += 1
+            name = None
+            if flags & UTF_HAS_NAME:
+                name = self.read_string(struct.unpack_from('>I', data, pos)[0])
+                pos += 4
+            ctype = flags & 0x0f
+            fmt = '>' + UTF_FORMATS[ctype]
+            default = None
+            if flags & UTF_HAS_DEFAULT:
+                default = self.convert(ctype, struct.unpack_from(fmt, data, pos))
+                pos += struct.calcsize(fmt)
+            per_row = bool(flags & UTF_PER_ROW)
+            if per_row:
+                row_format.append(UTF_FORMATS[ctype])
+            self.columns.append((name, ctype, per_row, default))
+        row_format = ''.join(row_format)
+        self.rows = []
+        for i in range(row_count):
+            values = iter(struct.unpack_from(row_format, data, rows_offset + 8 + i * row_length))
+            row = {}
+            for name, ctype, per_row, default in self.columns:
+                if not per_row:
+                    row[name] = default
+                elif ctype == UTF_DATA:
+                    row[name] = self.convert(ctype, (next(values), next(values)))
+                else:
+                    row[name] = self.convert(ctype, (next(values),))
+            self.rows.append(row)
+
+    def read_string(self, offset):
+        begin = self.strings_begin + offset
+        end = self.data.index(b'\x00', begin)
+        return self.data[begin:end].decode('cp932', 'replace')
+
+    def convert(self, ctype, values):
+        if ctype == UTF_STRING:
+            return self.read_string(values[0])
+        elif ctype == UTF_DATA:
+            begin = self.data_begin + values[0]
+            return self.data[begin:begin + values[1]]
+        return values[0]
+
+
+class LiteralRuns:
+    # For a window of a CRILAYLA bitstream, how many literal tokens (a 0
+    # flag bit and 8 bits of data) follow each other from every bit
+    # position, and the byte a literal at each position holds. Lets a whole
+    # run of literals be copied with one slice instead of token by token.
+    def __init__(self, stream, pos, window_bits):
+        first_byte = pos >> 3
+        self.begin = first_byte * 8
+        raw = numpy.frombuffer(stream, dtype=numpy.uint8,
+            count=min(window_bits // 8 + 2, len(stream) - first_byte), offset=first_byte)
+        bits = numpy.unpackbits(raw)
+        # Positions whose 8 data bits are all in the window
+        count = max(len(bits) - 8, 0)
+        self.end = self.begin + count
+        # The data bits of a literal at bit s of byte q are the top 8 of
+        # the 16 bits from q, shifted by s + 1.
+        pairs = (raw[:-1].astype(numpy.uint16) << 8) | raw[1:]
+        shifts = numpy.arange(7, -1, -1, dtype=numpy.uint16)
+        self.values = ((pairs[:, None] >> shifts) & 0xff).astype(numpy.uint8).ravel()[:count]
+        # Literals in a row are 9 bits apart, so with the bits in rows of 9
+        # each column is a separate sequence: the run from a position lasts
+        # until the next set flag bit below it in its column. Bits past the
+        # window count as set.
+        rows = -(-count // 9)
+        flags = numpy.ones(rows * 9, dtype=bool)
+        flags[:count] = bits[:count]
+        flags = flags.reshape(rows, 9)
+        row_ids = numpy.arange(rows, dtype=numpy.int32)[:, None]
+        next_match = numpy.where(flags, row_ids, rows)
+        next_match = numpy.minimum.accumulate(next_match[::-1], axis=0)[::-1]
+        runs = (next_match - row_ids).ravel()[:count]
+        self.runs = runs
+
+
+def decompress_crilayla(data):
+    # CRILAYLA is an LZ scheme that is decoded from the end of the file
+    # towards the beginning. The first 0x100 bytes of the output are
+    # stored uncompressed after the compressed stream.
+    data = bytes(data)
+    if data[:8] != b'CRILAYLA':
+        raise ValueError("Not CRILAYLA compressed data")
+    uncompressed_size, header_offset = struct.unpack_from('<II', data, 8)
+    header = data[0x10 + header_offset:0x10 + header_offset + 0x100]
+    # Reversing both the bitstream and the output turns this into an
+    # ordinary forward LZ77 decoder.
+    stream = data[0x10:0x10 + header_offset][::-1] + bytes(4)
+    pos = 0
+
+    def take(bit_count):
+        nonlocal pos
+        word = int.from_bytes(stream[pos >> 3:(pos >> 3) + 3], 'big')
+        value = (word >> (24 - (pos & 7) - bit_count)) & ((1 << bit_count) - 1)
+        pos += bit_count
+        return value
+
+    output = bytearray()
+    literals = None
+    while len(output) < uncompressed_size:
+        # The next 25 bits or more, at the top of a 32-bit word. That's
+        # enough for a literal, or for a match's flag, distance and first
+        # three length levels.
+        word = (int.from_bytes(stream[pos >> 3:(pos >> 3) + 4], 'big') << (pos & 7)) & 0xffffffff
+        if word & 0x80000000:
+            distance = ((word >> 18) & 0x1fff) + 3
+            length = 3
+            pos += 14
+            for bit_count, shift in ((2, 16), (3, 13), (5, 8)):
+                level = (word >> shift) & ((1 << bit_count) - 1)
+                length += level
+                pos += bit_count
+                if level != (1 << bit_count) - 1:
+                    break
+            else:
+                level = take(8)
+                length += level
+                while level == 0xff:
+                    level = take(8)
+                    length += level
+            begin = len(output) - distance
+            if begin < 0:
+                raise ValueError("Corrupt CRILAYLA data")
+            if distance >= length:
+                output += output[begin:begin + length]
+            else:
+                repeated = output[begin:]
+                output += (repeated * (length // distance + 1))[:length]
+            continue
+        # A literal followed by another one starts a run
+        if numpy is not None and not word & 0x400000:
+            if literals is None or pos >= literals.end:
+                literals = LiteralRuns(stream, pos, LITERAL_WINDOW)
+            i = pos - literals.begin
+            count = min(literals.runs.item(i), uncompressed_size - len(output))
+            if count > 1:
+                output += literals.values[i:i + 9 * count:9].tobytes()
+                pos += 9 * count
+                continue
+        output.append((word >> 23) & 0xff)
+        pos += 9
+    del output[uncompressed_size:]
+    output.reverse()
+    return header + output
+
+
+class CPKArchive(ValkArchive):
+    def __init__(self, filename, use_mmap=None):
+        super().__init__(filename, use_mmap)
+        self.header = self.read_table(0, b'CPK ').rows[0]
+        toc_offset = self.header.get('TocOffset')
+        if not toc_offset:
+            raise NotImplementedError("CPK archives without a file name table are not supported.")
+        content_offset = self.header.get('ContentOffset') or toc_offset
+        data_begin = min(toc_offset, content_offset)
+        for row in self.read_table(toc_offset, b'TOC ').rows:
+            if row.get('DirName'):
+                name = row['DirName'] + '/' + row['FileName']
+            else:
+                name = row['FileName']
+            entry = ArchiveEntry(name, data_begin + row['FileOffset'], row['FileSize'], row.get('ExtractSize'))
+            self.add_entry(entry)
+
+    def read_table(self, offset, magic):
+        self.source.seek(offset)
+        found_magic = self.source.read(4)
+        if found_magic != magic:
+            raise ValueError("Expected {} at 0x{:x}, found {}".format(magic, offset, found_magic))
+        self.source.seek(offset + 8)
+        table_size = struct.unpack('<Q', self.source.read(8))[0]
+        return UTFTable(self.source.read(table_size))
+
+    def read_entry(self, entry):
+        data = super().read_entry(entry)
+        if data[:8] == b'CRILAYLA':
+            data = decompress_crilayla(data)
+        return data
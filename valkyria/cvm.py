@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+# Reader for the CVM images used by the PS3 release of Valkyria Chronicles
+# (DATA.CVM). A CVM is a small CRI header followed by an ISO9660 image.
+
+import struct
+
+from .archive import ArchiveEntry, ValkArchive
+
+
+SECTOR_SIZE = 0x800
+# The primary volume descriptor is always in sector 16 of the ISO image.
+VOLUME_DESCRIPTOR_OFFSET = 16 * SECTOR_SIZE
+# How far into the file to look for the beginning of the ISO image.
+MAX_IMAGE_BASE = 0x10000
+
+DIRECTORY_FLAG = 0x02
+
+
+class CVMArchive(ValkArchive):
+    def __init__(self, filename, use_mmap=None):
+        super().__init__(filename, use_mmap)
+        self.source.seek(0)
+        magic = self.source.read(4)
+        if magic != b'CVMH':
+            raise ValueError("Not a CVM image: {}".format(magic))
+        self.image_base = self.find_image_base()
+        self.source.seek(self.image_base + VOLUME_DESCRIPTOR_OFFSET)
+        descriptor = self.source.read(SECTOR_SIZE)
+        self.block_size = struct.unpack_from('<H', descriptor, 128)[0]
+        root_extent, root_size = self.unpack_extent(descriptor, 156)
+        self.index_directories(root_extent, root_size)
+
+    def find_image_base(self):
+        for base in range(0, MAX_IMAGE_BASE, SECTOR_SIZE):
+            self.source.seek(base + VOLUME_DESCRIPTOR_OFFSET)
+            if self.source.read(7) == b'\x01CD001\x01':
+                return base
+        raise ValueError("No ISO9660 volume found in {}. The image may be encrypted.".format(self.filename))
+
+    def unpack_extent(self, data, record_begin):
+        # Directory records store both-endian values; the little-endian
+        # half comes first.
+        return struct.unpack_from('<I4xI', data, record_begin + 2)
+
+    def index_directories(self, root_extent, root_size):
+        pending = [('', root_extent, root_size)]
+        visited = set()
+        while pending:
+            path, extent, size = pending.pop()
+            if extent in visited:
+                continue
+            visited.add(extent)
+            self.source.seek(self.image_base + extent * self.block_size)
+            data = self.source.read(size)
+            pos = 0
+            while pos < len(data):
+                record_length = data[pos]
+                if record_length == 0:
+                    # Records never cross a sector boundary.
+                    pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+                    continue
+                child_extent, child_size = self.unpack_extent(data, pos)
+                flags = data[pos + 25]
+                name_length = data[pos + 32]
+                name = data[pos + 33:pos + 33 + name_length]
+                pos += record_length
+                if name in (b'\x00', b'\x01'):
+                    # '.' and '..'
+                    continue
+                name = name.decode('ascii', 'replace').split(';')[0]
+                if name.endswith('.'):
+                    name = name[:-1]
+                full_name = path + '/' + name if path else name
+                if flags & DIRECTORY_FLAG:
+                    pending.append((full_name, child_extent, child_size))
+                else:
+                    offset = self.image_base + child_extent * self.block_size
+                    self.add_entry(ArchiveEntry(full_name, offset, child_size))
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+# DDS header parsing and in-memory texture decoding. The format of a
+# texture is read from its header, including the DX10 extension header
+# that BC7 textures use, so each texture can go straight to the decoder
+# that handles it.
+
+import struct
+
+try:
+    import numpy
+    from . import bc7
+    from . import dxt
+except ImportError:
+    # Decoding needs NumPy
+    numpy = None
+
+
+DDS_MAGIC = b'DDS '
+HEADER = struct.Struct('<7I44x8I5I')
+# Offsets of the height, width, pitch and mip count fields, which
+# extract_level() rewrites
+HEIGHT_OFFSET = 12
+MIP_COUNT_OFFSET = 28
+DX10_HEADER = struct.Struct('<5I')
+
+# Pixel format flags
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDPF_LUMINANCE = 0x20000
+
+FOURCC_FORMATS = {
+    b'DXT1': 'BC1',
+    b'DXT2': 'BC2',
+    b'DXT3': 'BC2',
+    b'DXT4': 'BC3',
+    b'DXT5': 'BC3',
+    b'ATI1': 'BC4',
+    b'BC4U': 'BC4',
+    b'ATI2': 'BC5',
+    b'BC5U': 'BC5',
+    }
+
+DXGI_FORMATS = {
+    27: 'RGBA',
+    28: 'RGBA',
+    29: 'RGBA',
+    70: 'BC1',
+    71: 'BC1',
+    72: 'BC1',
+    73: 'BC2',
+    74: 'BC2',
+    75: 'BC2',
+    76: 'BC3',
+    77: 'BC3',
+    78: 'BC3',
+    79: 'BC4',
+    80: 'BC4',
+    82: 'BC5',
+    83: 'BC5',
+    87: 'BGRA',
+    91: 'BGRA',
+    95: 'BC6H',
+    96: 'BC6H',
+    97: 'BC7',
+    98: 'BC7',
+    99: 'BC7',
+    }
+
+# Bytes per 4x4 block of block compressed formats
+BLOCK_SIZES = {
+    'BC1': 8,
+    'BC2': 16,
+    'BC3': 16,
+    'BC4': 8,
+    'BC5': 16,
+    'BC6H': 16,
+    'BC7': 16,
+    }
+
+
+class DDSHeader:
+    def __init__(self, data):
+        if bytes(data[:4]) != DDS_MAGIC:
+            raise ValueError("Not a DDS file")
+        (size, flags, self.height, self.width, pitch, depth, mip_count,
+            pf_size, self.pf_flags, fourcc, self.bit_count,
+            self.r_mask, self.g_mask, self.b_mask, self.a_mask,
+            caps, caps2, caps3, caps4, reserved) = HEADER.unpack_from(data, 4)
+        mip_count = max(mip_count, 1)
+        self.fourcc = struct.pack('<I', fourcc)
+        self.dxgi_format = None
+        self.data_offset = 4 + HEADER.size
+        if self.pf_flags & DDPF_FOURCC and self.fourcc == b'DX10':
+            self.dxgi_format = DX10_HEADER.unpack_from(data, self.data_offset)[0]
+            self.data_offset += DX10_HEADER.size
+        self.format = self.find_format()
+        # Only count the mip levels that are actually in the data. Without
+        # level sizes they can't be found, so only the top level is used.
+        self.mip_count = 1
+        end = self.data_offset + self.image_size(self.width, self.height)
+        while self.sizes_known() and self.mip_count < mip_count:
+            end += self.image_size(*self.level_size(self.mip_count))
+            if end > len(data):
+                break
+            self.mip_count += 1
+
+    def find_format(self):
+        # A format name from FOURCC_FORMATS or DXGI_FORMATS, 'RGB' for
+        # other uncompressed formats described by bit masks, or None.
+        if self.dxgi_format is not None:
+            return DXGI_FORMATS.get(self.dxgi_format)
+        if self.pf_flags & DDPF_FOURCC:
+            return FOURCC_FORMATS.get(self.fourcc)
+        if self.pf_flags & (DDPF_RGB | DDPF_LUMINANCE):
+            return 'RGB'
+        return None
+
+    def sizes_known(self):
+        # Whether image_size() is right for this format
+        if self.format in BLOCK_SIZES or self.format in ('RGBA', 'BGRA'):
+            return True
+        return self.format == 'RGB' and self.bit_count > 0 and self.bit_count % 8 == 0
+
+    def image_size(self, width, height):
+        # Bytes of one mip level of the given size
+        if self.format in BLOCK_SIZES:
+            return ((width + 3) // 4) * ((height + 3) // 4) * BLOCK_SIZES[self.format]
+        if self.format in ('RGBA', 'BGRA'):
+            return width * height * 4
+        return width * height * (self.bit_count // 8)
+
+    def level_size(self, level):
+        # (width, height) of a mip level
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+    def level_offset(self, level):
+        offset = self.data_offset
+        for i in range(level):
+            offset += self.image_size(*self.level_size(i))
+        return offset
+
+    def choose_level(self, level=0, max_size=None):
+        # The mip level to use for a texture: level, or a smaller one if
+        # that's still bigger than max_size on its longest side. Limited to
+        # the levels the texture has, so always 0 for formats whose level
+        # sizes aren't known.
+        level = min(level, self.mip_count - 1)
+        while max_size and level < self.mip_count - 1 and max(self.level_size(level)) > max_size:
+            level += 1
+        return level
+
+
+def read_header(data):
+    return DDSHeader(data)
+
+
+def decode_rgba(data, width, height):
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8, count=width * height * 4)
+    return pixels.reshape(height, width, 4)
+
+
+def decode_bgra(data, width, height):
+    return decode_rgba(data, width, height)[:, :, [2, 1, 0, 3]]
+
+
+def decode_masked(data, width, height, header):
+    # Uncompressed pixels described by bit masks, e.g. A8R8G8B8, R5G6B5 or
+    # 8-bit luminance
+    pixel_size = header.bit_count // 8
+    pixel_bytes = numpy.frombuffer(data, dtype=numpy.uint8, count=width * height * pixel_size)
+    values = numpy.zeros(width * height, dtype=numpy.uint32)
+    for i in range(pixel_size):
+        values |= pixel_bytes[i::pixel_size].astype(numpy.uint32) << (8 * i)
+    pixels = numpy.empty((width * height, 4), dtype=numpy.uint8)
+    if header.pf_flags & DDPF_LUMINANCE:
+        masks = (header.r_mask, header.r_mask, header.r_mask, header.a_mask)
+    else:
+        masks = (header.r_mask, header.g_mask, header.b_mask, header.a_mask)
+    for channel, mask in enumerate(masks):
+        if not mask or (channel == 3 and not header.pf_flags & DDPF_ALPHAPIXELS):
+            pixels[:, channel] = 0 if channel < 3 else 255
+            continue
+        shift = (mask & -mask).bit_length() - 1
+        maximum = mask >> shift
+        channel_values = (values & mask) >> shift
+        pixels[:, channel] = (channel_values * 255 + maximum // 2) // maximum
+    return pixels.reshape(height, width, 4)
+
+
+# Formats that can be decoded in memory, by format name. Each decoder takes
+# (data, width, height) and returns (height, width, 4) RGBA bytes.
+decoders = {}
+if numpy is not None:
+    decoders.update({
+        'BC1': dxt.decode_bc1,
+        'BC2': dxt.decode_bc2,
+        'BC3': dxt.decode_bc3,
+        'BC7': bc7.decode_bc7,
+        'RGBA': decode_rgba,
+        'BGRA': decode_bgra,
+        })
+
+
+def can_decode(header):
+    if header.format == 'RGB':
+        return numpy is not None and header.bit_count in (8, 16, 24, 32)
+    return header.format in decoders
+
+
+def decode(data, header=None, level=0):
+    # A mip level of a DDS file, the top one by default, as
+    # (height, width, 4) RGBA bytes, top row first
+    if header is None:
+        header = read_header(data)
+    if not can_decode(header):
+        raise NotImplementedError("Decoding {} textures is not supported.".format(header.format))
+    width, height = header.level_size(level)
+    offset = header.level_offset(level)
+    image_data = memoryview(data)[offset:offset + header.image_size(width, height)]
+    if header.format == 'RGB':
+        return decode_masked(image_data, width, height, header)
+    return decoders[header.format](image_data, width, height)
+
+
+def downsample(pixels, max_size):
+    # Every nth pixel of a (height, width, 4) image, so that its longest
+    # side is at most max_size. For textures without the mip level needed.
+    step = -(-max(pixels.shape[:2]) // max_size)
+    if step <= 1:
+        return pixels
+    return pixels[::step, ::step]
+
+
+def extract_level(data, header, level):
+    # A DDS file holding only one mip level of another, for textures that
+    # are loaded by Blender instead of decoded here
+    if not header.sizes_known():
+        raise ValueError("Mip levels of {} textures can't be found.".format(header.format))
+    width, height = header.level_size(level)
+    size = header.image_size(width, height)
+    offset = header.level_offset(level)
+    if header.format in BLOCK_SIZES:
+        pitch = size
+    else:
+        pitch = header.image_size(width, 1)
+    result = bytearray(data[:header.data_offset])
+    struct.pack_into('<3I', result, HEIGHT_OFFSET, height, width, pitch)
+    struct.pack_into('<I', result, MIP_COUNT_OFFSET, 1)
+    result += data[offset:offset + size]
+    return bytes(result)
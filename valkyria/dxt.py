@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# DXT1/DXT3/DXT5 (BC1/BC2/BC3) texture decoders. Each block's palette is
+# built with NumPy for all blocks at once, then every pixel looks its
+# color up in its block's palette.
+
+import numpy
+
+
+def block_array(data, width, height, block_size):
+    blocks_wide = (width + 3) // 4
+    blocks_high = (height + 3) // 4
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=blocks_wide * blocks_high * block_size)
+    return blocks.reshape(-1, block_size)
+
+
+def blocks_to_image(pixels, width, height):
+    # (blocks, 16, 4) pixels to a (height, width, 4) image
+    blocks_wide = (width + 3) // 4
+    blocks_high = (height + 3) // 4
+    pixels = pixels.reshape(blocks_high, blocks_wide, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape(blocks_high * 4, blocks_wide * 4, 4)[:height, :width]
+
+
+def expand_565(colors):
+    # (blocks,) 16-bit colors to (blocks, 3) 8-bit RGB
+    red = (colors >> 11) & 0x1f
+    green = (colors >> 5) & 0x3f
+    blue = colors & 0x1f
+    return numpy.stack([
+        (red << 3) | (red >> 2),
+        (green << 2) | (green >> 4),
+        (blue << 3) | (blue >> 2),
+        ], axis=1)
+
+
+def unpack_indices(words, bits):
+    # (blocks,) integers holding 16 indices to (blocks, 16) indices,
+    # pixel 0 in the lowest bits
+    shifts = numpy.arange(16, dtype=numpy.uint64) * numpy.uint64(bits)
+    return ((words[:, None] >> shifts) & numpy.uint64((1 << bits) - 1)).astype(numpy.intp)
+
+
+def decode_color_blocks(blocks, allow_transparent):
+    # 8-byte color blocks to (blocks, 16, 4) RGBA. Only DXT1 uses the three
+    # color mode with a transparent fourth color.
+    count = len(blocks)
+    color_0 = blocks[:, 0].astype(numpy.int32) | (blocks[:, 1].astype(numpy.int32) << 8)
+    color_1 = blocks[:, 2].astype(numpy.int32) | (blocks[:, 3].astype(numpy.int32) << 8)
+    rgb_0 = expand_565(color_0)
+    rgb_1 = expand_565(color_1)
+    palette = numpy.empty((count, 4, 4), dtype=numpy.int32)
+    palette[:, 0, :3] = rgb_0
+    palette[:, 1, :3] = rgb_1
+    palette[:, 2, :3] = (2 * rgb_0 + rgb_1) // 3
+    palette[:, 3, :3] = (rgb_0 + 2 * rgb_1) // 3
+    palette[:, :, 3] = 255
+    if allow_transparent:
+        three_color = color_0 <= color_1
+        palette[three_color, 2, :3] = (rgb_0[three_color] + rgb_1[three_color]) // 2
+        palette[three_color, 3] = 0
+    words = blocks[:, 4:8].copy().view('<u4')[:, 0].astype(numpy.uint64)
+    indices = unpack_indices(words, 2)
+    return palette.astype(numpy.uint8)[numpy.arange(count)[:, None], indices]
+
+
+def decode_alpha_blocks(blocks):
+    # 8-byte interpolated alpha blocks (DXT5) to (blocks, 16) alpha
+    count = len(blocks)
+    alpha_0 = blocks[:, 0].astype(numpy.int32)
+    alpha_1 = blocks[:, 1].astype(numpy.int32)
+    palette = numpy.empty((count, 8), dtype=numpy.int32)
+    palette[:, 0] = alpha_0
+    palette[:, 1] = alpha_1
+    eight_alpha = alpha_0 > alpha_1
+    for i in range(1, 7):
+        palette[:, i + 1] = numpy.where(eight_alpha,
+            ((7 - i) * alpha_0 + i * alpha_1) // 7,
+            ((5 - i) * alpha_0 + i * alpha_1) // 5)
+    palette[~eight_alpha, 6] = 0
+    palette[~eight_alpha, 7] = 255
+    words = numpy.zeros((count, 8), dtype=numpy.uint8)
+    words[:, :6] = blocks[:, 2:8]
+    indices = unpack_indices(words.view('<u8')[:, 0], 3)
+    return palette.astype(numpy.uint8)[numpy.arange(count)[:, None], indices]
+
+
+def decode_bc1(data, width, height):
+    blocks = block_array(data, width, height, 8)
+    return blocks_to_image(decode_color_blocks(blocks, True), width, height)
+
+
+def decode_bc2(data, width, height):
+    blocks = block_array(data, width, height, 16)
+    pixels = decode_color_blocks(blocks[:, 8:], False)
+    # 4-bit alpha per pixel
+    alpha = numpy.empty((len(blocks), 16), dtype=numpy.uint8)
+    alpha[:, 0::2] = blocks[:, :8] & 0x0f
+    alpha[:, 1::2] = blocks[:, :8] >> 4
+    pixels[:, :, 3] = alpha * 17
+    return blocks_to_image(pixels, width, height)
+
+
+def decode_bc3(data, width, height):
+    blocks = block_array(data, width, height, 16)
+    pixels = decode_color_blocks(blocks[:, 8:], False)
+    pixels[:, :, 3] = decode_alpha_blocks(blocks[:, :8])
+    return blocks_to_image(pixels, width, height)
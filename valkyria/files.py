@@ -1,26 +1,355 @@
 #!/usr/bin/python3
 
+import collections
+import io
+import itertools
+import mmap
+import os
 import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DEBUG = False
+USE_MMAP = True
+USE_INDEX_CACHE = True
+DECODE_THREADS = min(8, os.cpu_count() or 1)
 
 
-class ValkFile:
-    filename = None
-    def __init__(self, F, offset=None):
+class ValkSource:
+    # Random-access byte source backed by an ordinary file object.
+    # seek()/read() share one cursor; chunks use pread(), which doesn't, so
+    # different chunks can be read from several threads at once.
+    archive = None
+    chunk_index = None
+
+    def __init__(self, F, filename=None):
+        self.F = F
+        self.filename = filename
+        self.lock = threading.Lock()
+        try:
+            self.fileno = F.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.fileno = None
+        # In-memory files are read by slicing their buffer, which needs
+        # neither the lock nor the shared cursor.
+        self.buffer = None
+        if isinstance(F, io.BytesIO):
+            self.buffer = F.getbuffer()
+
+    def seek(self, pos, whence=0):
+        return self.F.seek(pos, whence)
+
+    def tell(self):
+        return self.F.tell()
+
+    def read(self, size):
+        return self.F.read(size)
+
+    def read_view(self, size):
+        # Plain files can't hand out views, so this is an ordinary read.
+        return self.F.read(size)
+
+    def pread(self, offset, size):
+        if self.buffer is not None:
+            return self.buffer[offset:offset + size].tobytes()
+        if self.fileno is not None and hasattr(os, 'pread'):
+            data = os.pread(self.fileno, size, offset)
+            if len(data) < size:
+                # Short reads are allowed; keep going until EOF.
+                parts = [data]
+                while size > 0 and data:
+                    size -= len(data)
+                    offset += len(data)
+                    data = os.pread(self.fileno, size, offset)
+                    parts.append(data)
+                data = b''.join(parts)
+            return data
+        with self.lock:
+            self.F.seek(offset)
+            return self.F.read(size)
+
+    def pread_view(self, offset, size):
+        return self.pread(offset, size)
+
+    def get_size(self):
+        with self.lock:
+            pos = self.F.tell()
+            size = self.F.seek(0, os.SEEK_END)
+            self.F.seek(pos)
+        return size
+
+    def close(self):
+        # The descriptor number may be reused by the next open(), so
+        # pread() must not use it any more.
+        self.fileno = None
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        self.F.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ValkBufferSource(ValkSource):
+    # Byte source over a buffer that is already in memory, such as an
+    # archive member. read_view() returns zero-copy memoryview slices.
+    def __init__(self, data, filename=None):
+        self.F = None
+        self.filename = filename
+        self.view = memoryview(data)
+        self.size = len(self.view)
+        self.pos = 0
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size):
+        data = self.view[self.pos:self.pos + size].tobytes()
+        self.pos += len(data)
+        return data
+
+    def read_view(self, size):
+        view = self.view[self.pos:self.pos + size]
+        self.pos += len(view)
+        return view
+
+    def pread(self, offset, size):
+        return self.view[offset:offset + size].tobytes()
+
+    def pread_view(self, offset, size):
+        return self.view[offset:offset + size]
+
+    def get_size(self):
+        return self.size
+
+    def close(self):
+        try:
+            self.view.release()
+        except BufferError:
+            # Someone still holds a view of the data. It's freed once they
+            # let go of it.
+            pass
+
+
+class ValkMappedSource(ValkBufferSource):
+    # Byte source that maps the whole file once.
+    def __init__(self, F, filename=None):
+        try:
+            # Without trackfd the map doesn't hold a descriptor of its own,
+            # so close() frees it even if parts of the map are still viewed.
+            self.map = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ, trackfd=False)
+        except TypeError:
+            # Before Python 3.13
+            self.map = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+        super().__init__(self.map, filename)
         self.F = F
+
+    def read(self, size):
+        data = self.map[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def pread(self, offset, size):
+        return self.map[offset:offset + size]
+
+    def close(self):
+        # The file is closed even if parts of the mapping are still viewed,
+        # e.g. by arrays. The mapping itself goes away with the last view.
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            pass
+        self.F.close()
+
+
+def swap_word(value):
+    return ((value & 0xff) << 8) | (value >> 8)
+
+
+def unpack_floats(data, count, endianness='<'):
+    # Decodes count 32-bit floats to a list of Python floats.
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=endianness + 'f4', count=count).tolist()
+    return list(struct.unpack('{}{}f'.format(endianness, count), data[:4 * count]))
+
+
+def unpack_half_floats(data, count, endianness='<'):
+    # Decodes count IEEE half floats to a list of Python floats.
+    if numpy is not None:
+        halves = numpy.frombuffer(data, dtype=endianness + 'f2', count=count)
+        return halves.astype(numpy.float32).tolist()
+    return list(struct.unpack('{}{}e'.format(endianness, count), data[:2 * count]))
+
+
+def unpack_fixed(data, count, size, fraction_bits, endianness='<'):
+    # Decodes count signed fixed-point values that are size bytes long and
+    # have fraction_bits bits after the binary point.
+    codes = {1: 'b', 2: 'h'}
+    scale = 2 ** fraction_bits
+    if numpy is not None:
+        values = numpy.frombuffer(data, dtype=endianness + 'i{}'.format(size), count=count)
+        return (values / scale).tolist()
+    values = struct.unpack('{}{}{}'.format(endianness, count, codes[size]), data[:size * count])
+    return [value / scale for value in values]
+
+
+class RecordLayout:
+    # Describes one row of a fixed-size table as a list of
+    # (name, struct code) pairs, compiled to a single struct.Struct.
+    # Fields named None are padding and must use an 'x' code. An optional
+    # third item is a function applied to the unpacked value. If size is
+    # given, the row is padded out to that many bytes.
+    def __init__(self, endianness, fields, size=None):
+        self.names = []
+        self.converters = {}
+        codes = []
+        for field in fields:
+            name, code = field[0], field[1]
+            codes.append(code)
+            if name is None:
+                continue
+            self.names.append(name)
+            if len(field) > 2:
+                self.converters[name] = field[2]
+        self.struct = struct.Struct(endianness + ''.join(codes))
+        if size is not None:
+            assert size >= self.struct.size
+            if size > self.struct.size:
+                codes.append('{}x'.format(size - self.struct.size))
+                self.struct = struct.Struct(endianness + ''.join(codes))
+        self.size = self.struct.size
+
+    def make_row(self, values):
+        row = dict(zip(self.names, values))
+        for name, convert in self.converters.items():
+            row[name] = convert(row[name])
+        return row
+
+    def unpack_from(self, data, offset=0):
+        return self.make_row(self.struct.unpack_from(data, offset))
+
+    def unpack_rows(self, data, count):
+        data = data[:self.size * count]
+        return [self.make_row(values) for values in self.struct.iter_unpack(data)]
+
+
+class ChunkType(type):
+    # Chunk classes that don't list __slots__ of their own get empty ones,
+    # so no chunk has an instance dict.
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        namespace.setdefault('__slots__', ())
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+
+class ValkFile(metaclass=ChunkType):
+    # Large files have tens of thousands of chunks, so everything a chunk
+    # stores lives in slots: the bookkeeping every chunk has here, and the
+    # parsed data in the slots of the subclass that reads it.
+    __slots__ = (
+        'F', 'offset', 'source', 'base', 'pos', 'filename',
+        'ftype', 'header_length', 'main_length', 'total_length',
+        'children_found', 'index_id', '_inner_files', '_by_type',
+        '__weakref__',
+        )
+
+    def __init__(self, F, offset=None):
         if offset is None:
             offset = F.tell()
-        self.offset = offset
-        self.inner_files = []
+        self.set_position(F, offset)
         self.read_meta()
 
+    @classmethod
+    def from_meta(cls, F, offset, ftype, header_length, main_length, total_length):
+        # Rebuilds a chunk from previously read header values, e.g. from the
+        # chunk index, without touching the file.
+        self = cls.__new__(cls)
+        self.set_position(F, offset)
+        self.ftype = sys.intern(ftype)
+        if header_length is not None:
+            self.header_length = header_length
+        if main_length is not None:
+            self.main_length = main_length
+        self.total_length = total_length
+        return self
+
+    def set_position(self, F, offset):
+        self.F = F
+        self.offset = offset
+        # Every chunk has its own cursor, relative to its beginning.
+        self.pos = 0
+        # Resolve the absolute position once so reads go straight to the
+        # root source instead of through every enclosing chunk.
+        if isinstance(F, ValkFile):
+            self.source = F.source
+            self.base = F.base + offset
+        else:
+            self.source = F
+            self.base = offset
+        self.filename = None
+        self.children_found = False
+        self.index_id = None
+        # Children in file order, and the same children grouped by type.
+        # The list is made when the first child is added, the grouping the
+        # first time a child is looked up by type.
+        self._inner_files = None
+        self._by_type = None
+
+    def children_of_type(self, name):
+        # Children are reached by type, e.g. hmdl.KFMD. They're looked for
+        # the first time one of them is asked for, so unused branches of a
+        # file are never read.
+        if not self.children_found:
+            self.find_children()
+        if self._by_type is None and self._inner_files is not None:
+            self._by_type = {}
+            for inner_file in self._inner_files:
+                self._by_type.setdefault(inner_file.ftype, []).append(inner_file)
+        if self._by_type is not None and name in self._by_type:
+            return self._by_type[name]
+        raise AttributeError("{} has no attribute {}".format(type(self).__name__, repr(name)))
+
+    @property
+    def parent(self):
+        if isinstance(self.F, ValkFile):
+            return self.F
+        return None
+
+    @property
+    def inner_files(self):
+        self.find_children()
+        if self._inner_files is None:
+            return []
+        return self._inner_files
+
     def seek(self, pos, relative=False):
         if DEBUG == 2:
             print("Seeking to 0x{:x}".format(pos), relative)
-        if relative:
-            return self.F.seek(pos, relative) - self.offset
-        return self.F.seek(self.offset + pos) - self.offset
+        if relative == os.SEEK_END:
+            self.pos = self.source.get_size() - self.base + pos
+        elif relative:
+            self.pos += pos
+        else:
+            self.pos = pos
+        return self.pos
 
     def follow_ptr(self, pointer):
         if hasattr(self, 'vc_game') and self.vc_game == 4:
@@ -28,15 +357,36 @@ class ValkFile:
         return self.seek(pointer)
 
     def tell(self):
-        return self.F.tell() - self.offset
+        return self.pos
 
     def read(self, size):
         if DEBUG == 2:
             print("Reading 0x{:x} bytes".format(size))
-        return self.F.read(size)
+        data = self.source.pread(self.base + self.pos, size)
+        self.pos += len(data)
+        return data
+
+    def read_view(self, size):
+        # Like read(), but may return a zero-copy memoryview when the
+        # underlying source is memory-mapped.
+        if DEBUG == 2:
+            print("Viewing 0x{:x} bytes".format(size))
+        data = self.source.pread_view(self.base + self.pos, size)
+        self.pos += len(data)
+        return data
+
+    def pread(self, pos, size):
+        # Reads at pos without moving the cursor.
+        return self.source.pread(self.base + pos, size)
+
+    def read_records(self, layout, count):
+        # Reads count consecutive rows described by a RecordLayout.
+        if count <= 0:
+            return []
+        data = self.read_view(layout.size * count)
+        return layout.unpack_rows(data, count)
 
     def read_and_unpack(self, size, unpack):
-        oldpos = self.F.tell()
         value = struct.unpack(unpack, self.read(size))[0]
         return value
 
@@ -71,32 +421,17 @@ class ValkFile:
         return self.read_and_unpack(4, '>f')
 
     def read_half_float_be(self):
-        # http://davidejones.com/blog/1413-python-precision-floating-point/
-        word = self.read_and_unpack(2, '>h')
-        sign = (word >> 15) & 0x0001
-        exponent = (word >> 10) & 0x001f
-        fraction = word & 0x03ff
-        int32 = None
-        if exponent == 0:
-            if fraction == 0:
-                int32 = sign << 31
-            else:
-                while not (fraction & 0x0400):
-                    fraction = fraction << 1
-                    exponent -= 1
-                exponent += 1
-                fraction &= 0x0400
-        elif exponent == 31:
-            if fraction == 0:
-                int32 = (sign << 31) | 0x7f800000
-            else:
-                int32 = (sign << 31) | 0x7f800000 | (fraction << 13)
-        if int32 is None:
-            exponent = exponent + (127 -15)
-            fraction = fraction << 13
-            int32 = (sign << 31) | (exponent << 23) | fraction
-        packed = struct.pack('I', int32)
-        return struct.unpack('f', packed)[0]
+        return self.read_and_unpack(2, '>e')
+
+    def read_floats_be(self, count):
+        return unpack_floats(self.read_view(4 * count), count, '>')
+
+    def read_half_floats_be(self, count):
+        return unpack_half_floats(self.read_view(2 * count), count, '>')
+
+    def read_fixed_be(self, count, size, fraction_bits):
+        # Signed 8- or 16-bit fixed-point values
+        return unpack_fixed(self.read_view(size * count), count, size, fraction_bits, '>')
 
     def read_long_long_le(self):
         # https://youtu.be/sZsJyCyGBSI
@@ -127,7 +462,8 @@ class ValkFile:
 
     def read_meta(self):
         self.seek(0)
-        self.ftype = self.read(4).decode('ascii')
+        # Interned, so the chunks of a type share one string
+        self.ftype = sys.intern(self.read(4).decode('ascii'))
         if DEBUG:
             print("Creating", self.ftype)
         self.main_length = self.read_long_le()
@@ -148,9 +484,8 @@ class ValkFile:
             done = running_length >= max_length
         return done
 
-    def read_file_chain(self, start=0, max_length=None):
+    def iter_file_chain(self, start=0, max_length=None):
         running_length = 0
-        inner_files = []
         if max_length is None:
             done = False
         else:
@@ -158,27 +493,64 @@ class ValkFile:
         while not done:
             chunk_begin = start + running_length
             inner_file = valk_factory(self, chunk_begin)
-            inner_files.append(inner_file)
+            yield inner_file
             running_length += inner_file.total_length
             done = self.file_chain_done(running_length, max_length, inner_file)
-        return inner_files
 
-    def container_func(self):
-        if self.header_length < 0x20:
-            return
+    def read_file_chain(self, start=0, max_length=None):
+        return list(self.iter_file_chain(start, max_length))
+
+    def chain_bounds(self):
+        # Where a standard container's children are: (begin, length)
         self.seek(0x14)
         chunk_length = self.read_long_le()
         chain_begin = self.header_length + chunk_length
         chain_length = self.main_length - chunk_length
-        inner_files = self.read_file_chain(chain_begin, chain_length)
+        return chain_begin, chain_length
+
+    def container_func(self):
+        if self.header_length < 0x20:
+            return
+        inner_files = self.read_file_chain(*self.chain_bounds())
         for inner_file in inner_files:
             self.add_inner_file(inner_file)
 
-    def find_inner_files(self):
+    def find_children(self):
+        if self.children_found:
+            return
+        self.children_found = True
+        if self.index_id is not None:
+            inner_files = self.source.chunk_index.children(self)
+            if inner_files is not None:
+                for inner_file in inner_files:
+                    self.add_inner_file(inner_file)
+                return
         self.container_func()
+
+    def find_inner_files(self):
+        # Eagerly discovers the whole tree below this chunk.
         for inner_file in self.inner_files:
             inner_file.find_inner_files()
 
+    def iter_inner_files(self):
+        # Like inner_files, but standard containers hand out their children
+        # one at a time without keeping them.
+        cls = type(self)
+        standard = (cls.container_func is ValkFile.container_func and
+            cls.read_file_chain is ValkFile.read_file_chain and
+            cls.file_chain_done is ValkFile.file_chain_done)
+        if self.children_found or self.index_id is not None or not standard:
+            yield from self.inner_files
+        elif self.header_length >= 0x20:
+            yield from self.iter_file_chain(*self.chain_bounds())
+
+    def forget_children(self):
+        # Drops the children found so far so they can be freed. They are
+        # found again if they're needed later.
+        self._inner_files = None
+        self._by_type = None
+        self.children_found = False
+
     def container_path(self, so_far=[]):
         if hasattr(self.F, 'container_path'):
             return self.F.container_path() + [self.ftype]
@@ -186,11 +558,11 @@ class ValkFile:
             return [self.filename, self.ftype]
 
     def add_inner_file(self, inner_file):
-        self.inner_files.append(inner_file)
-        if not hasattr(self, inner_file.ftype):
-            setattr(self, inner_file.ftype, [])
-        files_of_this_type = getattr(self, inner_file.ftype)
-        files_of_this_type.append(inner_file)
+        if self._inner_files is None:
+            self._inner_files = []
+        self._inner_files.append(inner_file)
+        if self._by_type is not None:
+            self._by_type.setdefault(inner_file.ftype, []).append(inner_file)
 
 
 class ValkUnknown(ValkFile):
@@ -249,6 +621,8 @@ class ValkEOFC(ValkFile):
 class ValkHSHP(ValkFile):
     # Standard container
     # Shape keys
+    __slots__ = ('shape_keys',)
+
     def read_data(self):
         assert len(self.KFSH) == 1
         kfsh = self.KFSH[0]
@@ -259,6 +633,8 @@ class ValkHSHP(ValkFile):
 class ValkKFSH(ValkFile):
     # Standard container
     # Shape keys
+    __slots__ = ('shape_keys',)
+
     def read_data(self):
         assert len(self.KFSS) == 1 and len(self.KFSG) == 1
         kfss = self.KFSS[0]
@@ -282,6 +658,39 @@ class ValkKFSH(ValkFile):
 class ValkKFSS(ValkFile):
     # Doesn't contain other files.
     # Describes shape keys
+    __slots__ = (
+        'shape_keys', 'vc_game', 'key_count', 'key_list_ptr',
+        'vertex_format_count', 'vertex_format_ptr', 'vertex_formats',
+        'group_count', 'group_list_ptr',
+        )
+
+    VERTEX_FORMAT_LAYOUTS = {
+        1: RecordLayout('>', [
+            ('bytes_per_vertex', 'I'),
+            (None, '8x'),
+            ('vertex_count', 'I'),
+            ]),
+        4: RecordLayout('<', [
+            ('kfmg_ptr', 'I'),
+            ('kfsg_ptr', 'I'),
+            ('vertex_count', 'I'),
+            ('skip_count', 'I'),
+            ('skip_ptr', 'I'),
+            (None, '16x'),
+            ('bytes_per_vertex', 'I'),
+            ('struct_def_row_count', 'I'),
+            (None, '4x'),
+            ('struct_def_ptr', 'Q'),
+            ], size=0x80),
+        }
+    STRUCT_DEF_LAYOUT = RecordLayout('<', [
+        ('info_type', 'I'), # Position, UV
+        ('data_type', 'I'), # 0x1 = Byte, 0xa = Float
+        ('unknown', 'I'), # related to UV somehow?
+        ('offset', 'I'), # bytes before this item in the struct
+        ('value_count', 'I'), # 2 (u,v) or 3 (x,y,z)
+        ])
+
     def read_toc(self):
         self.seek(self.header_length)
         version = self.read_long_le()
@@ -311,47 +720,23 @@ class ValkKFSS(ValkFile):
     def read_vertex_formats(self):
         if self.vc_game == 1:
             self.follow_ptr(self.vertex_format_ptr + 0x8)
-            vertfmt = {
-                'kfsg_ptr': 0,
-                'bytes_per_vertex': self.read_long_be(),
-                'unk': self.read(0x8),
-                'vertex_count': self.read_long_be(),
-            }
-            del(vertfmt['unk'])
+            vertfmt = {'kfsg_ptr': 0}
+            vertfmt.update(self.read_records(self.VERTEX_FORMAT_LAYOUTS[1], 1)[0])
             assert vertfmt['bytes_per_vertex'] in [0x0, 0xc, 0x14]
             self.vertex_formats = [vertfmt]
         elif self.vc_game == 4:
-            item_length = 0x80
-            self.vertex_formats = []
-            for i in range(self.vertex_format_count):
-                item_start = self.vertex_format_ptr + item_length * i
-                self.follow_ptr(item_start)
-                vertfmt = {
-                    'kfmg_ptr': self.read_long_le(),
-                    'kfsg_ptr': self.read_long_le(),
-                    'vertex_count': self.read_long_le(),
-                    'skip_count': self.read_long_le(),
-                    'skip_ptr': self.read_long_le(),
-                    'unk': self.read(0x10),
-                    'bytes_per_vertex': self.read_long_le(),
-                }
-                del(vertfmt['unk'])
-                struct_def_row_count = self.read_long_le()
+            self.follow_ptr(self.vertex_format_ptr)
+            self.vertex_formats = self.read_records(self.VERTEX_FORMAT_LAYOUTS[4], self.vertex_format_count)
+            for vertfmt in self.vertex_formats:
+                struct_def_row_count = vertfmt.pop('struct_def_row_count')
+                struct_def_ptr = vertfmt.pop('struct_def_ptr')
                 if struct_def_row_count:
-                    vertfmt['struct_def'] = []
-                self.read(4)
-                struct_def_ptr = self.read_long_long_le()
-                self.follow_ptr(struct_def_ptr)
-                for j in range(struct_def_row_count):
-                    info_type = self.read_long_le() # Position, UV
-                    data_type = self.read_long_le() # 0x1 = Byte, 0xa = Float
-                    unknown = self.read_long_le() # related to UV somehow?
-                    offset = self.read_long_le() # bytes before this item in the struct
-                    value_count = self.read_long_le() # 2 (u,v) or 3 (x,y,z)
-                    struct_row = (offset, (info_type, data_type, value_count))
-                    vertfmt['struct_def'].append(struct_row)
+                    self.follow_ptr(struct_def_ptr)
+                    rows = self.read_records(self.STRUCT_DEF_LAYOUT, struct_def_row_count)
+                    vertfmt['struct_def'] = [
+                        (row['offset'], (row['info_type'], row['data_type'], row['value_count']))
+                        for row in rows]
                 assert vertfmt['bytes_per_vertex'] in [0x0, 0x8, 0xc, 0x14, 0x18, 0x1c]
-                self.vertex_formats.append(vertfmt)
 
     def read_key_list(self):
         if self.vc_game == 1:
@@ -407,6 +792,8 @@ class ValkKFSS(ValkFile):
 class ValkKFSG(ValkFile):
     # Doesn't contain other files.
     # Holds shape key data
+    __slots__ = ('vc_game', 'vertex_formats')
+
     VERT_LOCATION = (0x1, 0xa, 0x3)
     VERT_NORMAL= (0x4, 0xa, 0x3)
     VERT_UV1 = (0x7, 0xa, 0x2)
@@ -462,6 +849,11 @@ class ValkKFSG(ValkFile):
 
 class ValkKFMD(ValkFile):
     # Standard container
+    __slots__ = ('bones', 'materials', 'textures', 'meshes')
+
+    # Decode each vertex format's buffer once and give meshes slices of it.
+    SHARE_VERTEX_BUFFERS = True
+
     def read_data(self):
         assert len(self.KFMS) == 1 and len(self.KFMG) == 1
         kfms = self.KFMS[0]
@@ -480,26 +872,205 @@ class ValkKFMD(ValkFile):
             kfmg.vertex_ptr = kfmg.read_long_le()
         kfmg.vc_game = kfms.vc_game
         self.meshes = kfms.meshes
+        if self.SHARE_VERTEX_BUFFERS:
+            vertex_buffers = self.read_vertex_buffers(kfms, kfmg)
         for mesh in self.meshes:
-            if kfms.vc_game == 1:
-                fmt = 0
-            elif kfms.vc_game == 4:
-                obj = mesh['object']
-                fmt = obj['vertex_format']
+            fmt = self.mesh_vertex_format(kfms, mesh)
             vertex_format = kfms.vertex_formats[fmt]
-            mesh['faces'] = kfmg.read_faces(
+            if numpy is not None:
+                read_faces = kfmg.read_face_array
+            else:
+                read_faces = kfmg.read_faces
+            mesh['faces'] = read_faces(
                 mesh['faces_first_word'],
                 mesh['faces_word_count'],
                 vertex_format)
-            mesh['vertices'] = kfmg.read_vertices(
-                mesh['first_vertex'],
-                mesh['vertex_count'],
-                vertex_format)
+            if self.SHARE_VERTEX_BUFFERS:
+                buffer_start, vertices = vertex_buffers[fmt]
+                slice_start = mesh['first_vertex'] - buffer_start
+                slice_end = slice_start + mesh['vertex_count']
+                mesh['vertices'] = vertices[slice_start:slice_end]
+            else:
+                mesh['vertices'] = kfmg.read_vertex_columns(
+                    mesh['first_vertex'],
+                    mesh['vertex_count'],
+                    vertex_format)
+
+    def model_data(self):
+        # What read_data() decoded, without references back to the file, so
+        # it can be handed to another process.
+        return {
+            'vc_game': self.KFMS[0].vc_game,
+            'bones': self.bones,
+            'materials': self.materials,
+            'meshes': self.meshes,
+            'textures': self.textures,
+            }
+
+    def mesh_vertex_format(self, kfms, mesh):
+        if kfms.vc_game == 1:
+            return 0
+        elif kfms.vc_game == 4:
+            return mesh['object']['vertex_format']
+
+    def read_vertex_buffers(self, kfms, kfmg):
+        # Meshes are slices of a few per-format vertex buffers. Decode the
+        # range of each buffer that the meshes use exactly once, so meshes
+        # can share it (as views, with NumPy).
+        ranges = {}
+        for mesh in self.meshes:
+            fmt = self.mesh_vertex_format(kfms, mesh)
+            begin = mesh['first_vertex']
+            end = begin + mesh['vertex_count']
+            if fmt in ranges:
+                old_begin, old_end = ranges[fmt]
+                begin = min(begin, old_begin)
+                end = max(end, old_end)
+            ranges[fmt] = (begin, end)
+        vertex_buffers = {}
+        for fmt, (begin, end) in ranges.items():
+            vertices = kfmg.read_vertex_columns(begin, end - begin, kfms.vertex_formats[fmt])
+            vertex_buffers[fmt] = (begin, vertices)
+        return vertex_buffers
 
 
 class ValkKFMS(ValkFile):
     # Doesn't contain other files.
     # Describes model armature, materials, meshes, and textures.
+    __slots__ = (
+        'bones', 'deform_bones', 'materials', 'objects', 'meshes', 'textures',
+        'vc_game', 'endianness', 'bone_count', 'deform_count', 'model_height',
+        'material_count', 'object_count', 'mesh_count', 'texture_count',
+        'vertex_format_count', 'vertex_formats', 'bone_list_ptr',
+        'bone_xform_list_ptr', 'material_list_ptr', 'object_list_ptr',
+        'mesh_list_ptr', 'texture_list_ptr', 'mesh_info_ptr',
+        )
+
+    BONE_LAYOUTS = {
+        1: RecordLayout('>', [
+            (None, '4x'),
+            ('id', 'H'),
+            ('parent_id', 'H'),
+            ('dim1', 'f'),
+            ('dim2', 'f'),
+            ('parent_ptr', 'I'),
+            ('fav_child_ptr', 'I'),
+            ('unk_bone_ptr2', 'I'),
+            ('bound_box_ptr', 'I'),
+            (None, '2x'),
+            ('object_count', 'H'),
+            (None, '4x'),
+            ('deform_count', 'H'), # First bone only
+            ('is_deform', 'H'),
+            ('object_ptr1', 'I'),
+            ('object_ptr2', 'I'),
+            ('object_ptr3', 'I'),
+            ('deform_ids_ptr', 'I'), # First bone only
+            ('deform_ptr', 'I'),
+            (None, '32x'),
+            ]),
+        4: RecordLayout('<', [
+            (None, '4x'),
+            ('id', 'H'),
+            ('parent_id', 'H'),
+            ('dim1', 'f'),
+            ('dim2', 'f'),
+            ('parent_ptr', 'Q'),
+            ('fav_child_ptr', 'Q'),
+            ('unk_bone_ptr2', 'Q'),
+            ('bound_box_ptr', 'Q'),
+            (None, '4x'), # 0x20202020
+            (None, '2x'),
+            ('object_count', 'H'),
+            (None, '4x'),
+            ('deform_count', 'H'), # First bone only
+            ('is_deform', 'H'),
+            ('object_ptr1', 'Q'),
+            ('object_ptr2', 'Q'),
+            ('object_ptr3', 'Q'),
+            (None, '8x'),
+            ('deform_ids_ptr', 'Q'), # First bone only
+            ('deform_ptr', 'Q'),
+            (None, '48x'),
+            ]),
+        }
+    MATERIAL_LAYOUTS = {
+        1: RecordLayout('>', [
+            ('unk1', '4s'),
+            ('flags', 'I'),
+            ('unk2', '8s'),
+            ('texture0_ptr', 'I'),
+            ('texture1_ptr', 'I'),
+            ], size=0xa0),
+        4: RecordLayout('<', [
+            ('flags1', 'I'),
+            ('texture_count', 'B'),
+            ('flags2', 'H', swap_word), # Big-endian
+            ('flags3', 'B'),
+            (None, '120x'),
+            ('texture0_ptr', 'Q'),
+            ('texture1_ptr', 'Q'),
+            ('texture2_ptr', 'Q'),
+            ('texture3_ptr', 'Q'),
+            ('texture4_ptr', 'Q'),
+            ], size=0xf0),
+        }
+    OBJECT_LAYOUTS = {
+        1: RecordLayout('>', [
+            ('id', 'I'),
+            ('parent_is_armature', 'H'),
+            ('parent_bone_id', 'H'),
+            ('material_ptr', 'I'),
+            ('mesh_count', 'I'),
+            ('mesh_list_ptr', 'I'),
+            ('kfmg_vertex_offset', 'I'),
+            ('vertex_count', 'H'),
+            (None, '6x'),
+            ]),
+        4: RecordLayout('<', [
+            ('id', 'I'),
+            ('parent_is_armature', 'H'),
+            ('parent_bone_id', 'H'),
+            ('material_ptr', 'I'), # 64-bit?
+            ('u02', 'I'),
+            ('kfmg_vertex_offset', 'I'),
+            ('vertex_count', 'H'),
+            ('vertex_format', 'H'),
+            ('mesh_count', 'I'),
+            ('u03', 'I'),
+            ('mesh_list_ptr', 'I'), # 64-bit?
+            (None, '28x'),
+            ]),
+        }
+    MESH_LAYOUTS = {
+        1: RecordLayout('>', [
+            ('vertex_group_count', 'H'),
+            ('u01', 'H'),
+            ('u02', 'H'),
+            ('vertex_count', 'H'),
+            ('faces_word_count', 'H'),
+            ('n01', 'I'),
+            ('vertex_group_map_ptr', 'H'),
+            ('first_vertex', 'I'),
+            ('faces_first_word', 'I'),
+            ('first_vertex_id', 'I'),
+            ('n02', 'I'),
+            ]),
+        4: RecordLayout('<', [
+            ('vertex_group_count', 'H'),
+            ('u01', 'H'),
+            ('u02', 'H'),
+            ('vertex_count', 'H'),
+            ('faces_word_count', 'H'),
+            ('n01', 'H'),
+            ('first_vertex', 'I'),
+            ('faces_first_word', 'I'),
+            ('first_vertex_id', 'I'),
+            ('vertex_group_map_ptr', 'I'), # 64-bit?
+            ('n02', 'I'),
+            ]),
+        }
+
     def read_toc(self):
         self.seek(self.header_length)
         unk1 = self.read(4)
@@ -610,56 +1181,14 @@ class ValkKFMS(ValkFile):
             self.read(4)
 
     def read_bone_list(self):
-        self.follow_ptr(self.bone_list_ptr)
+        start = self.follow_ptr(self.bone_list_ptr)
+        if self.vc_game == 4:
+            start -= 0x20
+        layout = self.BONE_LAYOUTS[self.vc_game]
         self.bones = []
-        for i in range(self.bone_count):
-            bone = {}
-            if self.vc_game == 1:
-                bone['ptr'] = self.tell()
-                self.read(4)
-                bone['id'] = self.read_word_be()
-                bone['parent_id'] = self.read_word_be()
-                bone['dim1'] = self.read_float_be()
-                bone['dim2'] = self.read_float_be()
-                bone['parent_ptr'] = self.read_long_be()
-                bone['fav_child_ptr'] = self.read_long_be()
-                bone['unk_bone_ptr2'] = self.read_long_be()
-                bone['bound_box_ptr'] = self.read_long_be()
-                self.read(2)
-                bone['object_count'] = self.read_word_be()
-                self.read(4)
-                bone['deform_count'] = self.read_word_be() # First bone only
-                bone['is_deform'] = self.read_word_be()
-                bone['object_ptr1'] = self.read_long_be()
-                bone['object_ptr2'] = self.read_long_be()
-                bone['object_ptr3'] = self.read_long_be()
-                bone['deform_ids_ptr'] = self.read_long_be() # First bone only
-                bone['deform_ptr'] = self.read_long_be()
-                self.read(32)
-            elif self.vc_game == 4:
-                bone['ptr'] = self.tell() - 0x20
-                self.read(4)
-                bone['id'] = self.read_word_le()
-                bone['parent_id'] = self.read_word_le()
-                bone['dim1'] = self.read_float_le()
-                bone['dim2'] = self.read_float_le()
-                bone['parent_ptr'] = self.read_long_long_le()
-                bone['fav_child_ptr'] = self.read_long_long_le()
-                bone['unk_bone_ptr2'] = self.read_long_long_le()
-                bone['bound_box_ptr'] = self.read_long_long_le()
-                self.read(4) # 0x20202020
-                self.read(2)
-                bone['object_count'] = self.read_word_le()
-                self.read(4)
-                bone['deform_count'] = self.read_word_le() # First bone only
-                bone['is_deform'] = self.read_word_le()
-                bone['object_ptr1'] = self.read_long_long_le()
-                bone['object_ptr2'] = self.read_long_long_le()
-                bone['object_ptr3'] = self.read_long_long_le()
-                self.read(8)
-                bone['deform_ids_ptr'] = self.read_long_long_le() # First bone only
-                bone['deform_ptr'] = self.read_long_long_le()
-                self.read(48)
+        for i, row in enumerate(self.read_records(layout, self.bone_count)):
+            bone = {'ptr': start + i * layout.size}
+            bone.update(row)
             self.bones.append(bone)
 
     def link_bones(self):
@@ -725,110 +1254,35 @@ class ValkKFMS(ValkFile):
 
     def read_material_list(self):
         self.materials = {}
-        if self.vc_game == 1:
-            item_length = 0xa0
-        elif self.vc_game == 4:
-            item_length = 0xf0
-        for i in range(self.material_count):
-            self.follow_ptr(self.material_list_ptr + i * item_length)
-            material = {}
-            material['id'] = i
+        start = self.follow_ptr(self.material_list_ptr)
+        if self.vc_game == 4:
+            start -= 0x20
+        layout = self.MATERIAL_LAYOUTS[self.vc_game]
+        for i, row in enumerate(self.read_records(layout, self.material_count)):
+            material = {'id': i, 'ptr': start + i * layout.size}
+            material.update(row)
             if self.vc_game == 1:
-                material['ptr'] = self.tell()
-                material['unk1'] = self.read(4)
-                material['flags'] = self.read_long_be()
                 material['use_normal'] = bool(material['flags'] & 0x12) # 0x10 and 0x2 both seem to indicate normal maps
                 material['use_alpha'] = bool(material['flags'] & 0x40)
                 material['use_backface_culling'] = bool(material['flags'] & 0x400)
-                material['unk2'] = self.read(8)
-                material['texture0_ptr'] = self.read_long_be()
-                material['texture1_ptr'] = self.read_long_be()
             elif self.vc_game == 4:
-                material['ptr'] = self.tell() - 0x20
-                material['flags1'] = self.read_long_le()
                 transparency1 = material['flags1'] in [0x05, 0x21]
-                material['texture_count'] = self.read_byte()
-                material['flags2'] = self.read_word_be()
                 transparency2 = material['flags2'] == 0x0201
                 material['use_transparency'] = transparency1 or transparency2
-                material['flags3'] = self.read_byte()
                 material['use_backface_culling'] = material['flags3'] == 1
-                self.read(0x78)
-                material['texture0_ptr'] = self.read_long_long_le()
-                material['texture1_ptr'] = self.read_long_long_le()
-                material['texture2_ptr'] = self.read_long_long_le()
-                material['texture3_ptr'] = self.read_long_long_le()
-                material['texture4_ptr'] = self.read_long_long_le()
             self.materials[material['ptr']] = material
 
     def read_object_list(self):
         self.follow_ptr(self.object_list_ptr)
-        self.objects = []
-        for i in range(self.object_count):
-            if self.vc_game == 1:
-                object_row = {
-                    'id': self.read_long_be(),
-                    'parent_is_armature': self.read_word_be(),
-                    'parent_bone_id': self.read_word_be(),
-                    'material_ptr': self.read_long_be(),
-                    'mesh_count': self.read_long_be(),
-                    'mesh_list_ptr': self.read_long_be(),
-                    'kfmg_vertex_offset': self.read_long_be(),
-                    'vertex_count': self.read_word_be(),
-                    }
-                self.read(6)
-            elif self.vc_game == 4:
-                object_row = {
-                    'id': self.read_long_le(),
-                    'parent_is_armature': self.read_word_le(),
-                    'parent_bone_id': self.read_word_le(),
-                    'material_ptr': self.read_long_le(), # 64-bit?
-                    'u02': self.read_long_le(),
-                    'kfmg_vertex_offset': self.read_long_le(),
-                    'vertex_count': self.read_word_le(),
-                    'vertex_format': self.read_word_le(),
-                    'mesh_count': self.read_long_le(),
-                    'u03': self.read_long_le(),
-                    'mesh_list_ptr': self.read_long_le(), # 64-bit?
-                    }
-                self.read(4 * 7)
-            self.objects.append(object_row)
+        self.objects = self.read_records(self.OBJECT_LAYOUTS[self.vc_game], self.object_count)
 
     def read_mesh_list(self):
         self.meshes = []
+        layout = self.MESH_LAYOUTS[self.vc_game]
         for obj in self.objects:
             self.follow_ptr(obj['mesh_list_ptr'])
-            for i in range(obj['mesh_count']):
-                if self.vc_game == 1:
-                    mesh_row = {
-                        'vertex_group_count': self.read_word_be(),
-                        'u01': self.read_word_be(),
-                        'u02': self.read_word_be(),
-                        'vertex_count': self.read_word_be(),
-                        'faces_word_count': self.read_word_be(),
-                        'n01': self.read_long_be(),
-                        'vertex_group_map_ptr': self.read_word_be(),
-                        'first_vertex': self.read_long_be(),
-                        'faces_first_word': self.read_long_be(),
-                        'first_vertex_id': self.read_long_be(),
-                        'n02': self.read_long_be(),
-                        'object': obj,
-                        }
-                elif self.vc_game == 4:
-                    mesh_row = {
-                        'vertex_group_count': self.read_word_le(),
-                        'u01': self.read_word_le(),
-                        'u02': self.read_word_le(),
-                        'vertex_count': self.read_word_le(),
-                        'faces_word_count': self.read_word_le(),
-                        'n01': self.read_word_le(),
-                        'first_vertex': self.read_long_le(),
-                        'faces_first_word': self.read_long_le(),
-                        'first_vertex_id': self.read_long_le(),
-                        'vertex_group_map_ptr': self.read_long_le(), # 64-bit?
-                        'n02': self.read_long_le(),
-                        'object': obj,
-                        }
+            for mesh_row in self.read_records(layout, obj['mesh_count']):
+                mesh_row['object'] = obj
                 self.meshes.append(mesh_row)
 
     def read_vertex_group_maps(self):
@@ -905,9 +1359,131 @@ class ValkKFMS(ValkFile):
         self.link_materials()
 
 
+def strip_to_faces(words):
+    # Converts a triangle strip with 0xffff restart markers to an (N, 4)
+    # array of faces. Winding alternates within each strip, and
+    # degenerate triangles are dropped.
+    word_count = len(words)
+    if word_count < 3:
+        return numpy.zeros((0, 4), dtype=numpy.int32)
+    words = words.astype(numpy.int32)
+    # The two words after a restart marker are always read as vertices,
+    # even if they are 0xffff themselves, so only some markers count.
+    is_restart = numpy.zeros(word_count, dtype=bool)
+    strip_start = numpy.zeros(word_count, dtype=numpy.intp)
+    next_restart = 2
+    for pos in numpy.flatnonzero(words == 0xffff).tolist():
+        if pos < next_restart:
+            continue
+        is_restart[pos] = True
+        if pos + 1 < word_count:
+            strip_start[pos + 1] = pos + 1
+        next_restart = pos + 3
+    numpy.maximum.accumulate(strip_start, out=strip_start)
+    position = numpy.arange(word_count)
+    strip_position = position - strip_start
+    keep = (strip_position >= 2) & ~is_restart
+    keep[:2] = False
+    v3_pos = numpy.flatnonzero(keep)
+    v1 = words[v3_pos - 2]
+    v2 = words[v3_pos - 1]
+    v3 = words[v3_pos]
+    forward = (strip_position[v3_pos] & 1) == 1
+    valid = (v1 != v2) & (v2 != v3) & (v3 != v1)
+    faces = numpy.zeros((len(v3_pos), 4), dtype=numpy.int32)
+    faces[:, 0] = v3
+    faces[:, 1] = numpy.where(forward, v2, v1)
+    faces[:, 2] = numpy.where(forward, v1, v2)
+    return faces[valid]
+
+
+class ValkVertices:
+    # Column-oriented vertex data for one mesh. Each column has one row
+    # per vertex (a NumPy array, or a list of tuples without NumPy), or is
+    # None if the vertex format doesn't have it. Indexing returns the
+    # per-vertex dicts that ValkKFMG.read_vertex produces, minus the
+    # unknown_* fields.
+    COLUMNS = (
+        ('positions', ('location_x', 'location_y', 'location_z'), 'float32'),
+        ('normals', ('normal_x', 'normal_y', 'normal_z'), 'float32'),
+        ('weights', ('vertex_group_weight_1', 'vertex_group_weight_2', 'vertex_group_weight_3'), 'float32'),
+        ('groups', ('vertex_group_1', 'vertex_group_2', 'vertex_group_3', 'vertex_group_4'), 'uint8'),
+        ('colors', ('color_r', 'color_g', 'color_b', 'color_a'), 'float32'),
+        ('uv1', ('u', 'v'), 'float32'),
+        ('uv2', ('u2', 'v2'), 'float32'),
+        ('uv3', ('u3', 'v3'), 'float32'),
+        ('uv4', ('u4', 'v4'), 'float32'),
+        ('uv5', ('u5', 'v5'), 'float32'),
+        )
+    __slots__ = ('count',) + tuple(column[0] for column in COLUMNS)
+
+    def __init__(self, count, **columns):
+        self.count = count
+        for name, keys, dtype in self.COLUMNS:
+            setattr(self, name, columns.get(name))
+
+    @classmethod
+    def from_array(cls, vertex_array):
+        names = vertex_array.dtype.names
+        columns = {}
+        for name, keys, dtype in cls.COLUMNS:
+            if keys[0] not in names:
+                continue
+            column = numpy.empty((len(vertex_array), len(keys)), dtype=dtype)
+            for i, key in enumerate(keys):
+                column[:, i] = vertex_array[key]
+            columns[name] = column
+        return cls(len(vertex_array), **columns)
+
+    @classmethod
+    def from_dicts(cls, vertices):
+        columns = {}
+        if vertices:
+            for name, keys, dtype in cls.COLUMNS:
+                if keys[0] in vertices[0]:
+                    columns[name] = [tuple(vertex[key] for key in keys) for vertex in vertices]
+        return cls(len(vertices), **columns)
+
+    @property
+    def uvs(self):
+        return [self.uv1, self.uv2, self.uv3, self.uv4, self.uv5]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            columns = {}
+            for name, keys, dtype in self.COLUMNS:
+                column = getattr(self, name)
+                if column is not None:
+                    columns[name] = column[index]
+            return ValkVertices(len(range(*index.indices(self.count))), **columns)
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        vertex = {}
+        for name, keys, dtype in self.COLUMNS:
+            column = getattr(self, name)
+            if column is None:
+                continue
+            row = column[index]
+            if hasattr(row, 'tolist'):
+                row = row.tolist()
+            vertex.update(zip(keys, row))
+        return vertex
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
 class ValkKFMG(ValkFile):
     # Doesn't contain other files.
     # Holds mesh vertex and face data.
+    __slots__ = ('face_ptr', 'vertex_ptr', 'vc_game')
+
     VERT_LOCATION = (0x1, 0xa, 0x3)
     VERT_WEIGHTS = (0x2, 0xa, 0x3)
     VERT_GROUPS = (0x3, 0x1, 0x4)
@@ -920,24 +1496,128 @@ class ValkKFMG(ValkFile):
     VERT_UV5 = (0xb, 0xa, 0x2)
     VERT_COLOR = (0xf, 0xa, 0x4)
 
-    def read_faces(self, first_word, word_count, vertex_format):
+    # On-disk vertex layouts for vertex_dtype. Fields named None are
+    # skipped.
+    VC1_VERTEX_LAYOUTS = {
+        0x2c: [
+            ('location_x', '>f4'),
+            ('location_y', '>f4'),
+            ('location_z', '>f4'),
+            ('unknown_1', 'V4'),
+            ('normal_x', '>f2'),
+            ('normal_y', '>f2'),
+            ('normal_z', '>f2'),
+            ('unknown_2', 'V2'),
+            ('unknown_3', 'V8'),
+            ('u', '>f2'),
+            ('v', '>f2'),
+            ('u2', '>f2'),
+            ('v2', '>f2'),
+            ('unknown_4', 'V4'),
+            ],
+        0x30: [
+            ('location_x', '>f4'),
+            ('location_y', '>f4'),
+            ('location_z', '>f4'),
+            ('vertex_group_1', 'u1'),
+            ('vertex_group_2', 'u1'),
+            ('vertex_group_3', 'u1'), # Junk?
+            ('vertex_group_4', 'u1'), # Junk?
+            ('vertex_group_weight_1', '>f2'),
+            ('vertex_group_weight_2', '>f2'),
+            ('vertex_group_weight_3', '>f2'),
+            ('unknown_1', 'V2'),
+            ('u', '>f2'),
+            ('v', '>f2'),
+            ('u2', '>f2'),
+            ('v2', '>f2'),
+            (None, 'V4'),
+            ('normal_x', '>f2'),
+            ('normal_y', '>f2'),
+            ('normal_z', '>f2'),
+            ('unknown_2', 'V6'),
+            ],
+        0x50: [
+            ('location_x', '>f4'),
+            ('location_y', '>f4'),
+            ('location_z', '>f4'),
+            ('unknown_1', 'V12'),
+            ('unknown_2', 'V8'),
+            ('normal_x', '>f4'),
+            ('normal_y', '>f4'),
+            ('normal_z', '>f4'),
+            ('unknown_3', 'V4'),
+            ('u', '>f4'),
+            ('v', '>f4'),
+            ('u2', '>f4'),
+            ('v2', '>f4'),
+            ('unknown_4', 'V16'),
+            ],
+        }
+    VC4_VERTEX_ELEMENTS = {
+        VERT_LOCATION: [('location_x', '<f4'), ('location_y', '<f4'), ('location_z', '<f4')],
+        VERT_WEIGHTS: [('vertex_group_weight_1', '<f4'), ('vertex_group_weight_2', '<f4'), ('vertex_group_weight_3', '<f4')],
+        VERT_GROUPS: [('vertex_group_1', 'u1'), ('vertex_group_2', 'u1'), ('vertex_group_3', 'u1'), ('vertex_group_4', 'u1')],
+        VERT_NORMAL: [('normal_x', '<f4'), ('normal_y', '<f4'), ('normal_z', '<f4')],
+        VERT_UNKNOWN: [('unknown_1', '<f4'), ('unknown_2', '<f4'), ('unknown_3', '<f4')],
+        VERT_UV1: [('u', '<f4'), ('v', '<f4')],
+        VERT_UV2: [('u2', '<f4'), ('v2', '<f4')],
+        VERT_UV3: [('u3', '<f4'), ('v3', '<f4')],
+        VERT_UV4: [('u4', '<f4'), ('v4', '<f4')],
+        VERT_UV5: [('u5', '<f4'), ('v5', '<f4')],
+        VERT_COLOR: [('color_r', '<f4'), ('color_g', '<f4'), ('color_b', '<f4'), ('color_a', '<f4')],
+        }
+    FLIPPED_FIELDS = ('v', 'v2', 'v3', 'v4', 'v5')
+    vertex_dtypes = {}
+
+    def read_face_data(self, first_word, word_count, vertex_format):
         fmt_face_offset = vertex_format['face_ptr']
         self.seek(self.header_length + self.face_ptr + fmt_face_offset + first_word * 2)
-        end_ptr = self.tell() + word_count * 2
-        start_direction = 1
+        return self.read_view(word_count * 2)
+
+    def read_vertex_data(self, first_vertex, vertex_count, vertex_format):
+        fmt_bytes_per_vertex = vertex_format['bytes_per_vertex']
+        fmt_vertex_offset = vertex_format['vertex_ptr']
+        self.seek(self.header_length + self.vertex_ptr + fmt_vertex_offset + first_vertex * fmt_bytes_per_vertex)
+        return self.read_view(vertex_count * fmt_bytes_per_vertex)
+
+    def read_face_array(self, first_word, word_count, vertex_format):
+        # Vectorized version of read_faces. Returns an (N, 4) int32 array
+        # with the same rows read_faces would return.
+        data = self.read_face_data(first_word, word_count, vertex_format)
         if self.vc_game == 1:
-            read_vertex_id = self.read_word_be
+            dtype = '>u2'
         elif self.vc_game == 4:
-            read_vertex_id = self.read_word_le
-        v1 = read_vertex_id()
-        v2 = read_vertex_id()
-        face_direction = start_direction
+            dtype = '<u2'
+        words = numpy.frombuffer(data, dtype=dtype, count=word_count)
+        return strip_to_faces(words)
+
+    def read_faces(self, first_word, word_count, vertex_format):
+        if numpy is not None:
+            return self.read_face_array(first_word, word_count, vertex_format).tolist()
+        data = self.read_face_data(first_word, word_count, vertex_format)
+        if self.vc_game == 1:
+            words = struct.unpack('>{}H'.format(word_count), data)
+        elif self.vc_game == 4:
+            words = struct.unpack('<{}H'.format(word_count), data)
+        start_direction = 1
         faces = []
-        while self.tell() < end_ptr:
-            v3 = read_vertex_id()
+        if word_count < 2:
+            return faces
+        v1 = words[0]
+        v2 = words[1]
+        face_direction = start_direction
+        i = 2
+        while i < word_count:
+            v3 = words[i]
+            i += 1
             if v3 == 0xffff:
-                v1 = read_vertex_id()
-                v2 = read_vertex_id()
+                if i + 2 > word_count:
+                    # Restart marker at the very end of the strip.
+                    break
+                v1 = words[i]
+                v2 = words[i + 1]
+                i += 2
                 face_direction = start_direction
             else:
                 face_direction *= -1
@@ -954,60 +1634,78 @@ class ValkKFMG(ValkFile):
     def read_vertex(self, vertex_format):
         bytes_per_vertex = vertex_format['bytes_per_vertex']
         if self.vc_game == 1 and bytes_per_vertex == 0x2c:
+            location = self.read_floats_be(3)
+            unknown_1 = self.read(4)
+            normal = self.read_half_floats_be(3)
+            unknown_2 = self.read(2)
+            unknown_3 = self.read(8)
+            uv = self.read_half_floats_be(4)
             vertex = {
-                'location_x': self.read_float_be(),
-                'location_y': self.read_float_be(),
-                'location_z': self.read_float_be(),
-                'unknown_1': self.read(4),
-                'normal_x': self.read_half_float_be(),
-                'normal_y': self.read_half_float_be(),
-                'normal_z': self.read_half_float_be(),
-                'unknown_2': self.read(2),
-                'unknown_3': self.read(8),
-                'u': self.read_half_float_be(),
-                'v': self.read_half_float_be() * -1,
-                'u2': self.read_half_float_be(),
-                'v2': self.read_half_float_be() * -1,
+                'location_x': location[0],
+                'location_y': location[1],
+                'location_z': location[2],
+                'unknown_1': unknown_1,
+                'normal_x': normal[0],
+                'normal_y': normal[1],
+                'normal_z': normal[2],
+                'unknown_2': unknown_2,
+                'unknown_3': unknown_3,
+                'u': uv[0],
+                'v': uv[1] * -1,
+                'u2': uv[2],
+                'v2': uv[3] * -1,
                 'unknown_4': self.read(4),
                 }
         elif self.vc_game == 1 and bytes_per_vertex == 0x30:
+            location = self.read_floats_be(3)
+            groups = self.read(4)
+            weights = self.read_half_floats_be(3)
+            unknown_1 = self.read(2)
+            uv = self.read_half_floats_be(4)
+            self.read(4)
+            normal = self.read_half_floats_be(3)
             vertex = {
-                'location_x': self.read_float_be(),
-                'location_y': self.read_float_be(),
-                'location_z': self.read_float_be(),
-                'vertex_group_1': self.read_byte(),
-                'vertex_group_2': self.read_byte(),
-                'vertex_group_3': self.read_byte(), # Junk?
-                'vertex_group_4': self.read_byte(), # Junk?
-                'vertex_group_weight_1': self.read_half_float_be(),
-                'vertex_group_weight_2': self.read_half_float_be(),
-                'vertex_group_weight_3': self.read_half_float_be(),
-                'unknown_1': self.read(2),
-                'u': self.read_half_float_be(),
-                'v': self.read_half_float_be() * -1,
-                'u2': self.read_half_float_be(),
-                'v2': self.read_half_float_be() * -1,
-                'unknown_2': self.read(4),
-                'normal_x': self.read_half_float_be(),
-                'normal_y': self.read_half_float_be(),
-                'normal_z': self.read_half_float_be(),
+                'location_x': location[0],
+                'location_y': location[1],
+                'location_z': location[2],
+                'vertex_group_1': groups[0],
+                'vertex_group_2': groups[1],
+                'vertex_group_3': groups[2], # Junk?
+                'vertex_group_4': groups[3], # Junk?
+                'vertex_group_weight_1': weights[0],
+                'vertex_group_weight_2': weights[1],
+                'vertex_group_weight_3': weights[2],
+                'unknown_1': unknown_1,
+                'u': uv[0],
+                'v': uv[1] * -1,
+                'u2': uv[2],
+                'v2': uv[3] * -1,
+                'normal_x': normal[0],
+                'normal_y': normal[1],
+                'normal_z': normal[2],
                 'unknown_2': self.read(6),
                 }
         elif self.vc_game == 1 and bytes_per_vertex == 0x50:
+            location = self.read_floats_be(3)
+            unknown_1 = self.read(4 * 3)
+            unknown_2 = self.read(4 * 2)
+            normal = self.read_floats_be(3)
+            unknown_3 = self.read(4)
+            uv = self.read_floats_be(4)
             vertex = {
-                'location_x': self.read_float_be(),
-                'location_y': self.read_float_be(),
-                'location_z': self.read_float_be(),
-                'unknown_1': self.read(4 * 3),
-                'unknown_2': self.read(4 * 2),
-                'normal_x': self.read_float_be(),
-                'normal_y': self.read_float_be(),
-                'normal_z': self.read_float_be(),
-                'unknown_3': self.read(4),
-                'u': self.read_float_be(),
-                'v': self.read_float_be() * -1,
-                'u2': self.read_float_be(),
-                'v2': self.read_float_be() * -1,
+                'location_x': location[0],
+                'location_y': location[1],
+                'location_z': location[2],
+                'unknown_1': unknown_1,
+                'unknown_2': unknown_2,
+                'normal_x': normal[0],
+                'normal_y': normal[1],
+                'normal_z': normal[2],
+                'unknown_3': unknown_3,
+                'u': uv[0],
+                'v': uv[1] * -1,
+                'u2': uv[2],
+                'v2': uv[3] * -1,
                 'unknown_4': self.read(4 * 4),
                 }
         elif self.vc_game == 4:
@@ -1067,6 +1765,10 @@ class ValkKFMG(ValkFile):
         return vertex
 
     def read_vertices(self, first_vertex, vertex_count, vertex_format):
+        if numpy is not None:
+            vertex_array = self.decode_vertices(first_vertex, vertex_count, vertex_format)
+            names = vertex_array.dtype.names
+            return [dict(zip(names, row)) for row in vertex_array.tolist()]
         fmt_bytes_per_vertex = vertex_format['bytes_per_vertex']
         fmt_vertex_offset = vertex_format['vertex_ptr']
         self.seek(self.header_length + self.vertex_ptr + fmt_vertex_offset + first_vertex * fmt_bytes_per_vertex)
@@ -1076,6 +1778,77 @@ class ValkKFMG(ValkFile):
             vertices.append(vertex)
         return vertices
 
+    def read_vertex_columns(self, first_vertex, vertex_count, vertex_format):
+        if numpy is not None:
+            vertex_array = self.decode_vertices(first_vertex, vertex_count, vertex_format)
+            return ValkVertices.from_array(vertex_array)
+        return ValkVertices.from_dicts(self.read_vertices(first_vertex, vertex_count, vertex_format))
+
+    def vertex_dtype(self, vertex_format):
+        # Builds (and caches) a NumPy structured dtype that matches the
+        # on-disk layout of one vertex. Field names are the same as the
+        # keys produced by read_vertex.
+        bytes_per_vertex = vertex_format['bytes_per_vertex']
+        if self.vc_game == 4:
+            key = (4, bytes_per_vertex, tuple(vertex_format['struct_def']))
+        else:
+            key = (self.vc_game, bytes_per_vertex)
+        dtype = self.vertex_dtypes.get(key)
+        if dtype is not None:
+            return dtype
+        if self.vc_game == 1 and bytes_per_vertex in self.VC1_VERTEX_LAYOUTS:
+            fields = self.VC1_VERTEX_LAYOUTS[bytes_per_vertex]
+        elif self.vc_game == 4:
+            fields = []
+            for offset, element in vertex_format['struct_def']:
+                if element not in self.VC4_VERTEX_ELEMENTS:
+                    raise NotImplementedError('Unknown vertex data element: {}'.format(element))
+                fields.extend(self.VC4_VERTEX_ELEMENTS[element])
+        else:
+            raise NotImplementedError('Unsupported vertex type. Bytes per vertex: {}'.format(bytes_per_vertex))
+        names = []
+        formats = []
+        offsets = []
+        position = 0
+        for name, fmt in fields:
+            size = numpy.dtype(fmt).itemsize
+            if name is not None:
+                names.append(name)
+                formats.append(fmt)
+                offsets.append(position)
+            position += size
+        # Sometimes vertex data is padded, and bytes_per_vertex is larger
+        # than the actual amount of data in a vertex.
+        dtype = numpy.dtype({
+            'names': names,
+            'formats': formats,
+            'offsets': offsets,
+            'itemsize': bytes_per_vertex,
+            })
+        self.vertex_dtypes[key] = dtype
+        return dtype
+
+    def decode_vertices(self, first_vertex, vertex_count, vertex_format):
+        # Decodes a range of vertices with a single frombuffer call.
+        # Returns a packed, native-endian structured array with the V
+        # coordinates already flipped.
+        dtype = self.vertex_dtype(vertex_format)
+        data = self.read_vertex_data(first_vertex, vertex_count, vertex_format)
+        raw = numpy.frombuffer(data, dtype=dtype, count=vertex_count)
+        out_fields = []
+        for name in dtype.names:
+            field_dtype = dtype.fields[name][0]
+            if field_dtype.kind == 'f':
+                field_dtype = numpy.dtype('float32')
+            out_fields.append((name, field_dtype))
+        vertices = numpy.empty(vertex_count, dtype=out_fields)
+        for name in dtype.names:
+            if name in self.FLIPPED_FIELDS:
+                vertices[name] = -raw[name]
+            else:
+                vertices[name] = raw[name]
+        return vertices
+
 
 class ValkABDA(ValkFile):
     # Special container
@@ -1152,6 +1925,11 @@ class ValkCSBD(ValkFile):
 
 class ValkHTER(ValkFile):
     # Small files that contain lists of textures used by MXE files
+    __slots__ = (
+        'texture_pack_count', 'texture_pack_list_ptr', 'texture_packs',
+        'vc_game',
+        )
+
     def read_toc(self):
         self.seek(self.header_length + 4)
         self.texture_pack_count = self.read_long_be()
@@ -1300,6 +2078,8 @@ class ValkHTSF(ValkFile):
 
 class ValkDDS(ValkFile):
     # Texture image. Not a Valkyria-specific file format.
+    __slots__ = ('data',)
+
     def read_meta(self):
         self.ftype = 'DDS'
 
@@ -1308,7 +2088,7 @@ class ValkDDS(ValkFile):
 
     def read_data(self):
         self.seek(0)
-        self.data = self.read(self.total_length)
+        self.data = self.read_view(self.total_length)
 
 
 class ValkKFCA(ValkFile):
@@ -1341,6 +2121,11 @@ class ValkKFMI(ValkFile):
 class ValkKFMO(ValkFile):
     # Doesn't contain other files.
     # Specifies an armature pose or animation
+    __slots__ = (
+        'bone_count', 'frame_count', 'frames_per_second', 'bone_list_ptr',
+        'bones',
+        )
+
     def read_toc(self):
         self.seek(self.header_length + 4)
         self.bone_count = self.read_long_be()
@@ -1389,14 +2174,13 @@ class ValkKFMO(ValkFile):
         assert data_type in [1, 2, 3]
         assert bits_after_decimal in [0x00, 0x01, 0x02, 0x06, 0x07, 0x0a, 0x0b, 0x0c, 0x0d, 0x0e, 0x0f]
         self.follow_ptr(frames_ptr)
-        frames = []
-        for i in range(self.frame_count + 1):
-            if data_type == 1:
-                frames.append(self.read_float_be())
-            elif data_type == 2:
-                frames.append(self.read_word_be_signed() / 2**bits_after_decimal)
-            elif data_type == 3:
-                frames.append(self.read_byte_signed() / 2**bits_after_decimal)
+        frame_count = self.frame_count + 1
+        if data_type == 1:
+            frames = self.read_floats_be(frame_count)
+        elif data_type == 2:
+            frames = self.read_fixed_be(frame_count, 2, bits_after_decimal)
+        elif data_type == 3:
+            frames = self.read_fixed_be(frame_count, 1, bits_after_decimal)
         #print(ptr_key, end=" ")
         #print("\t{:02x} {:02x} {:08x} {:04x} {:04x}".format(data_type, bits_after_decimal, frames_ptr, difference, int(self.frame_count * 2) + 2), end=" ")
         #print(frames)
@@ -1485,6 +2269,13 @@ class ValkKSPR(ValkFile):
 class ValkMXEC(ValkFile):
     # Doesn't contain other files.
     # Points to HTX and HMD files.
+    __slots__ = (
+        'parameters', 'models', 'files', 'vc_game', 'param_block_ptr',
+        'model_block_ptr', 'file_block_ptr', 'param_count', 'param_list_ptr',
+        'model_count', 'model_list_ptr', 'file_count', 'file_list_ptr',
+        'merge_htx_file', 'htr_file', 'mmf_file',
+        )
+
     model_types = [
             "EnEventDecor",
             "EnHeightField",
@@ -1519,13 +2310,38 @@ class ValkMXEC(ValkFile):
             "VlTree",
             "VlWindmill",
             ]
-    def __init__(self, F, offset=None):
-        self.PRINT_FILES = False
-        self.PRINT_PARAMS = False
-        self.PRINT_MODELS = False
-        self.PRINT_MODEL_PARAMS = False
-        self.PRINT_MODEL_FILES = False
-        super().__init__(F, offset)
+    FILE_LAYOUTS = {
+        1: RecordLayout('>', [
+            ('is_inside', 'I'),
+            ('id', 'I'),
+            ('path_ptr', 'I'),
+            ('filename_ptr', 'I'),
+            ('type', 'I'),
+            ('htr_index', 'I'),
+            ('unk1', '12s'),
+            ('mmr_index', 'I'),
+            ('unk2', '24s'),
+            ]),
+        4: RecordLayout('<', [
+            ('is_inside', 'I'),
+            ('id', 'I'),
+            ('type', 'I'),
+            ('htr_index', 'I'),
+            ('unk1', 'I'),
+            ('mmr_index', 'I'),
+            ('path_ptr', 'Q'),
+            ('filename_ptr', 'Q'),
+            ('unk2', '24s'),
+            ]),
+        }
+
+    # Class attributes rather than set in __init__, which chunks rebuilt
+    # from the chunk index (ValkFile.from_meta) don't run.
+    PRINT_FILES = False
+    PRINT_PARAMS = False
+    PRINT_MODELS = False
+    PRINT_MODEL_PARAMS = False
+    PRINT_MODEL_FILES = False
 
     def read_toc(self):
         self.seek(self.header_length)
@@ -1600,7 +2416,7 @@ class ValkMXEC(ValkFile):
             if self.PRINT_PARAMS:
                 data_pos = self.follow_ptr(row["data_ptr"])
                 print('Param:', row)
-                print(check_output(["xxd", "-s", str(data_pos + self.offset), "-l", str(row["data_length"]), self.F.filename]).decode("ascii"))
+                print(check_output(["xxd", "-s", str(data_pos + self.base), "-l", str(row["data_length"]), self.F.filename]).decode("ascii"))
         if self.PRINT_PARAMS:
             print('Done Reading Parameters')
         self.parameters = rows
@@ -1643,31 +2459,7 @@ class ValkMXEC(ValkFile):
             return
         self.follow_ptr(self.file_list_ptr)
         file_rows = []
-        for i in range(self.file_count):
-            if self.vc_game == 1:
-                row = {
-                    "is_inside": self.read_long_be(),
-                    "id": self.read_long_be(),
-                    "path_ptr": self.read_long_be(),
-                    "filename_ptr": self.read_long_be(),
-                    "type": self.read_long_be(),
-                    "htr_index": self.read_long_be(),
-                    "unk1": self.read(0xc),
-                    "mmr_index": self.read_long_be(),
-                    "unk2": self.read(0x18),
-                    }
-            elif self.vc_game == 4:
-                row = {
-                    "is_inside": self.read_long_le(),
-                    "id": self.read_long_le(),
-                    "type": self.read_long_le(),
-                    "htr_index": self.read_long_le(),
-                    "unk1": self.read_long_le(),
-                    "mmr_index": self.read_long_le(),
-                    "path_ptr": self.read_long_long_le(),
-                    "filename_ptr": self.read_long_long_le(),
-                    "unk2": self.read(0x18),
-                    }
+        for row in self.read_records(self.FILE_LAYOUTS[self.vc_game], self.file_count):
             # 0 = Not inside another file
             # 0x100 = Is inside merge.htx, indexed by merge.htr
             # 0x200 = Is inside mmf, indexed by mmr
@@ -1738,7 +2530,7 @@ class ValkMXEC(ValkFile):
                         param_id = self.read_long_le()
                     if self.PRINT_MODEL_PARAMS:
                         print('Model Param:', self.parameters[param_id])
-                        print(check_output(["xxd", "-s", str(self.parameters[param_id]["data_ptr"] + self.offset), "-l", str(self.parameters[param_id]["data_length"]), self.F.filename]).decode("ascii"))
+                        print(check_output(["xxd", "-s", str(self.parameters[param_id]["data_ptr"] + self.base), "-l", str(self.parameters[param_id]["data_length"]), self.F.filename]).decode("ascii"))
                     param_group["param_ids"].append(param_id)
                 param_groups.append(param_group)
             model["param_groups"] = param_groups
@@ -1771,19 +2563,9 @@ class ValkMXEC(ValkFile):
         #   0x11c EnCEffect abd
         # SlgEnStronghold
         #   0x114-0x144 hmt, cvd, htx, hmd
-        def file_exists(filename):
-            import os
-            path = os.path.dirname(self.F.filename)
-            filepath = os.path.join(path, filename)
-            exists = False
-            for trypath in [filepath, filepath.upper()]:
-                try:
-                    F = open(trypath, "rb")
-                    F.close()
-                    exists = True
-                except IOError:
-                    pass
-            return exists
+        if self.PRINT_MODEL_FILES:
+            from .resolver import FileResolver
+            file_exists = FileResolver(os.path.dirname(self.F.filename), search_dirs=('',)).exists
         for model in self.models:
             for group in model["param_groups"]:
                 if group["text"] in self.model_types:
@@ -1901,6 +2683,8 @@ class ValkMXMI(ValkFile):
 class ValkMXMH(ValkFile):
     # Doesn't contain other files.
     # Small. Contains a filename.
+    __slots__ = ('vc_game',)
+
     def read_data(self):
         self.seek(self.header_length)
         path_ptr = self.read_long_be()
@@ -1936,6 +2720,8 @@ class ValkMXTF(ValkFile):
 class ValkMXTL(ValkFile):
     # Doesn't contain other files.
     # Texture list
+    __slots__ = ('texture_lists',)
+
     def read_data(self):
         self.seek(self.header_length)
         hmdl_count = self.read_long_le()
@@ -2100,6 +2886,8 @@ class ValkMXMF(ValkFile):
     # Standard container
     # Contains MXMB file, which contains MXMI files, which contain a single
     # HMDL file with an MXMH filename specifier.
+    __slots__ = ('named_models',)
+
     def read_data(self):
         self.named_models = {}
         assert len(self.MXMB) == 1
@@ -2133,7 +2921,60 @@ class ValkHMDL(ValkFile):
 
 class ValkHTEX(ValkFile):
     # Standard container
-    pass
+    # Maps use a few textures out of a merge.htx with thousands, so single
+    # HTSFs can be fetched by position without making the others.
+    __slots__ = ('_htsf_locations', '_htsf_cache')
+
+    chunk_header = struct.Struct('<4sII')
+
+    def htsf_locations(self):
+        # (offset, index record id) of every HTSF child, from the chunk
+        # index if the file has one, otherwise by reading only their
+        # headers. The record id is None without an index.
+        locations = getattr(self, '_htsf_locations', None)
+        if locations is not None:
+            return locations
+        locations = []
+        record_ids = None
+        if self.index_id is not None:
+            record_ids = self.source.chunk_index.child_ids_of(self)
+        if record_ids is not None:
+            records = self.source.chunk_index.records
+            for record_id in record_ids:
+                if records[record_id][1] == 'HTSF':
+                    locations.append((records[record_id][2] - self.base, record_id))
+        elif self.header_length >= 0x20:
+            pos, chain_length = self.chain_bounds()
+            end = pos + chain_length
+            while pos < end:
+                ftype, main_length, header_length = self.chunk_header.unpack(self.pread(pos, self.chunk_header.size))
+                if ftype == b'EOFC':
+                    break
+                if ftype == b'HTSF':
+                    locations.append((pos, None))
+                pos += header_length + main_length
+        self._htsf_locations = locations
+        return locations
+
+    def htsf_count(self):
+        return len(self.htsf_locations())
+
+    def get_htsf(self, htsf_id):
+        # Same as self.HTSF[htsf_id], but only that HTSF is made.
+        if self.children_found:
+            return self.HTSF[htsf_id]
+        htsf_cache = getattr(self, '_htsf_cache', None)
+        if htsf_cache is None:
+            htsf_cache = self._htsf_cache = {}
+        htsf = htsf_cache.get(htsf_id)
+        if htsf is None:
+            offset, record_id = self.htsf_locations()[htsf_id]
+            if record_id is not None:
+                htsf = self.source.chunk_index.make_chunk(self, record_id)
+            else:
+                htsf = valk_factory(self, offset)
+            htsf_cache[htsf_id] = htsf
+        return htsf
 
 
 class ValkHSPR(ValkFile):
@@ -2164,6 +3005,8 @@ class ValkHSCM(ValkFile):
 class ValkHMOT(ValkFile):
     # Standard container
     # Contains a KFMO file
+    __slots__ = ('bones',)
+
     def read_data(self):
         assert len(self.KFMO) == 1
         kfmo = self.KFMO[0]
@@ -2201,7 +3044,7 @@ class Valk2MIG(ValkFile):
 
     def read_meta(self):
         self.seek(0)
-        self.ftype = self.read(4).decode('ascii')
+        self.ftype = sys.intern(self.read(4).decode('ascii'))
         if DEBUG:
             print("Creating", self.ftype)
         self.seek(0x14)
@@ -2278,7 +3121,7 @@ class Valk4NSEN(ValkFile):
 
     def read_meta(self):
         self.seek(0)
-        self.ftype = self.read(4).decode('ascii')
+        self.ftype = sys.intern(self.read(4).decode('ascii'))
         if DEBUG:
             print("Creating", self.ftype)
         import os
@@ -2340,7 +3183,7 @@ class Valk4XLSB(ValkFile):
 
     def read_meta(self):
         self.seek(0)
-        self.ftype = self.read(4).decode('ascii')
+        self.ftype = sys.intern(self.read(4).decode('ascii'))
         if DEBUG:
             print("Creating", self.ftype)
         import os
@@ -2483,23 +3326,195 @@ file_types = {
     'EFSC': Valk4EFSC,
     }
 
+# Attribute names under which ValkFile exposes its children
+child_names = frozenset(ftype.strip() for ftype in file_types)
+
+
+class ChildLookup:
+    # Class attribute for one child type. Unlike a __getattr__ hook it
+    # leaves every other attribute lookup on chunks at full speed.
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.children_of_type(self.name)
+
+for name in child_names:
+    if not hasattr(ValkFile, name):
+        setattr(ValkFile, name, ChildLookup(name))
+del name
+
 def valk_factory(F, offset=0, parent=None):
-    F.seek(offset)
-    ftype = F.read(4).decode('ascii')
+    ftype = F.pread(offset, 4).decode('ascii')
     if ftype == '':
         return None
-    F.seek(-4, True)
     if DEBUG:
         if hasattr(F, 'ftype'):
-            print("Attempting to create", ftype, "file found in {} at 0x{:x}".format(F.ftype, F.tell()))
+            print("Attempting to create", ftype, "file found in {} at 0x{:x}".format(F.ftype, offset))
     fclass = file_types.get(ftype, ValkUnknown)
     if fclass == ValkUnknown:
         raise NotImplementedError("File type {} not recognized.".format(repr(ftype)))
     return fclass(F, offset)
 
-def valk_open(filename):
-    files = []
+def map_threads(func, items, max_workers=None):
+    # Calls func on every item from a thread pool and returns the results
+    # in order. Meant for decoding independent chunks, e.g. the KFMDs of an
+    # HMDL; NumPy releases the GIL for most of the heavy lifting.
+    items = list(items)
+    if max_workers is None:
+        max_workers = DECODE_THREADS
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(func, items))
+
+def imap_threads(func, items, max_workers=None):
+    # Like map_threads, but yields the results in order as they become
+    # ready, so the caller can work on one while the pool works on the next.
+    # Only a couple of items per thread are started ahead of the caller, so
+    # large results don't pile up when the caller is the slower side.
+    items = list(items)
+    if max_workers is None:
+        max_workers = DECODE_THREADS
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+        return
+    max_workers = min(max_workers, len(items))
+    remaining = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque(
+            pool.submit(func, item) for item in itertools.islice(remaining, 2 * max_workers))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                for item in itertools.islice(remaining, 1):
+                    pending.append(pool.submit(func, item))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+def walk_chunks(chunks, parent_path, types, skip):
+    type_counts = {}
+    for chunk in chunks:
+        type_index = type_counts.get(chunk.ftype, 0)
+        type_counts[chunk.ftype] = type_index + 1
+        path = '{}{}[{}]'.format(parent_path, chunk.ftype, type_index)
+        if types is None or chunk.ftype in types:
+            yield path, chunk.ftype, chunk.base, chunk.total_length, chunk
+        if skip is None or chunk.ftype not in skip:
+            yield from walk_chunks(chunk.iter_inner_files(), path + '/', types, skip)
+            chunk.forget_children()
+
+def iter_chunks(filename, types=None, skip=None, use_mmap=None, use_index=False):
+    # Walks every chunk in a file depth first and yields
+    # (path, ftype, offset, length, chunk) for those whose type is in types,
+    # or for all of them if types is None. path looks like
+    # 'IZCA[0]/HTEX[0]/HTSF[3]', mirroring izca.HTEX[0].HTSF[3]; offset is
+    # absolute. Subtrees of chunks whose type is in skip aren't entered.
+    # Visited chunks aren't kept, so a chunk is only usable until the walk
+    # moves past it and the file is closed when the walk ends. The walk
+    # reads headers rather than the chunk index by default, since a loaded
+    # index keeps a record of every chunk in memory.
+    if types is not None:
+        types = {ftype.strip() for ftype in types}
+    if skip is not None:
+        skip = {ftype.strip() for ftype in skip}
+    with valk_open(filename, use_mmap, use_index) as top_level:
+        yield from walk_chunks(top_level, '', types, skip)
+
+def valk_source(filename, use_mmap=None):
+    if use_mmap is None:
+        use_mmap = USE_MMAP
     F = open(filename, 'rb')
+    if use_mmap:
+        try:
+            return ValkMappedSource(F, filename)
+        except (ValueError, OSError):
+            # Empty files and some special files can't be mapped.
+            pass
+    return ValkSource(F, filename)
+
+class ValkChunks(list):
+    # The top level chunks of a file, as returned by valk_open(). Closing
+    # it closes the file, after which its chunks can't be read any more.
+    # Can be used as a context manager.
+    def __init__(self, chunks=(), source=None):
+        super().__init__(chunks)
+        self.source = source
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SourcePool:
+    # Files opened during one import, by path, so that a file several
+    # others refer to (merge.htx, an .mmf) is opened and parsed only once.
+    # At most max_open files are kept; opening another closes the least
+    # recently used one, so max_open must cover the files in use at once.
+    # Closing the pool closes all of them.
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.opened = collections.OrderedDict()
+
+    def open(self, filename, archive=None):
+        # Returns valk_open()'s ValkChunks for filename, a loose file or a
+        # member of archive.
+        key = (archive, filename)
+        top_level = self.opened.get(key)
+        if top_level is not None:
+            self.opened.move_to_end(key)
+            return top_level
+        if archive is None:
+            top_level = valk_open(filename)
+        else:
+            top_level = valk_open(archive.open(filename))
+        self.opened[key] = top_level
+        while len(self.opened) > self.max_open:
+            old_key, old_top_level = self.opened.popitem(last=False)
+            old_top_level.close()
+        return top_level
+
+    def close(self):
+        while self.opened:
+            key, top_level = self.opened.popitem(last=False)
+            top_level.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def valk_open(filename, use_mmap=None, use_index=None):
+    # filename may also be an already opened source, e.g. an archive member.
+    # Returns a ValkChunks; close it when done with the file.
+    if use_index is None:
+        use_index = USE_INDEX_CACHE
+    files = ValkChunks()
+    if isinstance(filename, ValkSource):
+        F = filename
+        filename = F.filename
+    else:
+        F = valk_source(filename, use_mmap)
+        if use_index:
+            from . import index
+            F.chunk_index = index.load_index(filename)
+            if F.chunk_index is not None:
+                return ValkChunks(F.chunk_index.roots(F), F)
+    files.source = F
     FV = valk_factory(F)
     FV.filename = filename
     files.append(FV)
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+
+# Persistent chunk index. A file's chunk tree is walked once and every
+# chunk's type, position and lengths are stored in the cache. Later opens
+# rebuild chunks from the index without reading their headers, as long as
+# the file's size and modification time are unchanged.
+#
+# Building an index reads every chunk header in the file, which costs more
+# than a first open that only needs a few chunks. So opening a file never
+# builds its index; files opened without one are remembered, and their
+# indexes are built by build_pending() once the caller is done. The add-on
+# does that on one background thread, see start_building(), which it stops
+# before the next import and when it's unregistered.
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+
+from . import cache
+from . import files
+
+
+# Bump when the parser starts producing different trees.
+INDEX_VERSION = 1
+
+index_cache = cache.CacheDirectory('index')
+
+# Files that were opened without an index, for build_pending()
+pending = set()
+pending_lock = threading.Lock()
+
+# The thread started by start_building(), and the event that stops it
+builder = None
+builder_stop = threading.Event()
+builder_lock = threading.Lock()
+
+
+class BuildStopped(Exception):
+    pass
+
+
+def cache_key(filename):
+    path = os.path.abspath(filename)
+    return hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def add_records(records, chunk, parent, stop=None):
+    if stop is not None and stop.is_set():
+        raise BuildStopped()
+    record_id = len(records)
+    records.append([
+        type(chunk).__name__, chunk.ftype, chunk.base,
+        getattr(chunk, 'header_length', None),
+        getattr(chunk, 'main_length', None),
+        getattr(chunk, 'total_length', None),
+        parent, False])
+    try:
+        inner_files = chunk.inner_files
+    except Exception:
+        # Branches the parser can't walk are left out of the index. They
+        # are parsed, and fail, only if something actually uses them.
+        return
+    records[record_id][-1] = True
+    for inner_file in inner_files:
+        add_records(records, inner_file, record_id, stop)
+    chunk.forget_children()
+
+
+def build_records(filename, stop=None):
+    records = []
+    with files.valk_open(filename, use_index=False) as top_level:
+        for chunk in top_level:
+            add_records(records, chunk, -1, stop)
+    return records
+
+
+class ChunkIndex:
+    def __init__(self, filename, records):
+        self.filename = filename
+        self.records = records
+        self.root_ids = []
+        self.child_ids = [[] for record in records]
+        for record_id, record in enumerate(records):
+            parent = record[6]
+            if parent < 0:
+                self.root_ids.append(record_id)
+            else:
+                self.child_ids[parent].append(record_id)
+
+    def make_chunk(self, F, record_id):
+        class_name, ftype, base, header_length, main_length, total_length, parent, complete = self.records[record_id]
+        if isinstance(F, files.ValkFile):
+            offset = base - F.base
+        else:
+            offset = base
+        chunk = getattr(files, class_name).from_meta(F, offset, ftype, header_length, main_length, total_length)
+        chunk.index_id = record_id
+        return chunk
+
+    def roots(self, source):
+        chunks = []
+        for record_id in self.root_ids:
+            chunk = self.make_chunk(source, record_id)
+            chunk.filename = self.filename
+            chunks.append(chunk)
+        return chunks
+
+    def child_ids_of(self, chunk):
+        # None when the index doesn't know this chunk's children.
+        if not self.records[chunk.index_id][7]:
+            return None
+        return self.child_ids[chunk.index_id]
+
+    def children(self, chunk):
+        record_ids = self.child_ids_of(chunk)
+        if record_ids is None:
+            return None
+        return [self.make_chunk(chunk, record_id) for record_id in record_ids]
+
+
+def load_index(filename):
+    # The stored index of a file, or None if there isn't an up to date one
+    key = cache_key(filename)
+    signature = file_signature(filename)
+    data = index_cache.get(key)
+    if data is not None:
+        try:
+            stored = json.loads(data.decode('utf-8'))
+            if stored['version'] == INDEX_VERSION and stored['signature'] == signature:
+                return ChunkIndex(filename, stored['chunks'])
+        except (ValueError, KeyError, TypeError):
+            pass
+    with pending_lock:
+        pending.add(os.path.abspath(filename))
+    return None
+
+
+def build_index(filename, stop=None):
+    # Walks a file's chunk tree and stores its index. Raises BuildStopped
+    # if stop, a threading.Event, is set before it's done.
+    signature = file_signature(filename)
+    try:
+        records = build_records(filename, stop)
+    except BuildStopped:
+        raise
+    except Exception:
+        # Let the ordinary parser report whatever is wrong with the file.
+        return None
+    stored = {
+        'version': INDEX_VERSION,
+        'filename': os.path.abspath(filename),
+        'signature': signature,
+        'chunks': records,
+        }
+    index_cache.put(cache_key(filename), json.dumps(stored, separators=(',', ':')).encode('utf-8'))
+    return ChunkIndex(filename, records)
+
+
+def build_pending(stop=None):
+    # Builds the indexes of the files that were opened without one. Once
+    # stop is set, the file being indexed and the rest are left pending.
+    while stop is None or not stop.is_set():
+        with pending_lock:
+            if not pending:
+                return
+            filename = min(pending)
+            pending.discard(filename)
+        try:
+            build_index(filename, stop)
+        except BuildStopped:
+            with pending_lock:
+                pending.add(filename)
+        except OSError:
+            pass
+
+
+def start_building():
+    # Builds the pending indexes on a background thread, unless it's
+    # already running. Only one builds at a time.
+    global builder
+    with builder_lock:
+        if builder is not None and builder.is_alive():
+            return
+        builder_stop.clear()
+        builder = threading.Thread(target=build_pending, args=(builder_stop,),
+            name='valkyria-index', daemon=True)
+        builder.start()
+
+
+def stop_building():
+    # Stops the background thread and waits for it. It stops between two
+    # chunks, so this is quick even in the middle of a large file.
+    global builder
+    with builder_lock:
+        thread = builder
+        builder = None
+        builder_stop.set()
+    if thread is not None:
+        thread.join()
+
+
+# The thread is a daemon so it can't hold up an exit, but it's stopped
+# first so it isn't killed while it writes an index.
+atexit.register(stop_building)
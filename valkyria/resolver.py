@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+# Finds the files that a model or map refers to. File names in the game
+# data don't match the case of the files on disk, so every directory that's
+# searched is listed once and looked up case-insensitively from memory,
+# instead of trying each spelling of each path with open(). That matters
+# on network shares, where every failed open is a round trip.
+
+import os
+import posixpath
+
+
+# Where referenced files are looked for, relative to the folder of the file
+# that refers to them, in order.
+SEARCH_DIRS = (
+    '',
+    # Maps in data/ refer to models in data/resource/mx/ (PC release)
+    '../resource/mx',
+    )
+
+
+def split_path(path):
+    return [part for part in path.replace('\\', '/').split('/') if part not in ('', '.')]
+
+
+class FileResolver:
+    def __init__(self, directory, archive=None, search_dirs=SEARCH_DIRS):
+        # directory is a folder on disk, or inside archive if one is given.
+        # A bare file name has '' for its folder, i.e. the current one.
+        if archive is None and not directory:
+            directory = os.curdir
+        self.directory = directory
+        self.archive = archive
+        self.search_dirs = search_dirs
+        # folder -> {case folded name: name on disk}
+        self.listings = {}
+
+    def listing(self, directory):
+        names = self.listings.get(directory)
+        if names is None:
+            names = {}
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        names.setdefault(entry.name.casefold(), entry.name)
+            except OSError:
+                pass
+            self.listings[directory] = names
+        return names
+
+    def find_on_disk(self, parts):
+        path = self.directory
+        for part in parts:
+            if part == '..':
+                path = os.path.dirname(os.path.abspath(path))
+                continue
+            name = self.listing(path).get(part.casefold())
+            if name is None:
+                return None
+            path = os.path.join(path, name)
+        return path
+
+    def find_in_archive(self, parts):
+        path = posixpath.normpath(posixpath.join(self.directory.replace('\\', '/'), *parts))
+        try:
+            self.archive.find(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def resolve(self, filename):
+        # The path to open for filename. Raises FileNotFoundError if it
+        # isn't in any of the search folders.
+        for search_dir in self.search_dirs:
+            parts = split_path(search_dir) + split_path(filename)
+            if self.archive is None:
+                path = self.find_on_disk(parts)
+            else:
+                path = self.find_in_archive(parts)
+            if path is not None:
+                return path
+        raise FileNotFoundError(filename)
+
+    def exists(self, filename):
+        try:
+            self.resolve(filename)
+        except FileNotFoundError:
+            return False
+        return True
@@ -0,0 +1,412 @@
+#!/usr/bin/python3
+
+# Parses many model and texture files at once, e.g. every file an MXE map
+# refers to. Each job opens and decodes one file in a worker process and
+# returns plain data (dicts, NumPy arrays, bytes) that the caller can build
+# from.
+#
+# Inside Blender this package is <add-on>.valkyria, and importing the add-on
+# needs Blender. Workers are spawned with Blender's bundled Python instead,
+# and import this package as the top-level valkyria package from the add-on's
+# folder. Jobs and results are pickled under those top-level names.
+#
+# Large arrays and byte strings don't go through the result pipe. The worker
+# copies them into one shared memory block per job and pickles only their
+# positions in it; the parent maps the block and gets views of it back.
+
+import contextlib
+import importlib
+import io
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import types
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import files
+
+
+# None means one worker per CPU.
+MAX_WORKERS = None
+
+# Arrays and bytes smaller than this are pickled as usual.
+SHARED_MIN_SIZE = 4096
+
+# How worker processes are started: a multiprocessing start method, or None
+# to pick one with start_method().
+START_METHOD = None
+
+# This package's name in the importing process, the name workers import it
+# by, and the folder they import it from
+PACKAGE = __name__.rpartition('.')[0]
+WORKER_PACKAGE = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+WORKER_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rename_module(module, old, new):
+    if module == old or module.startswith(old + '.'):
+        return new + module[len(old):]
+    return module
+
+
+def worker_module(module):
+    # Name a worker imports one of this package's modules by
+    return rename_module(module, PACKAGE, WORKER_PACKAGE)
+
+
+def parent_module(module):
+    # Name a module from a worker has in this process
+    return rename_module(module, WORKER_PACKAGE, PACKAGE)
+
+
+class ModuleReference:
+    # Unpickled by importing the module
+    def __init__(self, name):
+        self.name = name
+
+    def __reduce__(self):
+        return importlib.import_module, (self.name,)
+
+
+class WorkerPickler(pickle.Pickler):
+    # Pickles this package's classes and functions under the names workers
+    # import them by.
+    def reducer_override(self, obj):
+        if isinstance(obj, (type, types.FunctionType)) and '.' not in obj.__qualname__:
+            module = getattr(obj, '__module__', None)
+            if module is not None and worker_module(module) != module:
+                return getattr, (ModuleReference(worker_module(module)), obj.__qualname__)
+        return NotImplemented
+
+
+def worker_dumps(obj):
+    F = io.BytesIO()
+    WorkerPickler(F, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return F.getvalue()
+
+
+class WorkerFunction:
+    # A function of this package that the process pool pickles under its
+    # worker_module() name.
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+    def __reduce__(self):
+        return getattr, (ModuleReference(worker_module(self.function.__module__)), self.function.__qualname__)
+
+
+def member_location(archive, filename):
+    # Where a job's file is, for parse_job(): None for a loose file, or the
+    # archive's class and filename and the member's already found entry, so
+    # workers don't parse the archive's table of contents again.
+    if archive is None:
+        return None
+    return (type(archive), archive.filename, archive.find(filename))
+
+
+def open_job_file(filename, location):
+    # valk_open() for a job's file; close the result when done.
+    if location is None:
+        return files.valk_open(filename)
+    archive_type, archive_filename, entry = location
+    archive = archive_type.without_toc(archive_filename)
+    try:
+        # Copied so the archive can be closed right away
+        data = bytes(archive.read_entry(entry))
+    finally:
+        archive.close()
+    return files.valk_open(files.ValkBufferSource(data, entry.name))
+
+
+def read_model_file(filename, location=None):
+    # One model_data() dict per KFMD of the file's HMDL
+    with open_job_file(filename, location) as top_level:
+        model_data = []
+        for kfmd in top_level[0].KFMD:
+            kfmd.read_data()
+            model_data.append(kfmd.model_data())
+    return model_data
+
+
+def read_texture_file(filename, location=None):
+    # The DDS data of every HTSF in the file's HTEX, as bytes
+    with open_job_file(filename, location) as top_level:
+        dds_data = []
+        for htsf in top_level[0].HTSF:
+            dds = htsf.DDS[0]
+            dds.read_data()
+            dds_data.append(bytes(dds.data))
+    return dds_data
+
+
+job_types = {
+    'model': read_model_file,
+    'texture': read_texture_file,
+    }
+
+
+def parse_job(job):
+    job_type, filename, location = job
+    return job_types[job_type](filename, location)
+
+
+class SharedResultPickler(pickle.Pickler):
+    # Lays out large arrays and bytes in a shared memory block while
+    # pickling. Views of the same array are stored once and keep sharing
+    # memory on the other side, like mesh vertices sliced from one buffer.
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.size = 0
+        self.offsets = {}
+        # (object, offset) of everything to copy. Also keeps the objects
+        # alive so their ids aren't reused while pickling.
+        self.shared = []
+
+    def reserve(self, obj, size):
+        offset = self.offsets.get(id(obj))
+        if offset is None:
+            offset = self.size
+            self.offsets[id(obj)] = offset
+            self.shared.append((obj, offset))
+            # Keep every array aligned for any dtype.
+            self.size += (size + 63) & ~63
+        return offset
+
+    def persistent_id(self, obj):
+        if shared_memory is None:
+            return None
+        if type(obj) is bytes and len(obj) >= SHARED_MIN_SIZE:
+            return ('bytes', self.reserve(obj, len(obj)), len(obj))
+        if numpy is not None and type(obj) is numpy.ndarray and not obj.dtype.hasobject:
+            root = obj
+            while isinstance(root.base, numpy.ndarray):
+                root = root.base
+            if root.nbytes < SHARED_MIN_SIZE:
+                return None
+            if not root.flags.c_contiguous:
+                root = obj = numpy.ascontiguousarray(obj)
+            start = obj.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+            offset = self.reserve(root, root.nbytes) + start
+            return ('array', offset, obj.dtype, obj.shape, obj.strides)
+        return None
+
+    def copy_to(self, buf):
+        for obj, offset in self.shared:
+            if type(obj) is bytes:
+                buf[offset:offset + len(obj)] = obj
+            else:
+                numpy.ndarray(obj.shape, obj.dtype, buffer=buf, offset=offset)[...] = obj
+
+
+def map_block(block):
+    # One array over the whole block, which all of its views are made from.
+    # numpy.frombuffer() gives the array a memoryview of its own as base,
+    # released before that memoryview's weakref callbacks run, so the block
+    # is closed once the array and every view of it are gone.
+    root = numpy.frombuffer(block.buf, dtype=numpy.uint8)
+    finalizer = weakref.finalize(root.base, block.close)
+    # Views that outlive the interpreter are unmapped with it
+    finalizer.atexit = False
+    return root
+
+
+class SharedResultUnpickler(pickle.Unpickler):
+    # buf is map_block()'s array, or the block's own buffer without NumPy.
+    def __init__(self, file, buf=None):
+        super().__init__(file)
+        self.buf = buf
+
+    def find_class(self, module, name):
+        return super().find_class(parent_module(module), name)
+
+    def persistent_load(self, pid):
+        if pid[0] == 'bytes':
+            kind, offset, size = pid
+            if numpy is None:
+                # Copied, so release() can close the block
+                return bytes(self.buf[offset:offset + size])
+            return memoryview(self.buf[offset:offset + size]).toreadonly()
+        elif pid[0] == 'array':
+            kind, offset, dtype, shape, strides = pid
+            return numpy.ndarray(shape, dtype, buffer=self.buf, offset=offset, strides=strides)
+        raise pickle.UnpicklingError("Unknown shared object {!r}".format(pid[0]))
+
+
+def share_result(result):
+    # Runs in the worker. Returns the name of the result's shared memory
+    # block (None if nothing was large enough) and the pickled result.
+    F = io.BytesIO()
+    pickler = SharedResultPickler(F)
+    pickler.dump(result)
+    if not pickler.size:
+        return None, F.getvalue()
+    block = shared_memory.SharedMemory(create=True, size=pickler.size)
+    try:
+        pickler.copy_to(block.buf)
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    # The parent unlinks the block in release(). Blocks it never gets to
+    # are unlinked by the resource tracker when it exits.
+    block.close()
+    return block.name, F.getvalue()
+
+
+def parse_shared_job(job_data):
+    # job_data is a job pickled by worker_dumps()
+    return share_result(parse_job(pickle.loads(job_data)))
+
+
+class ParsedFiles(list):
+    # Results of parse_files(). Some of them may be views of shared memory
+    # blocks, which are unlinked by release(), or when used as a context
+    # manager, once the results have been built from. Each block is closed
+    # when the last view of it is gone, see map_block().
+    def __init__(self, results=(), blocks=()):
+        super().__init__(results)
+        self.blocks = list(blocks)
+
+    def release(self):
+        for block in self.blocks:
+            block.unlink()
+            if numpy is None:
+                block.close()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def load_shared_results(shared_results):
+    results = ParsedFiles()
+    try:
+        for name, data in shared_results:
+            if name is None:
+                results.append(SharedResultUnpickler(io.BytesIO(data)).load())
+                continue
+            block = shared_memory.SharedMemory(name)
+            results.blocks.append(block)
+            buf = block.buf if numpy is None else map_block(block)
+            results.append(SharedResultUnpickler(io.BytesIO(data), buf).load())
+    except BaseException:
+        results.release()
+        raise
+    return results
+
+
+def worker_count(max_workers=None):
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    return max(1, max_workers)
+
+
+def python_executable():
+    # The interpreter spawned workers run. Blender's sys.executable may be
+    # Blender itself, with the bundled Python under sys.prefix. None if
+    # there's no Python to run.
+    if 'bpy' not in sys.modules:
+        return sys.executable
+    if sys.platform == 'win32':
+        names = ['python.exe']
+    else:
+        version = '{}.{}'.format(*sys.version_info[:2])
+        names = ['python' + version, 'python' + version + 'm', 'python3', 'python']
+    candidates = [sys.executable]
+    for folder in (os.path.join(sys.prefix, 'bin'), sys.prefix):
+        candidates.extend(os.path.join(folder, name) for name in names)
+    for path in candidates:
+        if (os.path.basename(path).lower().startswith('python')
+                and os.path.isfile(path) and os.access(path, os.X_OK)):
+            return path
+    return None
+
+
+@contextlib.contextmanager
+def empty_main():
+    # Spawned workers run the parent's __main__ script again before any
+    # job. Inside Blender that may be a --python script that needs bpy, so
+    # workers are started while __main__ is an empty module.
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def start_method():
+    # None when workers can't be started, and threads are used instead.
+    if START_METHOD is not None:
+        return START_METHOD
+    methods = multiprocessing.get_all_start_methods()
+    if PACKAGE != WORKER_PACKAGE and sys.version_info < (3, 8):
+        # Pickler.reducer_override(), which renames the package for the
+        # workers, is new in Python 3.8.
+        return None
+    if 'bpy' in sys.modules:
+        # Forking Blender copies none of its own threads.
+        if 'spawn' in methods and python_executable() is not None:
+            return 'spawn'
+        return None
+    # Fork is only known to be safe on Linux, and while no other threads
+    # could be holding locks that the child would inherit.
+    if sys.platform.startswith('linux') and threading.active_count() == 1 and 'fork' in methods:
+        return 'fork'
+    if 'spawn' in methods:
+        return 'spawn'
+    return None
+
+
+def parse_files(jobs, max_workers=None):
+    # jobs are (job type, filename, member_location(archive, filename))
+    # tuples. Returns their results in the same order, as ParsedFiles. Call
+    # its release() when done with them.
+    jobs = list(jobs)
+    max_workers = min(worker_count(max_workers), len(jobs))
+    if max_workers <= 1:
+        return ParsedFiles(parse_job(job) for job in jobs)
+    method = start_method()
+    if method is None:
+        return ParsedFiles(files.map_threads(parse_job, jobs, max_workers))
+    # Workers get the parent's sys.path, where they find the top-level
+    # package.
+    if WORKER_PATH not in sys.path:
+        sys.path.append(WORKER_PATH)
+    if 'bpy' in sys.modules:
+        multiprocessing.set_executable(python_executable())
+    context = multiprocessing.get_context(method)
+    if shared_memory is not None:
+        # Started here so the workers register their blocks with the
+        # parent's tracker, which outlives them.
+        resource_tracker.ensure_running()
+    job_data = [worker_dumps(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        if 'bpy' in sys.modules:
+            # The pool starts its processes as jobs are submitted.
+            with empty_main():
+                shared_results = pool.map(WorkerFunction(parse_shared_job), job_data)
+        else:
+            shared_results = pool.map(WorkerFunction(parse_shared_job), job_data)
+        return load_shared_results(shared_results)
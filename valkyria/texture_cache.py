@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# On-disk cache of decoded textures. Entries are keyed by a hash of the DDS
+# data itself, so a texture that's shared by several files (e.g. merge.htx
+# textures used by many maps) is decoded once, wherever it's found. Only
+# block compressed textures of some size are stored; uncompressed and small
+# ones are quicker to decode than to read back.
+#
+# The cache can be filled ahead of time for a whole game folder:
+#
+#     python -m valkyria.texture_cache warm <folder>
+
+import argparse
+import hashlib
+import os
+import struct
+import sys
+
+from . import cache
+from . import dds
+from . import files
+
+
+USE_TEXTURE_CACHE = True
+# Bump when the decoders start producing different pixels.
+TEXTURE_CACHE_VERSION = 1
+DEFAULT_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# Smaller textures aren't cached
+MIN_CACHED_PIXELS = 256 * 256
+# Files that contain textures, by extension
+TEXTURE_FILE_EXTENSIONS = ('.abr', '.hmd', '.htx', '.mlx', '.mmf')
+
+ENTRY_HEADER = struct.Struct('<4sII')
+ENTRY_MAGIC = b'VKTX'
+
+
+def max_size_from_environment():
+    # VALKYRIA_TEXTURE_CACHE_SIZE is in megabytes
+    try:
+        return int(os.environ['VALKYRIA_TEXTURE_CACHE_SIZE']) * 1024 * 1024
+    except (KeyError, ValueError):
+        return DEFAULT_MAX_SIZE
+
+
+texture_cache = cache.CacheDirectory('textures', max_size=max_size_from_environment())
+
+
+def texture_key(data, level=0):
+    digest = hashlib.sha1(data).hexdigest()
+    if level:
+        return '{}-{}-{}'.format(TEXTURE_CACHE_VERSION, digest, level)
+    return '{}-{}'.format(TEXTURE_CACHE_VERSION, digest)
+
+
+def worth_caching(header, level=0):
+    width, height = header.level_size(level)
+    return (header.format in dds.BLOCK_SIZES and dds.can_decode(header)
+        and width * height >= MIN_CACHED_PIXELS)
+
+
+def load(key):
+    # (height, width, 4) RGBA bytes, or None if the entry is missing or
+    # unusable
+    data = texture_cache.get(key)
+    if data is None or len(data) < ENTRY_HEADER.size:
+        return None
+    magic, width, height = ENTRY_HEADER.unpack_from(data)
+    if magic != ENTRY_MAGIC or len(data) != ENTRY_HEADER.size + width * height * 4:
+        return None
+    pixels = dds.numpy.frombuffer(data, dtype=dds.numpy.uint8, offset=ENTRY_HEADER.size)
+    return pixels.reshape(height, width, 4)
+
+
+def store(key, pixels):
+    height, width = pixels.shape[:2]
+    header = ENTRY_HEADER.pack(ENTRY_MAGIC, width, height)
+    return texture_cache.put(key, header + dds.numpy.ascontiguousarray(pixels).tobytes())
+
+
+def decode(data, header=None, level=0):
+    # Same as dds.decode, but block compressed textures are looked up in the
+    # cache first and stored there after decoding.
+    if header is None:
+        header = dds.read_header(data)
+    if not USE_TEXTURE_CACHE or not worth_caching(header, level):
+        return dds.decode(data, header, level)
+    key = texture_key(data, level)
+    pixels = load(key)
+    if pixels is None:
+        pixels = dds.decode(data, header, level)
+        store(key, pixels)
+    return pixels
+
+
+def warm_texture(item):
+    # Decodes and stores a (key, data) texture unless it's already cached.
+    # Returns True if it had to be decoded.
+    key, data = item
+    header = dds.read_header(data)
+    if not worth_caching(header):
+        return False
+    if os.path.exists(texture_cache.entry_path(key)):
+        return False
+    store(key, dds.decode(data, header))
+    return True
+
+
+def texture_files(folder):
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in TEXTURE_FILE_EXTENSIONS:
+                yield os.path.join(dirpath, filename)
+
+
+def file_textures(filename):
+    # The DDS data of every texture in a file, copied so it outlives the
+    # walk
+    for path, ftype, offset, length, chunk in files.iter_chunks(filename, ('DDS',)):
+        chunk.read_data()
+        yield bytes(chunk.data)
+
+
+def warm(folder, max_workers=None, log=print):
+    # Decodes every texture under folder that isn't cached yet. Textures are
+    # decoded on a pool of threads, a few at a time, so a merge.htx with
+    # thousands of them isn't held in memory at once. Returns the number of
+    # textures that were decoded.
+    if max_workers is None:
+        max_workers = files.DECODE_THREADS
+    batch_size = max(1, max_workers) * 2
+    decoded = 0
+    # Keys of the textures seen so far, so copies of a texture aren't
+    # decoded side by side
+    seen = set()
+    for filename in texture_files(folder):
+        file_decoded = 0
+        batch = []
+        try:
+            for data in file_textures(filename):
+                key = texture_key(data)
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append((key, data))
+                if len(batch) >= batch_size:
+                    file_decoded += sum(files.map_threads(warm_texture, batch, max_workers))
+                    batch = []
+            file_decoded += sum(files.map_threads(warm_texture, batch, max_workers))
+        except (OSError, NotImplementedError, ValueError, UnicodeDecodeError, struct.error) as e:
+            log("Skipping {}: {}".format(filename, e))
+            continue
+        if file_decoded:
+            log("{}: {} textures decoded".format(filename, file_decoded))
+        decoded += file_decoded
+    return decoded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m valkyria.texture_cache',
+        description="Manage the cache of decoded textures in {}.".format(texture_cache.path))
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    warm_parser = commands.add_parser('warm',
+        help="decode every texture in a game folder ahead of time")
+    warm_parser.add_argument('folder')
+    warm_parser.add_argument('--threads', type=int, default=None,
+        help="threads used to decode textures (default: {})".format(files.DECODE_THREADS))
+    commands.add_parser('clear', help="delete every cached texture")
+    args = parser.parse_args(argv)
+    if dds.numpy is None:
+        parser.error("decoding textures needs NumPy")
+    if args.command == 'warm':
+        decoded = warm(args.folder, args.threads)
+        print("{} textures decoded into {}".format(decoded, texture_cache.path))
+    elif args.command == 'clear':
+        texture_cache.clear()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())